@@ -0,0 +1,279 @@
+# -*- coding: utf8 -*-
+"""
+End to end benchmark of cache_playlists against a local stand-in for Google Play Music.
+
+A FakeMobileclient serves a synthetic playlist, and a local HTTP server serves the test MP3 and
+JPEG as the stream and album art urls, with configurable latency, bandwidth and failure rate.
+Stage latencies and counters are taken from the metrics collected by cache_playlists.
+Each playlist size is run in its own process so that peak RSS is measured separately.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --tracks 100 1000 --workers 8 --latency 0.02
+"""
+
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import mkdtemp
+
+from gpm_cache import core
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_data')
+AUDIO_PATH = os.path.join(TEST_DATA_DIR, 'file_example_MP3_700KB.mp3')
+ART_PATH = os.path.join(TEST_DATA_DIR, 'SampleJPGImage_50kbmb.jpg')
+
+PERCENTILES = (50, 90, 99)
+
+
+class FakeGPMHandler(BaseHTTPRequestHandler):
+    """Serve /stream/<trackId> and /art/<albumId>, shaped by the settings of the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        if server.random.random() < server.failure_rate:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = server.audio if self.path.startswith('/stream/') else server.art
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.write_throttled(body)
+
+    def write_throttled(self, body, chunk_size=64 * 1024):
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGPMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, audio, art, latency=0.0, bandwidth=None, failure_rate=0.0, seed=0):
+        super(FakeGPMServer, self).__init__(('127.0.0.1', 0), FakeGPMHandler)
+        self.audio = audio
+        self.art = art
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeMobileclient(object):
+    """The parts of gmusicapi's Mobileclient used by cache_playlists, backed by a synthetic library."""
+
+    def __init__(self, server_url, tracks, albums, latency=0.0):
+        self.server_url = server_url
+        self.latency = latency
+        self.playlists = [
+            {'id': 'source_id', 'name': 'Benchmark', 'lastModifiedTimestamp': '1',
+             'type': 'USER_GENERATED', 'shareToken': 'source_token'},
+        ]
+        self.entries = [self.make_entry(number, number % max(albums, 1)) for number in range(tracks)]
+        self._lock = threading.Lock()
+
+    def make_entry(self, number, album):
+        album_id = "Bbench%d" % album
+        return {
+            'id': "entry%d" % number,
+            'trackId': "Tbench%d" % number,
+            'source': '2',
+            'track': {
+                'title': "Track %d" % number,
+                'artist': "Artist %d" % (album % 97),
+                'album': "Album %d" % album,
+                'albumId': album_id,
+                'albumArtRef': [{'url': "%s/art/%s" % (self.server_url, album_id)}],
+                'trackNumber': number % 20 + 1,
+                'discNumber': 1,
+                'year': 2000 + album % 20,
+                'genre': 'Benchmark',
+            },
+        }
+
+    def request(self):
+        time.sleep(self.latency)
+
+    def get_all_playlists(self):
+        self.request()
+        return list(self.playlists)
+
+    def get_shared_playlist_contents(self, share_token):
+        self.request()
+        return self.entries if share_token == 'source_token' else []
+
+    def create_playlist(self, name):
+        self.request()
+        playlist_id = "%s_id" % name
+        with self._lock:
+            self.playlists.append({'id': playlist_id, 'name': name, 'lastModifiedTimestamp': '1'})
+        return playlist_id
+
+    def get_stream_url(self, track_id):
+        self.request()
+        return "%s/stream/%s" % (self.server_url, track_id)
+
+    def add_songs_to_playlist(self, playlist_id, track_ids):
+        self.request()
+        return list(track_ids)
+
+    def remove_entries_from_playlist(self, entry_ids):
+        self.request()
+        return list(entry_ids)
+
+
+def get_peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run(args, tracks):
+    """Cache a synthetic playlist of the given size, returning a dict of measurements."""
+    with open(AUDIO_PATH, 'rb') as audio_file:
+        audio = audio_file.read(args.audio_bytes)
+    with open(ART_PATH, 'rb') as art_file:
+        art = art_file.read()
+
+    out_dir = mkdtemp(prefix='gpm-cache-bench-')
+    try:
+        with FakeGPMServer(audio, art, args.latency, args.bandwidth, args.failure_rate) as server:
+            api = FakeMobileclient(server.url, tracks, max(tracks // args.tracks_per_album, 1),
+                                   args.api_latency)
+            parser_args = core.get_parser_args([
+                '--email', 'bench', '--device-id', 'bench', '--playlist', 'Benchmark',
+                '--playlist-cached', 'Benchmark (Cached)', '--sleep-time', '0',
+                '--workers', str(args.workers), '--download-retries', str(args.retries),
+                '--download-backoff', '0', '--flush-interval', '0',
+                '--cache-location', os.path.join(out_dir, 'cache'),
+                '--art-cache-location', os.path.join(out_dir, 'art'),
+                '--staging-location', os.path.join(out_dir, 'staging'),
+            ])
+            start = time.perf_counter()
+            summary = core.cache_playlists(api, parser_args).summary()
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    return {
+        'tracks': tracks,
+        'cached': summary['counters'].get('tracks', 0),
+        'seconds': elapsed,
+        'tracks_per_sec': summary['counters'].get('tracks', 0) / elapsed,
+        'bytes_per_sec': summary['counters'].get('bytes', 0) / elapsed,
+        'peak_rss': get_peak_rss(),
+        'stages': {
+            stage: {"p%d" % pct: latencies["p%d" % pct] for pct in PERCENTILES}
+            for stage, latencies in summary['stages'].items()
+        },
+        'counters': summary['counters'],
+    }
+
+
+def report(result):
+    print("%(tracks)d tracks: cached %(cached)d in %(seconds).2fs, %(tracks_per_sec).1f tracks/s, "
+          "%(mib_per_sec).2f MiB/s, peak RSS %(rss_mib).1f MiB" % dict(
+              result, mib_per_sec=result['bytes_per_sec'] / 2 ** 20,
+              rss_mib=result['peak_rss'] / 2 ** 20))
+    print("  %-26s" % 'stage' + "".join("%10s" % ("p%d ms" % pct) for pct in PERCENTILES))
+    for stage, latencies in result['stages'].items():
+        print("  %-26s" % stage + "".join(
+            "%10.2f" % (latencies["p%d" % pct] * 1000) for pct in PERCENTILES))
+    for counter, value in result['counters'].items():
+        print("  %-26s %d" % (counter, value))
+
+
+def get_parser():
+    parser = ArgumentParser(description="benchmark cache_playlists against a fake GPM server")
+    parser.add_argument('--tracks', help="The sizes of synthetic playlist to cache", nargs='+',
+                        type=int, default=[100, 1000])
+    parser.add_argument('--tracks-per-album', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', help="Seconds before the server responds", type=float,
+                        default=0.0)
+    parser.add_argument('--api-latency', help="Seconds taken by each Mobileclient call",
+                        type=float, default=0.0)
+    parser.add_argument('--bandwidth', help="Bytes per second of each response", type=float,
+                        default=None)
+    parser.add_argument('--failure-rate', help="Fraction of requests that fail with a 503",
+                        type=float, default=0.0)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--audio-bytes', help="The number of bytes of the test MP3 served per track",
+                        type=int, default=64 * 1024)
+    parser.add_argument('--json', help="Print results as JSON lines", action='store_true')
+    parser.add_argument('--debug-level', choices=list(core.DEBUG_LEVELS), default='error')
+    return parser
+
+
+def strip_tracks(argv):
+    """Return argv without --tracks and its values."""
+    stripped = []
+    skipping = False
+    for arg in argv:
+        if arg == '--tracks':
+            skipping = True
+        elif skipping and arg.isdigit():
+            continue
+        else:
+            skipping = False
+            stripped.append(arg)
+    return stripped
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=core.DEBUG_LEVELS[args.debug_level])
+    if len(args.tracks) == 1:
+        results = [run(args, args.tracks[0])]
+    else:
+        results = []
+        for tracks in args.tracks:
+            # Run each size in its own process, so that its peak RSS is not inherited.
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.bench_pipeline', '--json', '--tracks',
+                 str(tracks)] + strip_tracks(argv))
+            results.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+"""
+Micro-benchmark of the filename sanitation helpers against their previous implementation.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sanitation
+"""
+
+import re
+import timeit
+
+from six import binary_type, iterbytes, text_type, unichr
+
+from gpm_cache.sanitation_helper import FILENAME_KEEP_CHARS, _to_safe_filename, to_safe_filename, to_safe_print
+
+INPUTS = [
+    u"hellö#my~baby",
+    u"Sigur Rós",
+    u"Ágætis byrjun",
+    u"Björk - Vespertine (Deluxe Edition) ",
+    u"坂本龍一 / Ryuichi Sakamoto",
+    u"Mötley Crüe",
+    u"Beyoncé",
+    b"\x80abc",
+    u"Sigur Rós - Ágætis byrjun".encode("utf-8"),
+    (b"\x80abc", u"\x80s"),
+]
+
+NUMBER = 2000
+
+
+def legacy_to_safe_print(thing, errors='backslashreplace'):
+    if isinstance(thing, binary_type):
+        thing = u"".join([(unichr(c) if (c in range(0x7f)) else "\\x%02x" % (c, ))
+                          for c in iterbytes(thing)])
+    elif not isinstance(thing, text_type):
+        thing = text_type(thing)
+    return thing.encode('ascii', errors=errors).decode('ascii')
+
+
+def legacy_to_safe_filename(thing):
+    thing = legacy_to_safe_print(thing, errors='ignore')
+    re_keep_characters = "[%s]" % ("A-Za-z0-9" + re.escape("".join(FILENAME_KEEP_CHARS)))
+    return "".join(c for c in thing if re.match(re_keep_characters, c)).rstrip()
+
+
+def uncached_to_safe_filename(thing):
+    if not isinstance(thing, (binary_type, text_type)):
+        thing = text_type(thing)
+    return _to_safe_filename.__wrapped__(thing)
+
+
+def bench(func):
+    return min(timeit.repeat(lambda: [func(thing) for thing in INPUTS], number=NUMBER, repeat=3))
+
+
+def main():
+    for thing in INPUTS:
+        assert to_safe_print(thing) == legacy_to_safe_print(thing), thing
+        assert to_safe_filename(thing) == legacy_to_safe_filename(thing), thing
+
+    results = [
+        ('to_safe_print', bench(legacy_to_safe_print), bench(to_safe_print)),
+        ('to_safe_filename (uncached)', bench(legacy_to_safe_filename), bench(uncached_to_safe_filename)),
+        ('to_safe_filename', bench(legacy_to_safe_filename), bench(to_safe_filename)),
+    ]
+    print("%-28s %12s %12s %8s" % ('helper', 'legacy (s)', 'current (s)', 'speedup'))
+    for name, legacy, current in results:
+        print("%-28s %12.4f %12.4f %7.1fx" % (name, legacy, current, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
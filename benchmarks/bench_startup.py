@@ -0,0 +1,62 @@
+# -*- coding: utf8 -*-
+"""
+Cold start latency of the gpm_cache CLI on the paths which do not need to log in, and on a real run.
+
+Each case is run in a fresh interpreter. The real run case only makes the imports that a run makes
+before logging in, since logging in needs the network.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup
+"""
+
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+
+CLI = [sys.executable, '-m', 'gpm_cache.core']
+
+
+def get_cases(cache_location):
+    return [
+        ('interpreter', [sys.executable, '-c', 'pass']),
+        ('--help', CLI + ['--help']),
+        ('argument error', CLI),
+        ('--rebuild-views', CLI + ['--email', 'bench', '--device-id', 'bench', '--rebuild-views',
+                                   '--cache-location', cache_location]),
+        ('real run imports', [sys.executable, '-c',
+                              'import gpm_cache.core, gpm_cache.session, gmusicapi']),
+    ]
+
+
+def measure(command, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="measure cold start latency of the gpm_cache CLI")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    cache_location = mkdtemp(prefix='gpm-cache-bench-')
+    try:
+        print("%-20s %10s %10s" % ('path', 'min ms', 'median ms'))
+        for name, command in get_cases(cache_location):
+            timings = measure(command, args.repeat)
+            print("%-20s %10.1f %10.1f" % (name, min(timings) * 1000,
+                                           statistics.median(timings) * 1000))
+    finally:
+        shutil.rmtree(cache_location, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
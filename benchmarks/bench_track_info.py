@@ -0,0 +1,59 @@
+# -*- coding: utf8 -*-
+"""
+Micro-benchmark of the memory held by TrackInfo for a large playlist, compared to the GPM track dicts.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_track_info
+"""
+
+import copy
+import json
+import os
+import tracemalloc
+
+from gpm_cache.track_info import TrackInfo
+
+TRACK_INFO_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_data', 'track_info.json')
+
+ENTRIES = 50000
+
+
+def load_track_dicts():
+    with open(TRACK_INFO_PATH) as json_fp:
+        track_info = json.load(json_fp)
+    track_dicts = []
+    for number in range(ENTRIES):
+        track = copy.deepcopy(track_info)
+        track['title'] = "%s %d" % (track['title'], number)
+        track['albumId'] = "B%d" % number
+        track_dicts.append(track)
+    return track_dicts
+
+
+def load_track_infos():
+    """Build a TrackInfo for each track dict, then let the track dicts be dropped."""
+    return [TrackInfo("T%d" % number, track) for number, track in enumerate(load_track_dicts())]
+
+
+def measure(build):
+    """Return the memory still held by the result of build once it returns."""
+    tracemalloc.start()
+    held = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size
+
+
+def main():
+    dicts_size = measure(load_track_dicts)
+    infos_size = measure(load_track_infos)
+    print("%d entries" % ENTRIES)
+    print("%-16s %10.1f MiB" % ('track dicts', dicts_size / 2 ** 20))
+    print("%-16s %10.1f MiB" % ('TrackInfo', infos_size / 2 ** 20))
+    print("%-16s %10.1f%%" % ('ratio', 100.0 * infos_size / dicts_size))
+
+
+if __name__ == '__main__':
+    main()
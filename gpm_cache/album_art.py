@@ -0,0 +1,106 @@
+"""
+Store of album covers cached on disk.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+from .store import makedirs
+
+ART_EXTENSION = '.jpg'
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class AlbumArtStore(object):
+    """
+    Index of the covers in an art cache location, keyed by albumId.
+
+    Covers are kept in subdirectories named after a hash of the albumId so that no one directory
+    holds every cover. The location is only scanned once, when the store is created, and covers
+    which are fetched concurrently for the same album are only downloaded once. A cover which
+    another process has cached since the location was scanned is used rather than downloaded again.
+    Albums whose cover could not be fetched are remembered, so the other tracks of the album do not
+    try again.
+    """
+
+    def __init__(self, cache_location):
+        self.cache_location = os.path.expanduser(cache_location)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._failed = set()
+        self._index = self.load_index()
+
+    def load_index(self):
+        """Scan the cache location for covers, including those from before it was sharded."""
+        index = {}
+        os.makedirs(self.cache_location, exist_ok=True)
+        for dirpath, _, filenames in os.walk(self.cache_location):
+            for filename in filenames:
+                if filename.endswith(ART_EXTENSION):
+                    index[filename[:-len(ART_EXTENSION)]] = os.path.join(dirpath, filename)
+        logging.debug("found %d covers in %s", len(index), self.cache_location)
+        return index
+
+    def get_filepath(self, album_id):
+        """Determine where the cover for album_id should be stored."""
+        shard = hashlib.md5(album_id.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.cache_location, shard, "%s%s" % (album_id, ART_EXTENSION))
+
+    def get(self, album_id):
+        """Return the path of the cover for album_id if it has been cached."""
+        with self._lock:
+            return self._index.get(album_id)
+
+    def fetch(self, album_id, download):
+        """
+        Return the path of the cover for album_id, calling download(filepath) if it is missing.
+
+        If another thread is already fetching the cover, wait for it instead. Return None if
+        fetching the cover has already failed during this run.
+        """
+        with self._lock:
+            if album_id in self._index:
+                return self._index[album_id]
+            if album_id in self._failed:
+                return None
+            in_flight = self._in_flight.get(album_id)
+            owner = in_flight is None
+            if owner:
+                in_flight = self._in_flight[album_id] = Future()
+
+        if not owner:
+            return in_flight.result()
+        return self._download(album_id, in_flight, download)
+
+    def _download(self, album_id, in_flight, download):
+        album_filepath = self.get_filepath(album_id)
+        try:
+            makedirs(os.path.dirname(album_filepath))
+            if not os.path.exists(album_filepath):
+                download(album_filepath)
+        except BaseException as exc:
+            with self._lock:
+                del self._in_flight[album_id]
+                if isinstance(exc, Exception):
+                    self._failed.add(album_id)
+            in_flight.set_exception(exc)
+            raise
+        with self._lock:
+            del self._in_flight[album_id]
+            self._index[album_id] = album_filepath
+        in_flight.set_result(album_filepath)
+        return album_filepath
+
+
+def get_album_art_store(cache_location):
+    """Return the store for cache_location, which is only created once per process."""
+    cache_location = os.path.expanduser(cache_location)
+    with _STORES_LOCK:
+        if cache_location not in _STORES:
+            _STORES[cache_location] = AlbumArtStore(cache_location)
+        return _STORES[cache_location]
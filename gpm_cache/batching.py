@@ -0,0 +1,206 @@
+"""
+Batching of playlist mutations, so that many tracks are changed with each request.
+"""
+
+import logging
+import threading
+import traceback
+from functools import partial
+
+from .rate_limit import MUTATION
+
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 30.0
+
+
+class MutationBatcher(object):
+    """
+    Accumulate items from any thread and pass them to flush_fn in batches.
+
+    A batch is flushed once it holds batch_size items, or once flush_interval seconds have passed
+    with items waiting. Items which flush_fn succeeds with are passed to on_flushed, and items which
+    it fails with are kept in `failed`. Call close, or use as a context manager, to flush whatever is
+    left.
+    """
+
+    def __init__(self, flush_fn, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 rate_limiter=None, on_flushed=None, name='mutation'):
+        self.flush_fn = flush_fn
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.rate_limiter = rate_limiter
+        self.on_flushed = on_flushed
+        self.name = name
+        self.flushed = []
+        self.failed = []
+        self._items = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._timer = None
+        if flush_interval:
+            self._timer = threading.Thread(target=self._flush_periodically, name=name)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, item):
+        """Queue an item, flushing the queue if it makes a full batch."""
+        with self._lock:
+            self._items.append(item)
+            full = len(self._items) >= self.batch_size
+        if full:
+            self.flush()
+
+    def extend(self, items):
+        """Queue several items."""
+        for item in items:
+            self.add(item)
+
+    def flush(self):
+        """Pass every queued item to flush_fn, one batch at a time."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._items[:self.batch_size]
+                    self._items = self._items[self.batch_size:]
+                if not batch:
+                    return
+                self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        if self.rate_limiter:
+            self.rate_limiter.wait(MUTATION)
+        try:
+            response = self.flush_fn(batch)
+        except Exception:
+            logging.warning("\n\n!!! failed to flush %d %s items, exception: %s",
+                            len(batch), self.name, traceback.format_exc())
+            self.failed.extend(batch)
+            return
+        logging.info("flushed %d %s items. response: %s", len(batch), self.name, repr(response))
+        self.flushed.extend(batch)
+        if self.on_flushed:
+            self.on_flushed(batch)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the periodic flush and flush any remaining items."""
+        self._closed.set()
+        if self._timer:
+            self._timer.join()
+        self.flush()
+
+
+class PlaylistMutations(object):
+    """
+    Add cached tracks to their cached playlists, and then remove them from their source playlists.
+
+    Each cached playlist has its own batcher of additions. Once an addition has been flushed, the
+    source entries are queued on a single batcher of removals if clear_source is set. Each track is
+    only queued to be added to a playlist once, and any other entries of the track wait for that
+    addition before they are removed.
+    """
+
+    def __init__(self, api, clear_source=False, **batcher_args):
+        self.api = api
+        self.batcher_args = batcher_args
+        self.remove_batcher = None
+        if clear_source:
+            self.remove_batcher = MutationBatcher(self.remove_entries, name='remove', **batcher_args)
+        self.add_batchers = {}
+        self.playlist_track_ids = {}
+        # (playlist id, trackId) of each queued addition, to the other entries waiting for it
+        self.waiting = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_entries(self, playlist_info, entries):
+        """Add the tracks of the given entries to the end of a playlist, once each."""
+        track_ids = list(dict.fromkeys(entry['trackId'] for entry in entries))
+        return self.api.add_songs_to_playlist(playlist_info['id'], track_ids)
+
+    def remove_entries(self, entries):
+        """Remove the given entries from their playlists."""
+        return self.api.remove_entries_from_playlist([entry['id'] for entry in entries])
+
+    def get_add_batcher(self, playlist_info):
+        if playlist_info['id'] not in self.add_batchers:
+            self.playlist_track_ids[playlist_info['id']] = {
+                entry['trackId'] for entry in playlist_info.get('tracks', [])
+            }
+            self.add_batchers[playlist_info['id']] = MutationBatcher(
+                partial(self.add_entries, playlist_info), name='add',
+                on_flushed=partial(self.on_added, playlist_info['id']), **self.batcher_args)
+        return self.add_batchers[playlist_info['id']]
+
+    def on_added(self, playlist_id, entries):
+        with self._lock:
+            waiting = [
+                waiting_entry for entry in entries
+                for waiting_entry in self.waiting.pop((playlist_id, entry['trackId']), [])
+            ]
+        if self.remove_batcher:
+            self.remove_batcher.extend(entries + waiting)
+
+    def track_cached(self, entry, cached_playlist=None):
+        """
+        Queue the mutations for a source entry whose track has been cached.
+
+        Tracks already in the cached playlist are not added again, only removed from the source,
+        once any addition of the track which is still queued has been flushed.
+        """
+        if not cached_playlist:
+            return
+        add_batcher = self.get_add_batcher(cached_playlist)
+        key = (cached_playlist['id'], entry['trackId'])
+        with self._lock:
+            track_ids = self.playlist_track_ids[cached_playlist['id']]
+            queue_add = entry['trackId'] not in track_ids
+            if queue_add:
+                track_ids.add(entry['trackId'])
+                self.waiting[key] = []
+            elif key in self.waiting:
+                self.waiting[key].append(entry)
+                return
+        if queue_add:
+            add_batcher.add(entry)
+        elif self.remove_batcher:
+            self.remove_batcher.add(entry)
+
+    @property
+    def batchers(self):
+        """Every batcher, with the additions before the removals that they feed."""
+        batchers = list(self.add_batchers.values())
+        if self.remove_batcher:
+            batchers.append(self.remove_batcher)
+        return batchers
+
+    def changed(self):
+        """Return whether any playlist may have been changed."""
+        return any(batcher.flushed or batcher.failed for batcher in self.batchers)
+
+    @property
+    def failed(self):
+        """Entries which failed to be added or removed, including those waiting on a failed add."""
+        with self._lock:
+            waiting = [entry for entries in self.waiting.values() for entry in entries]
+        return [entry for batcher in self.batchers for entry in batcher.failed] + waiting
+
+    def close(self):
+        """Flush every addition, and then every removal."""
+        for batcher in self.batchers:
+            batcher.close()
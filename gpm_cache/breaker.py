@@ -0,0 +1,126 @@
+"""
+Adaptive backoff and a circuit breaker around requests which fail in bursts, shared between workers.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from .exceptions import CircuitOpenException
+
+THRESHOLD = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+COOLDOWN = 300.0
+TRIPS = 3
+# How often calls waiting on a probe check whether it has finished.
+PROBE_POLL = 0.1
+
+
+class CircuitBreaker(object):
+    """
+    Slow down every worker after a failure, and pause or abort the run when failures keep coming.
+
+    Each consecutive failure doubles the delay before the next call from any worker, starting at
+    backoff_base and capped at backoff_max, with full jitter so workers do not retry in lockstep.
+    After `threshold` consecutive failures the breaker trips, and calls wait for `cooldown` seconds
+    before a single call is let through to probe. Calls which were already in flight when the
+    breaker tripped are still counted as failures, but only the probe can close the breaker or trip
+    it again. Once it has tripped more than `trips` times in a row, without a probe succeeding in
+    between, the run is aborted, and every call raises CircuitOpenException. A success resets the
+    backoff, and a probe which succeeds resets the count of trips.
+    """
+
+    def __init__(self, threshold=THRESHOLD, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 cooldown=COOLDOWN, trips=TRIPS, clock=time.monotonic, sleep=time.sleep,
+                 jitter=random.random):
+        self.threshold = max(threshold, 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cooldown = cooldown
+        self.trips = trips
+        self.clock = clock
+        self.sleep = sleep
+        self.jitter = jitter
+        self.failures = 0
+        self.tripped = 0
+        self.aborted = False
+        self._not_before = None
+        self._half_open = False
+        # the thread making the probe, if one is being made
+        self._probe = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_parser_args(cls, parser_args):
+        return cls(parser_args.breaker_threshold, parser_args.backoff_base, parser_args.backoff_max,
+                   parser_args.breaker_cooldown, parser_args.breaker_trips)
+
+    def before_call(self):
+        """Block until a call is allowed, raising CircuitOpenException if the run was aborted."""
+        while True:
+            with self._lock:
+                delay = self._get_delay()
+            if delay <= 0:
+                return
+            self.sleep(delay)
+
+    def _get_delay(self):
+        if self.aborted:
+            raise CircuitOpenException("aborted after %d consecutive failures, tripped %d times"
+                                       % (self.failures, self.tripped))
+        if self._probe == threading.get_ident():
+            return 0
+        delay = self._not_before - self.clock() if self._not_before is not None else 0
+        if delay <= 0 and self._probe is not None:
+            # wait for the call probing a tripped breaker to succeed or fail
+            return PROBE_POLL
+        if delay <= 0 and self._half_open:
+            self._half_open = False
+            self._probe = threading.get_ident()
+        return delay
+
+    def is_open(self):
+        return self._half_open or self._probe is not None
+
+    def record_success(self):
+        """Reset the backoff after a call succeeded, unless it was in flight when the breaker tripped."""
+        with self._lock:
+            probed = self._probe == threading.get_ident()
+            if self.is_open() and not probed:
+                return
+            if probed:
+                self.tripped = 0
+            self.failures = 0
+            self._not_before = None
+            self._probe = None
+
+    def record_failure(self):
+        """Back off after a failed call, tripping the breaker if failures have kept coming."""
+        with self._lock:
+            self.failures += 1
+            now = self.clock()
+            if self._probe == threading.get_ident():
+                self._probe = None
+                self._trip()
+                return
+            if self.is_open():
+                # only the probe trips a breaker which has already tripped
+                return
+            if self.failures >= self.threshold:
+                self._trip()
+                return
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+            self._not_before = max(self._not_before or now, now + delay * self.jitter())
+
+    def _trip(self):
+        self.tripped += 1
+        if self.tripped > self.trips:
+            self.aborted = True
+            logging.error("aborting, %d consecutive failures after the breaker tripped %d times",
+                          self.failures, self.tripped - 1)
+            return
+        logging.warning("%d consecutive failures, pausing for %.0fs", self.failures, self.cooldown)
+        self._not_before = self.clock() + self.cooldown
+        self._half_open = True
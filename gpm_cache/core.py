@@ -4,26 +4,31 @@ Cache information about a GPM playlist using gmusicapi.
 
 from __future__ import absolute_import
 
+import errno
+import json
 import logging
 import os
 import shutil
 import sys
-import time
 import traceback
 from argparse import ArgumentParser
-from tempfile import mkstemp
-
-import gmusicapi
-import mutagen
-import requests
-from gmusicapi import Mobileclient
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3, APIC
-from six import b, binary_type, iterbytes, text_type, u, unichr  # noqa: W0611
-from pprint import pformat
-
-from .exceptions import BadLoginException, GetStreamURLException
-from .library import Library
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import batching, breaker, download, shard
+from .album_art import get_album_art_store
+from .batching import PlaylistMutations
+from .breaker import CircuitBreaker
+from .download import POOL_SIZE, TIMEOUT, write_stream_to_disk
+from .exceptions import BadLoginException, GetStreamURLException, PlaylistNotFoundException
+from .journal import DOWNLOADED, JOURNAL_FILENAME, MOVED, RECORDED, URL_FETCHED, RunJournal
+from .library import SNAPSHOT_FILENAME, Library
+from .manifest import Manifest
+from .metrics import Metrics, write_atomic
+from .progress import INTERVAL, Progress, ProgressReporter, parse_udp_address
+from .rate_limit import ART, STREAM, RateLimiter
+from .shard import ClaimStore, ShardResults, merge_shards, parse_shard, shard_of, write_summary
+from .store import TrackStore, fsync_path, makedirs
+from .tagging import TAG_VERSION, build_id3, get_padding, load_id3, read_album_art, render_id3
 from .sanitation_helper import to_safe_filename, to_safe_print
 from .track_info import TrackInfo
 
@@ -35,44 +40,208 @@ DEBUG_LEVELS = {
     'critical': logging.CRITICAL
 }
 
+DEFAULT_CACHE_HEIRARCHY = 'artist_album'
+
+STAGING_DIRNAME = '.staging'
+STAGING_SUFFIX = '.part.mp3'
+
 
-# pprint(EasyID3.valid_keys.keys())
 def get_parser_args(argv=None):
     """Parse arguments from cli, env and config files."""
     argv = sys.argv[1:] if argv is None else argv
 
     parser = ArgumentParser(description="cache information about a playlist from Google Play Music",
                             fromfile_prefix_chars="@")
-    parser.add_argument('--email', help="The Google Authentication email", required=True)
+    parser.add_argument('--email',
+                        help="The Google Authentication email. Required unless --rebuild-views is given")
     parser.add_argument('--pwd', help="The Google Authentication password")
     parser.add_argument('--device-id',
                         help=("The Device ID used to log in "
-                              "(Use a GSF ID that has already been registered with GPM)"),
-                        required=True)
+                              "(Use a GSF ID that has already been registered with GPM). "
+                              "Required unless --rebuild-views is given"))
     parser.add_argument('--playlist',
-                        help="The name of the GPM playlist to cache info from",
-                        required=True)
+                        help=("The name of the GPM playlist to cache info from. "
+                              "Repeat to cache several playlists in one run"),
+                        action='append')
     parser.add_argument('--playlist-cached',
-                        help="The name of the GPM playlist to add cached songs to.",
+                        help=("The name of the GPM playlist to add cached songs to. If repeated, "
+                              "each is paired with the --playlist in the same position"),
+                        action='append')
+    parser.add_argument('--playlist-config',
+                        help=("A JSON file containing a list of playlists to cache, each an object "
+                              "with a 'playlist' and optional 'playlist_cached' name"),
                         default=None)
     parser.add_argument('--clear-playlist',
                         help=("Clear the source playlist once all files have been saved to the "
                               "cached playlist."),
                         default=True)
     parser.add_argument('--sleep-time',
-                        help="Time to sleep in between requests",
+                        help=("Time to sleep in between requests. "
+                              "Deprecated, used as 1 / --rate-limit when that is not given"),
                         default=10,
                         type=float)
+    parser.add_argument('--rate-limit',
+                        help=("The maximum number of requests per second made to each class of "
+                              "endpoint (stream urls, playlist mutations and album art)"),
+                        default=None,
+                        type=float)
+    parser.add_argument('--rate-burst',
+                        help="The number of requests to each class of endpoint that may be made at once",
+                        default=1,
+                        type=int)
+    parser.add_argument('--batch-size',
+                        help="The maximum number of tracks added to or removed from a playlist at once",
+                        default=batching.BATCH_SIZE,
+                        type=int)
+    parser.add_argument('--flush-interval',
+                        help=("The number of seconds after which tracks waiting to be added to or "
+                              "removed from a playlist are sent, even if the batch is not full"),
+                        default=batching.FLUSH_INTERVAL,
+                        type=float)
+    parser.add_argument('--workers',
+                        help=("The number of tracks to download concurrently. Requests are still "
+                              "limited by --rate-limit across all workers"),
+                        default=1,
+                        type=int)
+    parser.add_argument('--breaker-threshold',
+                        help=("The number of consecutive failures to get a stream url after which "
+                              "every worker pauses for --breaker-cooldown seconds"),
+                        default=breaker.THRESHOLD,
+                        type=int)
+    parser.add_argument('--breaker-cooldown',
+                        help="The number of seconds to pause for once --breaker-threshold is reached",
+                        default=breaker.COOLDOWN,
+                        type=float)
+    parser.add_argument('--breaker-trips',
+                        help="The number of pauses after which the run is aborted if failures continue",
+                        default=breaker.TRIPS,
+                        type=int)
+    parser.add_argument('--backoff-base',
+                        help=("The number of seconds to back off for after a failure to get a stream "
+                              "url, doubled after each consecutive failure, with jitter"),
+                        default=breaker.BACKOFF_BASE,
+                        type=float)
+    parser.add_argument('--backoff-max',
+                        help="The maximum number of seconds to back off for between failures",
+                        default=breaker.BACKOFF_MAX,
+                        type=float)
+    parser.add_argument('--requeue-rounds',
+                        help=("The number of times tracks which failed are queued again, once the "
+                              "other tracks have been tried"),
+                        default=1,
+                        type=int)
     parser.add_argument('--cache-location',
                         help="The location to store cached tracks",
                         default=os.path.join(os.path.expanduser("~"), "gpm-cache"))
+    parser.add_argument('--manifest',
+                        help=("The location of the manifest of cached tracks, used to skip tracks "
+                              "which are already cached. Defaults to a file in --cache-location"),
+                        default=None)
+    parser.add_argument('--staging-location',
+                        help=("The location to keep partially downloaded tracks, so that interrupted "
+                              "downloads can be resumed. Defaults to a directory in --cache-location, "
+                              "so that finished tracks are renamed into the store rather than copied"),
+                        default=None)
+    parser.add_argument('--staging-max-bytes',
+                        help=("The number of bytes of partial downloads kept between runs. The oldest "
+                              "are removed when a run starts until the rest fit"),
+                        default=None,
+                        type=int)
+    parser.add_argument('--journal',
+                        help=("The location of the journal of the stage each track has reached, "
+                              "used to resume a run which crashed. Defaults to a file in "
+                              "--cache-location"),
+                        default=None)
+    parser.add_argument('--chunk-size',
+                        help="The size in bytes of each chunk read from a download stream",
+                        default=download.CHUNK_SIZE,
+                        type=int)
+    parser.add_argument('--download-retries',
+                        help="The number of times a failed download is resumed before giving up",
+                        default=download.RETRIES,
+                        type=int)
+    parser.add_argument('--download-backoff',
+                        help=("The number of seconds to wait before resuming a failed download, "
+                              "doubled after each attempt"),
+                        default=download.BACKOFF,
+                        type=float)
+    parser.add_argument('--pool-size',
+                        help=("The number of connections kept open for each host. "
+                              "Defaults to twice --workers, and at least %d" % POOL_SIZE),
+                        default=None,
+                        type=int)
+    parser.add_argument('--timeout',
+                        help="The number of seconds to wait for a response from a download server",
+                        default=TIMEOUT,
+                        type=float)
+    parser.add_argument('--no-keep-alive',
+                        help="Close connections to download servers after each fetch",
+                        action='store_true')
+    parser.add_argument('--library-snapshot',
+                        help=("The location of the snapshot of playlist entries, used to skip "
+                              "fetching playlists which have not been modified. "
+                              "Defaults to a file in --cache-location"),
+                        default=None)
     parser.add_argument('--art-cache-location',
                         help="The location to store cached album art",
                         default=os.path.join(os.path.expanduser("~"), "gpm-cache", "album-art"))
     parser.add_argument('--cache-heirarchy',
-                        help="The structure in which the output files are organised",
+                        help=("The structure in which the output files are organised. Repeat to "
+                              "build several structures, which all link to one copy of each track. "
+                              "Defaults to %s" % DEFAULT_CACHE_HEIRARCHY),
                         choices=['artist_album', 'flat'],
-                        default='artist_album')
+                        action='append')
+    parser.add_argument('--rebuild-views',
+                        help=("Rebuild the structures given by --cache-heirarchy from the tracks "
+                              "which are already cached, without logging in, and exit"),
+                        action='store_true')
+    parser.add_argument('--metrics-json',
+                        help=("A file to write a JSON summary of the time taken by each stage of "
+                              "caching tracks, and counters such as bytes and failures, to"),
+                        default=None)
+    parser.add_argument('--metrics-prometheus',
+                        help=("A file to write the same metrics to in the Prometheus text format, "
+                              "such as a file read by the node exporter's textfile collector"),
+                        default=None)
+    parser.add_argument('--progress-interval',
+                        help=("The number of seconds between progress reports, shown on the "
+                              "terminal and written to --progress-file and --progress-udp"),
+                        default=INTERVAL,
+                        type=float)
+    parser.add_argument('--progress-file',
+                        help="A file to write the progress of the run to as JSON, replaced each report",
+                        default=None)
+    parser.add_argument('--progress-udp',
+                        help="A HOST:PORT to send the progress of the run to as JSON datagrams",
+                        default=None,
+                        type=parse_udp_address)
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument('--shard',
+                          help=("Only cache the tracks which hash to shard INDEX of COUNT, written as "
+                                "INDEX/COUNT and counting from 0, so several hosts sharing "
+                                "--cache-location can split a run. Playlists are left unchanged "
+                                "until a run with --merge-shards"),
+                          default=None,
+                          type=parse_shard)
+    sharding.add_argument('--merge-shards',
+                          help=("Merge what each of the given number of shards cached into the "
+                                "manifest, then cache any tracks that are left and change the "
+                                "playlists as a single run would"),
+                          default=None,
+                          type=int)
+    parser.add_argument('--claim-ttl',
+                        help=("The number of seconds after which a shard's claim on a track may be "
+                              "broken by another shard"),
+                        default=shard.CLAIM_TTL,
+                        type=float)
+    parser.add_argument('--plan', '--dry-run',
+                        help=("Work out what would be cached without downloading anything or "
+                              "changing any playlists, and write the plan as JSON to the given file, "
+                              "or to stdout"),
+                        dest='plan',
+                        nargs='?',
+                        const='-',
+                        default=None)
     parser.add_argument('--debug-level',
                         help="The level above which debug statements are printed",
                         choices=list(DEBUG_LEVELS.keys()),
@@ -89,34 +258,54 @@ def get_parser_args(argv=None):
 
     parser_args = parser.parse_args(argv)
 
+    if not parser_args.cache_heirarchy:
+        parser_args.cache_heirarchy = [DEFAULT_CACHE_HEIRARCHY]
+    if parser_args.staging_location is None:
+        parser_args.staging_location = get_default_staging_location(parser_args)
+    if not (parser_args.email and parser_args.device_id or parser_args.rebuild_views):
+        parser.error("the arguments --email and --device-id are required to log in")
+    if not (parser_args.playlist or parser_args.playlist_config or parser_args.rebuild_views):
+        parser.error("one of the arguments --playlist --playlist-config is required")
+    if len(parser_args.playlist_cached or []) not in (0, 1, len(parser_args.playlist or [])):
+        parser.error("argument --playlist-cached must be given once, or once for each --playlist")
+
     return parser_args
 
 
-def save_meta(local_filepath, track_info=None, album_art_path=None):
-    """Save meta associated with track to the given file."""
-    try:
-        meta = EasyID3(local_filepath)
-    except mutagen.id3.ID3NoHeaderError:
-        meta = mutagen.File(local_filepath, easy=True)
-        meta.add_tags()
+def get_default_staging_location(parser_args):
+    """Return the staging location in the cache location, one for each shard."""
+    staging_location = os.path.join(parser_args.cache_location, STAGING_DIRNAME)
+    if parser_args.shard:
+        staging_location = os.path.join(staging_location, shard.get_shard_name(*parser_args.shard))
+    return staging_location
 
-    for meta_key, meta_val in track_info.id3_meta.items():
-        meta[meta_key] = meta_val
 
-    meta.save()
+def get_playlist_mappings(parser_args):
+    """Return the pairs of source and cached playlist names to cache, in order."""
+    mappings = []
+    if parser_args.playlist_config:
+        with open(os.path.expanduser(parser_args.playlist_config)) as config_file:
+            for mapping in json.load(config_file):
+                mappings.append((mapping['playlist'], mapping.get('playlist_cached')))
 
-    meta = ID3(local_filepath)
+    source_names = parser_args.playlist or []
+    cached_names = parser_args.playlist_cached or [None]
+    if len(cached_names) == 1:
+        cached_names = cached_names * len(source_names)
+    mappings.extend(zip(source_names, cached_names))
+    return mappings
 
-    if album_art_path:
-        with open(album_art_path, 'rb') as albumart:
-            meta['APIC'] = APIC(
-                encoding=3,
-                mime='image/jpeg',
-                type=3, desc=u'Cover',
-                data=albumart.read()
-            )
 
-    meta.save()
+def save_meta(local_filepath, track_info=None, album_art_path=None):
+    """
+    Save meta associated with track to the given file.
+
+    All of the tags are built in memory and written in one pass, leaving padding so that later
+    changes to the tags do not have to rewrite the audio.
+    """
+    album_art = read_album_art(album_art_path) if album_art_path else None
+    meta = build_id3(track_info, album_art, load_id3(local_filepath))
+    meta.save(local_filepath, padding=get_padding)
 
     logging.info("saved meta for %s", local_filepath)
 
@@ -149,156 +338,768 @@ def get_local_filepath(cache_location, cache_heirarchy, track_info=None):
     return local_filepath
 
 
-def maybe_download_album_art(info_obj, cache_location):
-    if not os.path.exists(cache_location):
-        os.makedirs(cache_location)
+def maybe_download_album_art(info_obj, cache_location, rate_limiter=None, session=None,
+                             on_retry=None, chunk_size=download.CHUNK_SIZE,
+                             retries=download.RETRIES, backoff=download.BACKOFF):
+    """
+    Return the path of the cover for a track's album, downloading it if it is not cached.
 
-    try:
-        album_id = info_obj.track_info['albumId']
-    except KeyError:
+    The cover is downloaded in chunks of chunk_size, resumed up to retries times with a backoff
+    starting at backoff seconds. Return None if the track has no album art, or if its album's cover
+    has already failed to download.
+    """
+    album_id = info_obj.album_id
+    if album_id is None:
         logging.info(f"no art found for {info_obj}")
         return None
-    album_filename = f"{album_id}.jpg"
-    album_filepath = os.path.join(cache_location, album_filename)
 
-    if album_filename in os.listdir(cache_location):
+    art_store = get_album_art_store(cache_location)
+    album_filepath = art_store.get(album_id)
+    if album_filepath:
         return album_filepath
 
-    try:
-        art_url = info_obj.track_info['albumArtRef'][0]['url']
-    except IndexError:
-        logging.info(f"no art found for {info_obj.track_info}")
+    art_url = info_obj.album_art_url
+    if art_url is None:
+        logging.info(f"no art found for {info_obj}")
         return None
 
-    write_stream_to_disk(art_url, album_filepath)
-    return album_filepath
+    def download(album_filepath):
+        if rate_limiter:
+            rate_limiter.wait(ART)
+        download_cover(art_url, album_filepath, chunk_size=chunk_size, retries=retries,
+                       backoff=backoff, session=session, on_retry=on_retry)
+
+    return art_store.fetch(album_id, download)
+
+
+def download_cover(art_url, album_filepath, **download_args):
+    """
+    Download a cover to album_filepath, through a partial file which is renamed into place.
+
+    Each process downloads to a partial file of its own, since shards share the art cache location
+    and may fetch the same cover at once. The partial file is removed if the download fails.
+    """
+    partial_filepath = "%s.%d.part" % (album_filepath, os.getpid())
+    try:
+        write_stream_to_disk(art_url, partial_filepath, **download_args)
+        os.replace(partial_filepath, album_filepath)
+    except BaseException:
+        if os.path.exists(partial_filepath):
+            os.remove(partial_filepath)
+        raise
+
+
+def get_staging_filepath(staging_location, track_info):
+    """Determine where the partial download of a track is kept."""
+    staging_dir = makedirs(os.path.expanduser(staging_location))
+    return os.path.join(staging_dir, "%s%s" % (to_safe_filename(track_info.track_id), STAGING_SUFFIX))
 
 
-def write_stream_to_disk(stream_url, filename):
-    req = requests.get(stream_url, stream=True)
+def clean_staging(staging_location, manifest):
+    """
+    Remove partial downloads of tracks which are already in the manifest, left by a crashed run.
+
+    Return the number of files removed.
+    """
+    staging_dir = os.path.expanduser(staging_location)
+    try:
+        staged = {filename for filename in os.listdir(staging_dir) if filename.endswith(STAGING_SUFFIX)}
+    except OSError:
+        return 0
+    removed = 0
+    for record in manifest.iter_records() if staged else []:
+        filename = "%s%s" % (to_safe_filename(record['track_id']), STAGING_SUFFIX)
+        if filename in staged:
+            logging.info("removing stale partial download %s", to_safe_print(filename))
+            os.remove(os.path.join(staging_dir, filename))
+            removed += 1
+    return removed
+
+
+def prune_staging(staging_location, max_bytes):
+    """
+    Remove the oldest partial downloads until those left take up at most max_bytes.
 
-    with open(filename, 'wb') as stream_file:
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:  # filter out keep-alive new chunks
-                stream_file.write(chunk)
+    Return the number of files removed.
+    """
+    staging_dir = os.path.expanduser(staging_location)
+    staged = []
+    for filename in os.listdir(staging_dir):
+        filepath = os.path.join(staging_dir, filename)
+        if filename.endswith(STAGING_SUFFIX) and os.path.isfile(filepath):
+            stat = os.stat(filepath)
+            staged.append((stat.st_mtime, stat.st_size, filepath))
+    staged.sort()
+    total = sum(size for _, size, _ in staged)
+    removed = 0
+    for _, size, filepath in staged:
+        if total <= max_bytes:
+            break
+        logging.info("removing partial download %s, staging is over %d bytes",
+                     to_safe_print(filepath), max_bytes)
+        os.remove(filepath)
+        total -= size
+        removed += 1
+    return removed
+
+
+def prepare_staging(parser_args, manifest):
+    """
+    Clean up the staging location before a run, and warn if it is on another filesystem.
+
+    Partial downloads of tracks in the manifest are removed, and then the oldest if there are more
+    than --staging-max-bytes of them.
+    """
+    staging_dir = makedirs(os.path.expanduser(parser_args.staging_location))
+    store_root = makedirs(TrackStore(parser_args.cache_location).root)
+    if os.stat(staging_dir).st_dev != os.stat(store_root).st_dev:
+        logging.warning("staging location %s is not on the same filesystem as the cache location, "
+                        "so each track will be copied into the cache", to_safe_print(staging_dir))
+    clean_staging(parser_args.staging_location, manifest)
+    if parser_args.staging_max_bytes is not None:
+        prune_staging(parser_args.staging_location, parser_args.staging_max_bytes)
 
 
 def move_tmp_to_final(tmp_filename, local_filepath):
-    local_dir = os.path.dirname(local_filepath)
-    if not os.path.exists(local_dir):
-        os.makedirs(local_dir)
+    """
+    Move a finished download into place.
+
+    This is an atomic rename when both are on the same filesystem, and a copy otherwise.
+    """
+    makedirs(os.path.dirname(local_filepath))
 
     logging.info("moving %s to %s", repr(tmp_filename), repr(local_filepath))
 
-    shutil.move(tmp_filename, local_filepath)
+    try:
+        os.replace(tmp_filename, local_filepath)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        shutil.move(tmp_filename, local_filepath)
+
+
+def link_views(parser_args, track_info, blob_path):
+    """Link the stored copy of a track into each cache heirarchy, returning the linked paths."""
+    store = TrackStore(parser_args.cache_location)
+    return [
+        store.link_view(blob_path, get_local_filepath(parser_args.cache_location, cache_heirarchy,
+                                                      track_info))
+        for cache_heirarchy in parser_args.cache_heirarchy
+    ]
 
 
-def cache_track(api, parser_args, track_info, cached_playlist=None):
+def rebuild_views(parser_args):
     """
-    Cache a single track from the API.
+    Link every track in the manifest into each cache heirarchy, without making any requests.
+
+    Return the number of tracks linked.
+    """
+    store = TrackStore(parser_args.cache_location)
+    manifest = Manifest.from_parser_args(parser_args)
+    linked = 0
+    try:
+        for record in manifest.iter_records():
+            blob_path = store.get_blob_path(record['track_id'])
+            if record['track'] is None or not os.path.exists(blob_path):
+                logging.warning("cannot rebuild views of track %s, it is not in the store",
+                                to_safe_print(record['track_id']))
+                continue
+            link_views(parser_args, TrackInfo(record['track_id'], record['track']), blob_path)
+            linked += 1
+    finally:
+        manifest.close()
+    logging.info("rebuilt views of %d tracks", linked)
+    return linked
+
+
+def wait_for_stream_url(rate_limiter=None, circuit_breaker=None):
+    """
+    Wait until a stream url may be requested.
+
+    The circuit_breaker is checked again after waiting for rate_limiter, since it may have tripped
+    while this worker was waiting for its turn.
+    """
+    if circuit_breaker:
+        circuit_breaker.before_call()
+    if rate_limiter:
+        rate_limiter.wait(STREAM)
+    if circuit_breaker:
+        circuit_breaker.before_call()
+
+
+def get_stream_url(api, track_info, rate_limiter, metrics, circuit_breaker=None):
     """
+    Get the url to download a track from, waiting for rate_limiter if given.
 
-    local_filepath = get_local_filepath(parser_args.cache_location, parser_args.cache_heirarchy,
-                                        track_info)
+    If a circuit_breaker is given, wait for it before the request and tell it how the request went.
+    """
+    with metrics.timer('rate_limit'):
+        wait_for_stream_url(rate_limiter, circuit_breaker)
 
     try:
-        cache_url = api.get_stream_url(track_info.track_id)
+        with metrics.timer('get_stream_url'):
+            cache_url = api.get_stream_url(track_info.track_id)
     except Exception:
+        if circuit_breaker:
+            circuit_breaker.record_failure()
         raise GetStreamURLException(
             "Could not get stream URL. Check docco for more info "
             "https://unofficial-google-music-api.readthedocs.io/en/"
             "latest/reference/mobileclient.html#gmusicapi.clients.Mobileclient.get_stream_url"
             "\n\n%s", traceback.format_exc()
         )
+    if circuit_breaker:
+        circuit_breaker.record_success()
     logging.info("cache_url: %s", to_safe_print(cache_url))
+    return cache_url
 
-    tmp_descriptor, tmp_filename = mkstemp(suffix='.mp3', prefix='gpm-cache')
-    write_stream_to_disk(cache_url, tmp_filename)
-    album_art_file = maybe_download_album_art(track_info, parser_args.art_cache_location)
-    save_meta(tmp_filename, track_info, album_art_file)
-    move_tmp_to_final(tmp_filename, local_filepath)
 
-    if cached_playlist:
-        response = api.add_songs_to_playlist(cached_playlist['id'], [track_info.track_id])
-        logging.info("added song to cached playlist %s with name %s. response: %s",
-                     repr(cached_playlist['name']), repr(cached_playlist['id']), repr(response))
+def download_track(api, parser_args, track_info, tmp_filename, rate_limiter, session, metrics,
+                   progress=None, circuit_breaker=None, journal=None):
+    """
+    Download a track to tmp_filename, with its tags rendered and written ahead of the audio.
 
-    logging.info("taking a nap")
-    time.sleep(float(parser_args.sleep_time))
+    Album art is optional, so a track whose cover cannot be fetched is tagged without one. Return
+    the sha1 hex digest of the file, computed while it was downloaded.
+    """
+    def on_retry(exc):
+        metrics.count('download_retries', exception=type(exc).__name__)
 
-    return local_filepath
+    album_art_file = None
+    with metrics.timer('album_art'):
+        try:
+            album_art_file = maybe_download_album_art(
+                track_info, parser_args.art_cache_location, rate_limiter, session, on_retry,
+                chunk_size=parser_args.chunk_size, retries=parser_args.download_retries,
+                backoff=parser_args.download_backoff)
+        except Exception as exc:
+            logging.warning("could not fetch album art of track %s, tagging it without: %s",
+                            to_safe_print(track_info.track_id), exc)
+            metrics.count('album_art_failures', exception=type(exc).__name__)
+    with metrics.timer('render_id3'):
+        id3_header = render_id3(track_info, album_art_file)
+
+    cache_url = get_stream_url(api, track_info, rate_limiter, metrics, circuit_breaker)
+    if journal:
+        journal.record(track_info.track_id, URL_FETCHED)
+
+    with metrics.timer('download'):
+        sha1 = write_stream_to_disk(cache_url, tmp_filename, chunk_size=parser_args.chunk_size,
+                                    retries=parser_args.download_retries,
+                                    backoff=parser_args.download_backoff, session=session,
+                                    header=id3_header, on_retry=on_retry,
+                                    on_chunk=progress and progress.add_bytes)
+    metrics.count('bytes', os.path.getsize(tmp_filename))
+    if journal:
+        # the journal must not reach the disk before the track it says was downloaded
+        with metrics.timer('fsync'):
+            fsync_path(tmp_filename)
+        journal.record(track_info.track_id, DOWNLOADED)
+    return sha1
+
+
+def get_resume_stage(journal, track_info, tmp_filename, blob_path):
+    """
+    Return the stage a track reached in a previous run, if its files show it is still there.
 
+    A track which was moved must still be in the store, and one which was downloaded must still be
+    staged, otherwise it is cached from the start.
+    """
+    stage = journal.get(track_info.track_id) if journal else None
+    if stage == MOVED and os.path.exists(blob_path):
+        return MOVED
+    if stage in (DOWNLOADED, MOVED) and os.path.exists(tmp_filename):
+        return DOWNLOADED
+    return None
 
-def clear_playlist(api, playlist_info):
-    api.remove_entries_from_playlist([entry['id'] for entry in playlist_info['tracks']])
 
+def cache_track(api, parser_args, track_info, rate_limiter=None, session=None, metrics=None,
+                progress=None, circuit_breaker=None, journal=None):
+    """
+    Cache a single track from the API.
 
-def cache_playlist(api, parser_args):
+    The tags are rendered before the audio is downloaded, and written ahead of it, so the track is
+    written to disk in a single pass. The track is kept in the store, and linked into each cache
+    heirarchy. If a rate_limiter is given, wait for it before each request made for the track.
+    Downloads are made with session if one is given. The time taken by each stage, and the number
+    of download retries, are recorded in metrics if given, and the bytes downloaded are added to
+    progress if given. Requests for the stream url go through circuit_breaker if one is given.
+
+    Each stage the track reaches is recorded in journal if given, and a track which was downloaded
+    or moved into the store by a run which crashed is resumed from that stage. The staged track,
+    and then the store directory it is moved into, are flushed to disk before the journal records
+    it, so a crash of the OS cannot leave the journal ahead of the files.
+
+    Return the path of the track in the first cache heirarchy, and the sha1 hex digest of the track
+    if this call downloaded it, or None if it was resumed.
     """
-    Cache an entire playlist from the API.
+    if metrics is None:
+        metrics = Metrics()
+
+    tmp_filename = get_staging_filepath(parser_args.staging_location, track_info)
+    blob_path = TrackStore(parser_args.cache_location).get_blob_path(track_info.track_id)
+    resume_stage = get_resume_stage(journal, track_info, tmp_filename, blob_path)
+    sha1 = None
+    if resume_stage:
+        logging.info("resuming track %s from stage %s", to_safe_print(track_info.track_id),
+                     resume_stage)
+    else:
+        sha1 = download_track(api, parser_args, track_info, tmp_filename, rate_limiter, session,
+                              metrics, progress, circuit_breaker, journal)
+    if resume_stage != MOVED:
+        with metrics.timer('move'):
+            move_tmp_to_final(tmp_filename, blob_path)
+        if journal:
+            with metrics.timer('fsync'):
+                # the track was copied rather than renamed if staging is on another filesystem
+                fsync_path(blob_path)
+                fsync_path(os.path.dirname(blob_path))
+            journal.record(track_info.track_id, MOVED)
+    with metrics.timer('link_views'):
+        local_filepaths = link_views(parser_args, track_info, blob_path)
+    return local_filepaths[0], sha1
+
+
+def get_call_failure():
+    """Return gmusicapi's CallFailure, only importing gmusicapi once an exception is raised."""
+    from gmusicapi.exceptions import CallFailure
+    return CallFailure
+
+
+def record_cached(parser_args, track_info, metrics, manifest=None, journal=None, claims=None,
+                  sha1=None):
+    """Record a track which has been cached in the manifest, then the journal, then its claim."""
+    if manifest:
+        blob_path = TrackStore(parser_args.cache_location).get_blob_path(track_info.track_id)
+        with metrics.timer('manifest'):
+            manifest.record(track_info.track_id, blob_path, TAG_VERSION, track_info.to_dict(), sha1)
+        if journal:
+            journal.record(track_info.track_id, RECORDED)
+    if claims:
+        claims.complete(track_info.track_id)
+
+
+def cache_entry(api, parser_args, track, rate_limiter=None, manifest=None, session=None,
+                metrics=None, progress=None, circuit_breaker=None, journal=None, claims=None):
     """
+    Cache the track of a single playlist entry, logging any failure.
 
-    library = Library(api)
-    source_playlist = library.find_playlist(parser_args.playlist)
+    If a manifest is given, record the track in it once it has been cached, and then in journal if
+    given. If metrics are given, record the time taken by each stage, and count the tracks cached
+    and failures by exception type. If claims are given, the track is claimed just before it is
+    cached, and skipped as a failure if another shard holds the claim.
+
+    Return a tuple of the entry and whether it was cached successfully.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    logging.debug(f"caching track {track}")
+    track_info = TrackInfo(track['trackId'], track.get('track'))
+    if claims and not claims.claim(track_info.track_id):
+        logging.info("skipping track %s, claimed by another shard", to_safe_print(track_info.track_id))
+        metrics.count('claimed_elsewhere')
+        return track, False
+    try:
+        with metrics.timer('track'):
+            filename, sha1 = cache_track(api, parser_args, track_info, rate_limiter, session,
+                                         metrics, progress, circuit_breaker, journal)
+        logging.info("succesfully cached to %s", to_safe_print(filename))
+        record_cached(parser_args, track_info, metrics, manifest, journal, claims, sha1)
+    except get_call_failure() as exc:
+        logging.warning("failed to get streaming url, "
+                        "try updating your device id: "
+                        "https://github.com/simon-weber/gmusicapi/issues/590"
+                        "\n%s", traceback.format_exc())
+        metrics.count('failures', exception=type(exc).__name__)
+        return track, False
+    except Exception as exc:
+        logging.warning("\n\n!!! failed to cache track, %s. info: %s, exception: %s",
+                        track_info.track_id, track_info, traceback.format_exc())
+        metrics.count('failures', exception=type(exc).__name__)
+        return track, False
+    metrics.count('tracks')
+    return track, True
+
+
+def get_snapshot_path(parser_args):
+    """Return --library-snapshot, or the default snapshot in the cache location, one for each shard."""
+    snapshot_path = parser_args.library_snapshot
+    if snapshot_path is None and parser_args.shard:
+        snapshot_path = shard.get_snapshot_path(parser_args.cache_location, *parser_args.shard)
+    elif snapshot_path is None:
+        snapshot_path = os.path.join(parser_args.cache_location, SNAPSHOT_FILENAME)
+    return snapshot_path
+
+
+def get_journal_path(parser_args):
+    """Return --journal, or the default journal in the cache location, one for each shard."""
+    journal_path = parser_args.journal
+    if journal_path is None and parser_args.shard:
+        journal_path = shard.get_journal_path(parser_args.cache_location, *parser_args.shard)
+    elif journal_path is None:
+        journal_path = os.path.join(parser_args.cache_location, JOURNAL_FILENAME)
+    return journal_path
+
+
+def resolve_playlists(library, parser_args):
+    """Return pairs of source and cached playlists for every mapping, creating cached playlists."""
+    mappings = get_playlist_mappings(parser_args)
+    source_playlists = library.find_playlists([source_name for source_name, _ in mappings])
+    cached_playlists = [
+        library.find_or_create_playlist(cached_name) if cached_name else None
+        for _, cached_name in mappings
+    ]
+    return list(zip(source_playlists, cached_playlists))
 
-    cached_playlist = None
-    if parser_args.playlist_cached:
-        cached_playlist = library.find_or_create_playlist(parser_args.playlist_cached)
 
+def plan_tracks(playlists, manifest, mutations=None):
+    """
+    Group the entries of every source playlist by track, so each track is only downloaded once.
+
+    Tracks already in the manifest are passed straight to mutations, if given. Return a dict mapping
+    each trackId to be downloaded to its (entry, cached playlist) pairs, and a list of entries which
+    cannot be cached.
+    """
+    pending_tracks = {}
     failed_tracks = []
+    for source_playlist, cached_playlist in playlists:
+        for track in source_playlist['tracks']:
+            if track['source'] == '1':
+                logging.warning(f"did not cache track, already cached {track}")
+                failed_tracks.append(track)
+            elif manifest.is_cached(track['trackId'], TAG_VERSION):
+                logging.info("skipping track %s, found in manifest", to_safe_print(track['trackId']))
+                if mutations:
+                    mutations.track_cached(track, cached_playlist)
+            else:
+                pending_tracks.setdefault(track['trackId'], []).append((track, cached_playlist))
+    return pending_tracks, failed_tracks
+
+
+def cancel_futures(futures):
+    for future in futures:
+        future.cancel()
+
+
+def download_round(executor, api, parser_args, pending_tracks, mutations, progress, **cache_args):
+    """
+    Try to cache each pending track once, returning the pending tracks which failed.
 
-    for track in source_playlist['tracks']:
-        logging.debug(f"caching track {track}")
-        if track['source'] == '1':
-            logging.warning(f"did not cache track, already cached {track}")
-            failed_tracks.append(track)
-            continue
-        track_info = TrackInfo(track['trackId'], track.get('track'))
-        try:
-            filename = cache_track(api, parser_args, track_info, cached_playlist)
-            logging.info("succesfully cached to %s", to_safe_print(filename))
-        except gmusicapi.exceptions.CallFailure:
-            logging.warning("failed to get streaming url, "
-                            "try updating your device id: "
-                            "https://github.com/simon-weber/gmusicapi/issues/590"
-                            "\n%s", traceback.format_exc())
-            failed_tracks.append(track)
-            continue
-        except Exception:
-            logging.warning("\n\n!!! failed to cache track, %s. info: %s, exception: %s",
-                            track_info.track_id, track_info, traceback.format_exc())
-            failed_tracks.append(track)
-            continue
+    If the circuit breaker aborts the run, tracks which have not been tried yet are cancelled and
+    returned as failed.
+    """
+    circuit_breaker = cache_args.get('circuit_breaker')
+    futures = {
+        executor.submit(cache_entry, api, parser_args, entries[0][0], progress=progress,
+                        **cache_args): track_id
+        for track_id, entries in pending_tracks.items()
+    }
+    failed = {}
+    try:
+        for future in as_completed(futures):
+            track_id = futures[future]
+            if future.cancelled() or not future.result()[1]:
+                failed[track_id] = pending_tracks[track_id]
+                if circuit_breaker and circuit_breaker.aborted:
+                    cancel_futures(futures)
+                continue
+            progress.track_done()
+            for entry, cached_playlist in pending_tracks[track_id]:
+                mutations.track_cached(entry, cached_playlist)
+    except BaseException:
+        cancel_futures(futures)
+        raise
+    return failed
+
+
+def download_tracks(api, parser_args, pending_tracks, mutations, progress=None, **cache_args):
+    """
+    Cache each pending track on a pool of workers, returning the entries which failed.
+
+    Tracks which fail are queued again up to --requeue-rounds times, once the other tracks have
+    been tried. Progress is reported every --progress-interval seconds while the tracks are
+    downloaded.
+    """
+    progress = progress or Progress()
+    progress.add_total(len(pending_tracks))
+    circuit_breaker = cache_args.get('circuit_breaker')
+    with ThreadPoolExecutor(max_workers=max(parser_args.workers, 1)) as executor, \
+            ProgressReporter.from_parser_args(progress, parser_args):
+        for requeue_round in range(max(parser_args.requeue_rounds, 0) + 1):
+            if not pending_tracks or (circuit_breaker and circuit_breaker.aborted):
+                break
+            if requeue_round:
+                logging.warning("queueing %d failed tracks again", len(pending_tracks))
+            pending_tracks = download_round(executor, api, parser_args, pending_tracks, mutations,
+                                            progress, **cache_args)
+        for _ in pending_tracks:
+            progress.track_done(success=False)
+    return [entry for entries in pending_tracks.values() for entry, _ in entries]
+
+
+def cache_playlists(api, parser_args, session=None, metrics=None):
+    """
+    Cache every playlist given by --playlist and --playlist-config from the API.
+
+    The library is only fetched once, and a track in several playlists is only downloaded once.
+    Cached tracks are added to their cached playlist in batches, and once added, their entries are
+    removed from the source playlist in batches if --clear-playlist is set. Downloads are made with
+    session, or a new pooled session if none is given. The stage each track reaches is recorded in
+    the --journal, so a run which crashed resumes each track from where it got to, and partial
+    downloads of tracks which were cached since are removed.
+
+    Metrics of every track are collected in metrics, or new Metrics if none are given, and exported
+    by export_metrics once the run is over. Return the metrics.
+    """
+    if metrics is None:
+        metrics = Metrics()
+
+    library = Library(api, get_snapshot_path(parser_args))
+    playlists = resolve_playlists(library, parser_args)
+
+    rate_limiter = RateLimiter.from_parser_args(parser_args)
+    manifest = open_manifest(parser_args)
+    prepare_staging(parser_args, manifest)
+    journal = RunJournal(get_journal_path(parser_args))
+    owns_session = session is None
+    if owns_session:
+        from .session import PooledSession
+        session = PooledSession.from_parser_args(parser_args)
+    mutations = PlaylistMutations(
+        api, clear_source=bool(parser_args.clear_playlist), batch_size=parser_args.batch_size,
+        flush_interval=parser_args.flush_interval, rate_limiter=rate_limiter)
+
+    failed_tracks = []
+    try:
+        pending_tracks, unavailable_tracks = plan_tracks(playlists, manifest, mutations)
+        failed_tracks.extend(unavailable_tracks)
+        failed_tracks.extend(download_tracks(
+            api, parser_args, pending_tracks, mutations, rate_limiter=rate_limiter,
+            manifest=manifest, session=session, metrics=metrics, journal=journal,
+            circuit_breaker=CircuitBreaker.from_parser_args(parser_args)))
+    finally:
+        mutations.close()
+        journal.close()
+        failed_tracks.extend(mutations.failed)
+        if mutations.changed():
+            for source_playlist, cached_playlist in playlists:
+                library.invalidate(source_playlist)
+                if cached_playlist:
+                    library.invalidate(cached_playlist)
+        manifest.close()
+        if owns_session:
+            session.close()
+        if mutations.failed:
+            metrics.count('mutation_failures', len(mutations.failed))
+        export_metrics(parser_args, metrics)
 
     if failed_tracks:
         logging.warning("tracks that failed: ")
         for track in failed_tracks:
-            logging.warning("-> %s %s", track.get('trackID'), track.get('track'))
-    elif parser_args.clear_playlist and parser_args.playlist_cached:
-        clear_playlist(api, source_playlist)
+            logging.warning("-> %s %s", track.get('trackId'), track.get('track'))
+    return metrics
 
 
-def main(argv=None):
+def open_manifest(parser_args):
+    """Open the manifest, first merging the manifest of every shard into it if --merge-shards is given."""
+    manifest = Manifest.from_parser_args(parser_args)
+    if parser_args.merge_shards:
+        try:
+            merge_shards(manifest, parser_args.cache_location, parser_args.merge_shards)
+        except BaseException:
+            manifest.close()
+            raise
+    return manifest
+
+
+def select_shard_tracks(pending_tracks, parser_args):
+    """Return the pending tracks which hash to this --shard."""
+    index, count = parser_args.shard
+    return {
+        track_id: entries for track_id, entries in pending_tracks.items()
+        if shard_of(track_id, count) == index
+    }
+
+
+def cache_shard(api, parser_args, session=None, metrics=None):
     """
-    Parse arguments, set up debugging and cache metadata.
+    Cache the tracks of the playlists which belong to --shard, without changing any playlists.
+
+    Each track is claimed just before it is downloaded, and recorded in the shard's own manifest,
+    which also holds the records of the main manifest so that cached tracks are skipped. Claims on
+    tracks which were not cached are released at the end, and the rest are kept until the merge. A
+    summary of the shard is written once it finishes, and a run with --merge-shards merges the
+    manifests of every shard before adding cached tracks to their cached playlists. Return the
+    metrics.
     """
-    api = Mobileclient()
+    if metrics is None:
+        metrics = Metrics()
+
+    library = Library(api, get_snapshot_path(parser_args))
+    playlists = resolve_planned_playlists(library, parser_args)
+
+    manifest = Manifest(shard.get_manifest_path(parser_args.cache_location, *parser_args.shard))
+    manifest.merge(Manifest.get_path(parser_args))
+    prepare_staging(parser_args, manifest)
+    journal = RunJournal(get_journal_path(parser_args))
+    claims = ClaimStore.from_parser_args(parser_args)
+    results = ShardResults()
+    owns_session = session is None
+    if owns_session:
+        from .session import PooledSession
+        session = PooledSession.from_parser_args(parser_args)
 
-    parser_args = get_parser_args(argv)
+    try:
+        pending_tracks, _ = plan_tracks(playlists, manifest)
+        pending_tracks = select_shard_tracks(pending_tracks, parser_args)
+        failed_tracks = download_tracks(
+            api, parser_args, pending_tracks, results,
+            rate_limiter=RateLimiter.from_parser_args(parser_args), manifest=manifest,
+            session=session, metrics=metrics, journal=journal, claims=claims,
+            circuit_breaker=CircuitBreaker.from_parser_args(parser_args))
+        write_summary(parser_args.cache_location, *parser_args.shard, planned=len(pending_tracks),
+                      cached_entries=len(results.cached),
+                      failed_tracks=sorted({track['trackId'] for track in failed_tracks}))
+    finally:
+        claims.release_all()
+        journal.close()
+        manifest.close()
+        if owns_session:
+            session.close()
+        export_metrics(parser_args, metrics)
+    return metrics
+
+
+def export_metrics(parser_args, metrics):
+    """Log a JSON summary of metrics, and write it to --metrics-json and --metrics-prometheus."""
+    logging.info("metrics: %s", json.dumps(metrics.summary(), sort_keys=True))
+    if parser_args.metrics_json:
+        metrics.write_json(parser_args.metrics_json)
+    if parser_args.metrics_prometheus:
+        metrics.write_prometheus(parser_args.metrics_prometheus)
+
+
+def resolve_planned_playlists(library, parser_args):
+    """Return pairs of source and cached playlists for every mapping, without creating any."""
+    playlists = []
+    for source_name, cached_name in get_playlist_mappings(parser_args):
+        cached_playlist = None
+        if cached_name:
+            try:
+                cached_playlist = library.find_playlist(cached_name)
+            except PlaylistNotFoundException:
+                cached_playlist = {'name': cached_name, 'id': None, 'tracks': []}
+        playlists.append((library.find_playlist(source_name), cached_playlist))
+    return playlists
+
+
+def get_view_owners(parser_args, manifest, pending_infos):
+    """Map the path of every view of a cached or pending track to the trackIds linked there."""
+    infos = [
+        TrackInfo(record['track_id'], record['track'])
+        for record in manifest.iter_records() if record['track']
+    ] + pending_infos
+    view_owners = {}
+    for info in infos:
+        for cache_heirarchy in parser_args.cache_heirarchy:
+            view_path = get_local_filepath(parser_args.cache_location, cache_heirarchy, info)
+            view_owners.setdefault(view_path, set()).add(info.track_id)
+    return view_owners
+
+
+def plan_track(parser_args, art_store, track_id, entries):
+    """Return the plan for downloading one track, linked into each cache heirarchy."""
+    info = TrackInfo(track_id, entries[0][0].get('track'))
+    art = None
+    if info.album_id and info.album_art_url:
+        art = 'cached' if art_store and art_store.get(info.album_id) else 'missing'
+    return {
+        'track_id': track_id,
+        'entries': [entry['id'] for entry, _ in entries],
+        'blob_path': TrackStore(parser_args.cache_location).get_blob_path(track_id),
+        'views': [
+            get_local_filepath(parser_args.cache_location, cache_heirarchy, info)
+            for cache_heirarchy in parser_args.cache_heirarchy
+        ],
+        'album_id': info.album_id,
+        'art': art,
+        'estimated_bytes': info.estimated_size,
+    }
 
-    logging_args = {
-        'format': '%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-        'datefmt': '%m-%d %H:%M'
+
+def build_plan(api, parser_args):
+    """
+    Work out what cache_playlists would do, without downloading anything or changing playlists.
+
+    Only the playlists and their entries are fetched, unless the entries are in the snapshot, and
+    nothing is written but the snapshot. The plan lists every track to download with its paths and
+    whether its cover is missing, along with paths which more than one track would be linked to, and
+    an estimate of the bytes to download.
+    """
+    library = Library(api, get_snapshot_path(parser_args))
+    playlists = resolve_planned_playlists(library, parser_args)
+    manifest_path = Manifest.get_path(parser_args)
+    manifest = Manifest(manifest_path if os.path.exists(manifest_path) else ':memory:')
+    try:
+        pending_tracks, unavailable_tracks = plan_tracks(playlists, manifest)
+        art_store = None
+        if os.path.isdir(os.path.expanduser(parser_args.art_cache_location)):
+            art_store = get_album_art_store(parser_args.art_cache_location)
+        tracks = [
+            plan_track(parser_args, art_store, track_id, entries)
+            for track_id, entries in pending_tracks.items()
+        ]
+        view_owners = get_view_owners(parser_args, manifest, [
+            TrackInfo(track_id, entries[0][0].get('track'))
+            for track_id, entries in pending_tracks.items()
+        ])
+    finally:
+        manifest.close()
+
+    entry_count = sum(len(source_playlist['tracks']) for source_playlist, _ in playlists)
+    pending_count = sum(len(entries) for entries in pending_tracks.values())
+    return {
+        'playlists': [
+            {
+                'source': source_playlist['name'],
+                'source_id': source_playlist['id'],
+                'entries': len(source_playlist['tracks']),
+                'cached': cached_playlist['name'] if cached_playlist else None,
+                'cached_id': cached_playlist['id'] if cached_playlist else None,
+            }
+            for source_playlist, cached_playlist in playlists
+        ],
+        'tracks': tracks,
+        'already_cached_entries': entry_count - pending_count - len(unavailable_tracks),
+        'unavailable_entries': [entry['id'] for entry in unavailable_tracks],
+        'missing_art': sorted({track['album_id'] for track in tracks if track['art'] == 'missing'}),
+        'collisions': [
+            {'path': view_path, 'track_ids': sorted(owners)}
+            for view_path, owners in sorted(view_owners.items()) if len(owners) > 1
+        ],
+        'estimated_bytes': sum(track['estimated_bytes'] or 0 for track in tracks),
+        'unknown_size_tracks': sum(1 for track in tracks if track['estimated_bytes'] is None),
     }
-    if parser_args.debug_level:
-        logging_args['level'] = DEBUG_LEVELS[parser_args.debug_level]
 
-    logging.basicConfig(**logging_args)
 
-    for item, value in list(vars(parser_args).items()):
-        if item == "pwd":
-            continue
-        logging.info("Parser arg: %15s = %s", item, value)
+def write_plan(plan, path='-'):
+    """Write a plan as JSON to path, or to stdout if path is '-'."""
+    contents = json.dumps(plan, indent=2, sort_keys=True)
+    if path == '-':
+        sys.stdout.write(contents + "\n")
+    else:
+        write_atomic(path, contents)
+    logging.info("planned %d tracks, about %d bytes, %d colliding paths", len(plan['tracks']),
+                 plan['estimated_bytes'], len(plan['collisions']))
+
+
+def login(parser_args):
+    """Log in to the API, performing oauth first if there are no stored credentials."""
+    # gmusicapi is slow to import, so it is only imported once it is needed to log in
+    from gmusicapi import Mobileclient
+    from pprint import pformat
+
+    api = Mobileclient()
 
     if not os.path.exists(api.OAUTH_FILEPATH):
         logging.info("performing oauth")
@@ -320,8 +1121,40 @@ def main(argv=None):
                         traceback.format_exc())
         raise BadLoginException("Bad login. Check creds and internet")
 
-        logging.info("api response: %s", response)
-        cache_playlist(api, parser_args)
+    logging.info("api response: %s", response)
+    return api
+
+
+def main(argv=None):
+    """
+    Parse arguments, set up debugging and cache metadata.
+    """
+    parser_args = get_parser_args(argv)
+
+    logging_args = {
+        'format': '%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+        'datefmt': '%m-%d %H:%M'
+    }
+    if parser_args.debug_level:
+        logging_args['level'] = DEBUG_LEVELS[parser_args.debug_level]
+
+    logging.basicConfig(**logging_args)
+
+    for item, value in list(vars(parser_args).items()):
+        if item == "pwd":
+            continue
+        logging.info("Parser arg: %15s = %s", item, value)
+
+    if parser_args.rebuild_views:
+        rebuild_views(parser_args)
+        return
+
+    api = login(parser_args)
+    if parser_args.plan:
+        write_plan(build_plan(api, parser_args), parser_args.plan)
+        return
+    run = cache_shard if parser_args.shard else cache_playlists
+    run(api, parser_args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+"""
+Resumable downloads of streams to disk.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+from .exceptions import IncompleteDownloadException
+from .sanitation_helper import to_safe_print
+
+CHUNK_SIZE = 256 * 1024
+RETRIES = 5
+BACKOFF = 1.0
+POOL_SIZE = 10
+TIMEOUT = 30
+
+CONTENT_RANGE_TOTAL = re.compile(r'bytes\s+(?:\*|\d+-\d+)/(\d+)')
+
+
+def get_range_total(response):
+    """Return the total length of the resource from a Content-Range header, if known."""
+    match = CONTENT_RANGE_TOTAL.match(response.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def restart_partial(filename, header=b''):
+    """Discard any downloaded content in filename, leaving only the header."""
+    with open(filename, 'wb') as stream_file:
+        stream_file.write(header)
+
+
+def get_resume_offset(filename, header=b''):
+    """
+    Return the number of bytes of the stream already downloaded to filename.
+
+    The file is expected to start with header, and is restarted if it does not.
+    """
+    if os.path.exists(filename) and os.path.getsize(filename) >= len(header):
+        with open(filename, 'rb') as stream_file:
+            if stream_file.read(len(header)) == header:
+                return os.path.getsize(filename) - len(header)
+    restart_partial(filename, header)
+    return 0
+
+
+def hash_file(filename, digest, chunk_size=CHUNK_SIZE):
+    """Update digest with the contents of filename, and return it."""
+    with open(filename, 'rb') as stream_file:
+        for chunk in iter(lambda: stream_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest
+
+
+def download_chunks(stream_url, filename, chunk_size=CHUNK_SIZE, session=None, header=b'',
+                    on_chunk=None):
+    """
+    Make a single attempt at downloading the rest of stream_url to filename, after header.
+
+    Any content already in filename is kept, and only the remaining bytes are requested. If given,
+    on_chunk is called with the size of each chunk written. The content kept is hashed before the
+    download, and each chunk as it is written, so the sha1 hex digest of the whole file is returned
+    without reading it back.
+    """
+    from .session import get_default_session
+
+    session = session or get_default_session()
+    on_chunk = on_chunk or (lambda size: None)
+    offset = get_resume_offset(filename, header)
+    headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+
+    with session.get(stream_url, stream=True, headers=headers) as response:
+        if offset and response.status_code == 416:
+            if get_range_total(response) == offset:
+                return hash_file(filename, hashlib.sha1()).hexdigest()
+            restart_partial(filename, header)
+            raise IncompleteDownloadException(
+                "partial download of %s did not match the remote length" % to_safe_print(filename))
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            logging.info("server ignored range request, restarting %s", to_safe_print(filename))
+            restart_partial(filename, header)
+
+        expected = response.headers.get('Content-Length')
+        written = 0
+        digest = hash_file(filename, hashlib.sha1())
+        with open(filename, 'ab') as stream_file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:  # filter out keep-alive new chunks
+                    stream_file.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+                    on_chunk(len(chunk))
+
+    if expected is not None and written < int(expected):
+        raise IncompleteDownloadException(
+            "received %d of %s bytes for %s" % (written, expected, to_safe_print(filename)))
+    return digest.hexdigest()
+
+
+def write_stream_to_disk(stream_url, filename, chunk_size=CHUNK_SIZE, retries=RETRIES,
+                         backoff=BACKOFF, session=None, header=b'', on_retry=None, on_chunk=None):
+    """
+    Download stream_url to filename, resuming from any partial content already in filename.
+
+    If a header is given, such as a rendered ID3 tag, it is written before the stream. Failed
+    attempts are retried with exponential backoff, each retry resuming where the last attempt
+    left off, and on_retry is called with the exception of each failed attempt that is retried.
+    on_chunk is called with the size of each chunk written. Requests are made with session, or the
+    shared default session.
+
+    Return the sha1 hex digest of the whole file, header included.
+    """
+    # requests is only imported once there is something to download, to keep startup fast
+    import requests
+
+    for attempt in range(retries + 1):
+        try:
+            return download_chunks(stream_url, filename, chunk_size, session, header, on_chunk)
+        except (requests.RequestException, IncompleteDownloadException) as exc:
+            if attempt >= retries:
+                raise
+            if on_retry:
+                on_retry(exc)
+            delay = backoff * (2 ** attempt)
+            logging.warning("download of %s failed (attempt %d of %d), retrying in %.1fs",
+                            to_safe_print(filename), attempt + 1, retries + 1, delay,
+                            exc_info=True)
+            time.sleep(delay)
@@ -10,3 +10,15 @@ class BadLoginException(UserWarning):
 
 class GetStreamURLException(UserWarning):
     pass
+
+
+class IncompleteDownloadException(UserWarning):
+    pass
+
+
+class CircuitOpenException(UserWarning):
+    pass
+
+
+class IncompleteShardsException(UserWarning):
+    pass
@@ -0,0 +1,143 @@
+"""
+Write-ahead journal of the stage each track of a run has reached, so a crashed run can resume.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+JOURNAL_FILENAME = 'gpm-cache-journal.jsonl'
+
+URL_FETCHED = 'url_fetched'
+DOWNLOADED = 'downloaded'
+MOVED = 'moved'
+RECORDED = 'recorded'
+STAGES = (URL_FETCHED, DOWNLOADED, MOVED, RECORDED)
+
+BATCH_SIZE = 32
+SYNC_INTERVAL = 1.0
+
+
+def replay(path):
+    """
+    Return the last stage reached by each track in the journal at path.
+
+    A line left incomplete by a crash is ignored.
+    """
+    stages = {}
+    try:
+        with open(path, 'rb') as journal_file:
+            for line in journal_file:
+                try:
+                    transition = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    logging.warning("ignoring incomplete line in journal %s", path)
+                    continue
+                stages[transition['track_id']] = transition['stage']
+    except (IOError, OSError):
+        pass
+    return stages
+
+
+class RunJournal(object):
+    """
+    Append-only log of the stages each track reaches, replayed when the journal is opened.
+
+    Transitions are buffered and written with an fsync once batch_size are waiting, and a timer
+    writes any which are waiting every sync_interval seconds, so a crash loses at most the
+    transitions of the last sync_interval seconds. Losing a transition only means that stage is
+    repeated. When the journal is closed it is rewritten with only the tracks which have not been
+    recorded in the manifest yet.
+
+    Playlist changes are not journaled: a resumed run compares the playlists themselves against the
+    manifest, so additions and removals which were lost are queued again and those which were made
+    are not.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, sync_interval=SYNC_INTERVAL):
+        self.path = os.path.expanduser(path)
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.stages = replay(self.path)
+        self._buffer = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'ab')
+        if self.stages:
+            logging.info("resuming from journal %s: %s", self.path, json.dumps(self.count_stages()))
+        self._closed = threading.Event()
+        self._timer = None
+        if sync_interval:
+            self._timer = threading.Thread(target=self._sync_periodically, name='journal')
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count_stages(self):
+        counts = {}
+        for stage in self.stages.values():
+            counts[stage] = counts.get(stage, 0) + 1
+        return counts
+
+    def get(self, track_id):
+        """Return the last stage a track reached, or None if it has none."""
+        with self._lock:
+            return self.stages.get(track_id)
+
+    def record(self, track_id, stage):
+        """Record that a track has reached stage, syncing the journal if a batch is full."""
+        transition = {'track_id': track_id, 'stage': stage, 'at': time.time()}
+        with self._lock:
+            self.stages[track_id] = stage
+            self._buffer.append(json.dumps(transition).encode('utf-8') + b'\n')
+            if len(self._buffer) >= self.batch_size:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer = []
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.sync_interval):
+            self.sync()
+
+    def checkpoint(self):
+        """Rewrite the journal with only the tracks which have not been recorded in the manifest."""
+        with self._lock:
+            self._sync()
+            self._file.close()
+            self.stages = {
+                track_id: stage for track_id, stage in self.stages.items()
+                if stage in STAGES[:STAGES.index(RECORDED)]
+            }
+            tmp_path = "%s.tmp" % self.path
+            with open(tmp_path, 'wb') as tmp_file:
+                for track_id, stage in self.stages.items():
+                    tmp_file.write(json.dumps({'track_id': track_id, 'stage': stage}).encode('utf-8') + b'\n')
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'ab')
+
+    def close(self):
+        """Stop the periodic sync, and checkpoint the journal."""
+        self._closed.set()
+        if self._timer:
+            self._timer.join()
+        self.checkpoint()
+        with self._lock:
+            self._file.close()
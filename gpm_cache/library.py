@@ -1,34 +1,259 @@
+import json
 import logging
+import os
 import re
-from pprint import pformat
+import threading
+import traceback
+from bisect import bisect_left
+from functools import lru_cache
 
 from .exceptions import PlaylistNotFoundException
 from .sanitation_helper import to_safe_print
+from .track_info import TrackInfo
+
+SNAPSHOT_FILENAME = 'library-snapshot.jsonl'
+
+# Keys of a playlist entry which are kept, along with the fields of its track kept by TrackInfo.
+ENTRY_FIELDS = ('id', 'trackId', 'source')
+
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+@lru_cache(maxsize=64)
+def compile_playlist_pattern(playlist_name):
+    return re.compile(playlist_name, re.I)
+
+
+def to_track_record(entry):
+    """Return a lightweight copy of a playlist entry, with only the fields that are used."""
+    record = {key: entry[key] for key in ENTRY_FIELDS if key in entry}
+    if entry.get('track'):
+        record['track'] = TrackInfo(entry['trackId'], entry['track']).to_dict()
+    return record
+
+
+class LibrarySnapshot:
+    """
+    Entries of playlists saved on disk, keyed by playlist id and lastModifiedTimestamp.
+
+    The snapshot is stored as JSON lines: a header line for each playlist, followed by one line for
+    each of its entries. Only the headers are read up front. get_tracks loads the entries of one
+    playlist, and the entries of the other playlists are only streamed when the snapshot is
+    rewritten, so the snapshot is never loaded whole.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        try:
+            self._index = self.load_index()
+        except (IOError, OSError, ValueError, KeyError):
+            self._index = {}
+
+    def load_index(self):
+        """Map the id of each saved playlist to its header and the offset of its entries."""
+        index = {}
+        with open(self.path, 'rb') as snapshot_file:
+            for header in iter(snapshot_file.readline, b''):
+                header = json.loads(header.decode('utf-8'))
+                index[header['id']] = (header, snapshot_file.tell())
+                for _ in range(header['count']):
+                    snapshot_file.readline()
+        return index
+
+    def iter_tracks(self, playlist_id):
+        """Yield the saved entries of a playlist, one at a time."""
+        header, offset = self._index[playlist_id]
+        with open(self.path, 'rb') as snapshot_file:
+            snapshot_file.seek(offset)
+            for _ in range(header['count']):
+                yield json.loads(snapshot_file.readline().decode('utf-8'))
+
+    def get_tracks(self, playlist):
+        """Return the saved entries of a playlist, or None if it has been modified since."""
+        with self._lock:
+            saved = self._index.get(playlist['id'])
+            if saved and saved[0]['lastModifiedTimestamp'] == playlist.get('lastModifiedTimestamp'):
+                return list(self.iter_tracks(playlist['id']))
+        return None
+
+    def set_tracks(self, playlist, tracks):
+        header = {
+            'id': playlist['id'],
+            'lastModifiedTimestamp': playlist.get('lastModifiedTimestamp'),
+            'count': len(tracks),
+        }
+        with self._lock:
+            self.save(playlist['id'], (header, tracks))
+
+    def invalidate(self, playlist_id):
+        """Forget the saved entries of a playlist, e.g. after it has been changed."""
+        with self._lock:
+            if playlist_id in self._index:
+                self.save(playlist_id)
+
+    def save(self, playlist_id, replacement=None):
+        """
+        Rewrite the snapshot without the entries of playlist_id, adding the replacement if given.
+
+        The entries of every other playlist are copied across one line at a time.
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = "%s.tmp" % self.path
+        index = {}
+        with open(tmp_path, 'wb') as tmp_file:
+            for saved_id in self._index:
+                if saved_id != playlist_id:
+                    self.write_playlist(tmp_file, index, self._index[saved_id][0],
+                                        self.iter_tracks(saved_id))
+            if replacement:
+                self.write_playlist(tmp_file, index, *replacement)
+        os.replace(tmp_path, self.path)
+        self._index = index
+
+    @staticmethod
+    def write_playlist(snapshot_file, index, header, tracks):
+        snapshot_file.write(json.dumps(header).encode('utf-8') + b'\n')
+        index[header['id']] = (header, snapshot_file.tell())
+        for track in tracks:
+            snapshot_file.write(json.dumps(track).encode('utf-8') + b'\n')
 
 
 class Library:
+    """
+    Playlists in the user's library.
+
+    Only the playlist headers are listed up front. The entries of a playlist are fetched when it
+    is found, or read from the snapshot if the playlist has not been modified since it was saved.
+    Entries are kept as lightweight records with only the fields needed to cache their tracks.
+    Playlist names are indexed once, so that most lookups do not need to match a regex against
+    every playlist.
+    """
 
-    def __init__(self, api):
+    def __init__(self, api, snapshot_path=None):
         self.api = api
-        self.data = api.get_all_user_playlist_contents()
+        self.snapshot = LibrarySnapshot(snapshot_path) if snapshot_path else None
+        self.data = [
+            playlist for playlist in api.get_all_playlists() if playlist.get('type') != 'SHARED'
+        ]
+        self._user_tracks = None
+        self.build_index()
+
+    def build_index(self):
+        """Index playlists by exact name, case-folded name and sorted case-folded name."""
+        self._exact = {}
+        self._folded = {}
+        self._sorted_names = []
+        for position, playlist in enumerate(self.data):
+            self._exact.setdefault(playlist['name'], position)
+            self._folded.setdefault(playlist['name'].casefold(), position)
+            self._sorted_names.append((playlist['name'].casefold(), position))
+        self._sorted_names.sort()
+
+    def match_prefix(self, folded_name):
+        """Return the position of the first playlist whose case-folded name starts with folded_name."""
+        matches = []
+        for name, position in self._sorted_names[bisect_left(self._sorted_names, (folded_name, )):]:
+            if not name.startswith(folded_name):
+                break
+            matches.append(position)
+        return min(matches) if matches else None
+
+    def match_playlist(self, playlist_name):
+        """
+        Return the position of the playlist best matching playlist_name, or None.
+
+        An exact name is preferred, then a case-insensitive name, then the first playlist that the
+        name matches the start of, as a case-insensitive regex.
+        """
+        if playlist_name in self._exact:
+            return self._exact[playlist_name]
+        folded_name = playlist_name.casefold()
+        if folded_name in self._folded:
+            return self._folded[folded_name]
+        if not REGEX_SPECIAL_CHARS.intersection(playlist_name):
+            return self.match_prefix(folded_name)
+        pattern = compile_playlist_pattern(playlist_name)
+        for position, playlist in enumerate(self.data):
+            if pattern.match(playlist['name']):
+                return position
+        return None
+
+    def load_tracks(self, playlist):
+        """Set the entries of a playlist, fetching them only if they are not in the snapshot."""
+        if 'tracks' in playlist:
+            return playlist
+        tracks = self.snapshot.get_tracks(playlist) if self.snapshot else None
+        if tracks is None:
+            logging.info("fetching entries of playlist %s", to_safe_print(playlist['name']))
+            tracks = self.get_shared_playlist_tracks(playlist) if playlist.get('shareToken') else None
+            if not tracks:
+                tracks = self.get_user_playlist_tracks(playlist['id'])
+            if self.snapshot:
+                self.snapshot.set_tracks(playlist, tracks)
+        playlist['tracks'] = tracks
+        return playlist
+
+    def get_shared_playlist_tracks(self, playlist):
+        """
+        Fetch the entries of a playlist by its share token, with a request for just that playlist.
+
+        gmusicapi only documents this for public playlists, so return None if it fails or finds no
+        entries, and the contents of every user playlist are fetched instead.
+        """
+        try:
+            tracks = self.api.get_shared_playlist_contents(playlist['shareToken'])
+        except Exception:
+            logging.info("could not fetch playlist %s by its share token: %s",
+                         to_safe_print(playlist['name']), traceback.format_exc())
+            return None
+        return [to_track_record(entry) for entry in tracks or []]
+
+    def get_user_playlist_tracks(self, playlist_id):
+        """
+        Fall back to fetching the contents of every playlist to get the entries of one.
+
+        The contents are fetched at most once, and the records of every playlist in the library are
+        kept until that playlist is loaded.
+        """
+        if self._user_tracks is None:
+            known_ids = {playlist['id'] for playlist in self.data}
+            self._user_tracks = {
+                playlist['id']: [to_track_record(entry) for entry in playlist.get('tracks', [])]
+                for playlist in self.api.get_all_user_playlist_contents()
+                if playlist['id'] in known_ids
+            }
+        return self._user_tracks.pop(playlist_id, [])
+
+    def invalidate(self, playlist):
+        """Forget the saved entries of a playlist which has been changed during this run."""
+        if self.snapshot:
+            self.snapshot.invalidate(playlist['id'])
 
     def find_playlist(self, playlist_name):
+        position = self.match_playlist(playlist_name)
+        if position is None:
+            raise PlaylistNotFoundException("no playlist matched search string: %s",
+                                            repr(playlist_name))
 
-        for playlist in self.data:
-            logging.debug('found %s %s', to_safe_print(playlist['name']),
-                          to_safe_print(playlist['id']))
-            if re.match(playlist_name, playlist['name'], re.I):
-                logging.info("found target playlist %s", pformat(playlist))
-                return playlist
+        playlist = self.load_tracks(self.data[position])
+        logging.info("found target playlist %s with id %s and %d tracks",
+                     to_safe_print(playlist['name']), to_safe_print(playlist['id']),
+                     len(playlist['tracks']))
+        return playlist
 
-        raise PlaylistNotFoundException("no playlist matched search string: %s",
-                                        repr(playlist_name))
+    def find_playlists(self, playlist_names):
+        """Find several playlists at once, returned in the same order as their names."""
+        return [self.find_playlist(playlist_name) for playlist_name in playlist_names]
 
     def find_or_create_playlist(self, playlist_name):
         try:
             return self.find_playlist(playlist_name)
         except PlaylistNotFoundException:
-            return {
+            playlist = {
                 'name': playlist_name,
                 'id': self.api.create_playlist(playlist_name)
             }
+            self.data.append(playlist)
+            self.build_index()
+            return playlist
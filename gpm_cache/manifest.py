@@ -0,0 +1,126 @@
+"""
+Persistent index of the tracks which have been cached.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .download import hash_file
+
+MANIFEST_FILENAME = 'gpm-cache.sqlite3'
+
+COLUMNS = ('track_id', 'path', 'size', 'sha1', 'tag_version', 'cached_at', 'track')
+
+
+class Manifest(object):
+    """SQLite backed record of each cached track, keyed by trackId."""
+
+    def __init__(self, path):
+        path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "track_id TEXT PRIMARY KEY, "
+                "path TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "sha1 TEXT NOT NULL, "
+                "tag_version INTEGER NOT NULL, "
+                "cached_at REAL NOT NULL, "
+                "track TEXT)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(tracks)")]
+            if 'track' not in columns:
+                self._conn.execute("ALTER TABLE tracks ADD COLUMN track TEXT")
+
+    @staticmethod
+    def get_path(parser_args):
+        """Return the path given by --manifest, or the default one in the cache location."""
+        path = parser_args.manifest
+        if path is None:
+            path = os.path.join(parser_args.cache_location, MANIFEST_FILENAME)
+        return os.path.expanduser(path)
+
+    @classmethod
+    def from_parser_args(cls, parser_args):
+        """Open the manifest given by --manifest, or the default one in the cache location."""
+        return cls(cls.get_path(parser_args))
+
+    @staticmethod
+    def to_record(row):
+        record = dict(zip(COLUMNS, row))
+        record['track'] = json.loads(record['track']) if record['track'] else None
+        return record
+
+    def get(self, track_id):
+        """Return the record for a track as a dict, or None if it has not been cached."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT %s FROM tracks WHERE track_id = ?" % ", ".join(COLUMNS), (track_id, )
+            ).fetchone()
+        if row is None:
+            return None
+        return self.to_record(row)
+
+    def iter_records(self):
+        """Yield the record of every cached track."""
+        with self._lock:
+            rows = self._conn.execute("SELECT %s FROM tracks" % ", ".join(COLUMNS)).fetchall()
+        for row in rows:
+            yield self.to_record(row)
+
+    def is_cached(self, track_id, tag_version):
+        """
+        Determine if a track is already cached with the given tag version.
+
+        Only the size of the file on disk is checked, its contents are not hashed.
+        """
+        record = self.get(track_id)
+        if record is None or record['tag_version'] != tag_version:
+            return False
+        try:
+            return os.path.getsize(record['path']) == record['size']
+        except OSError:
+            return False
+
+    def record(self, track_id, path, tag_version, track=None, sha1=None):
+        """
+        Record that a track has been cached to path, along with its metadata if given.
+
+        The sha1 of the file is read from its contents, unless it was computed while downloading.
+        """
+        size = os.path.getsize(path)
+        sha1 = sha1 or hash_file(path, hashlib.sha1()).hexdigest()
+        track = json.dumps(track) if track else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tracks (%s) VALUES (?, ?, ?, ?, ?, ?, ?)" % ", ".join(COLUMNS),
+                (track_id, path, size, sha1, tag_version, time.time(), track)
+            )
+
+    def merge(self, path):
+        """Copy every record from the manifest at path into this one, returning how many were copied."""
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            return 0
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS other", (path, ))
+            try:
+                with self._conn:
+                    cursor = self._conn.execute(
+                        "INSERT OR REPLACE INTO tracks (%s) SELECT %s FROM other.tracks" % (
+                            ", ".join(COLUMNS), ", ".join(COLUMNS)))
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,117 @@
+"""
+Timers and counters of each stage of caching a track, exported as JSON or a Prometheus textfile.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+PERCENTILES = (50, 90, 99)
+
+METRIC_PREFIX = 'gpm_cache'
+
+
+def percentile(samples, pct):
+    """Return the pct percentile of samples, which must be sorted, by the nearest rank."""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels
+    )
+
+
+class Metrics(object):
+    """
+    Durations of each stage, and counters such as bytes downloaded and failures, from any thread.
+
+    Counters may have labels, such as the type of exception which caused a failure.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)
+        self._counters = defaultdict(int)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the body of a with statement as one sample of stage, whether or not it raises."""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(stage, self.clock() - start)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._durations[stage].append(seconds)
+
+    def count(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def summary(self):
+        """Return a dict of the count, total and percentiles of each stage, and every counter."""
+        with self._lock:
+            durations = {stage: sorted(samples) for stage, samples in self._durations.items()}
+            counters = dict(self._counters)
+        response = {'stages': {}, 'counters': {}}
+        for stage, samples in sorted(durations.items()):
+            response['stages'][stage] = dict(
+                count=len(samples), total=sum(samples), max=samples[-1],
+                **{"p%d" % pct: percentile(samples, pct) for pct in PERCENTILES})
+        for (name, labels), value in sorted(counters.items()):
+            response['counters'][name + format_labels(labels)] = value
+        return response
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            durations = {stage: sorted(samples) for stage, samples in self._durations.items()}
+            counters = dict(self._counters)
+        lines = [
+            "# HELP %s_stage_seconds Time taken by each stage of caching a track" % METRIC_PREFIX,
+            "# TYPE %s_stage_seconds summary" % METRIC_PREFIX,
+        ]
+        for stage, samples in sorted(durations.items()):
+            for pct in PERCENTILES:
+                lines.append("%s_stage_seconds%s %r" % (
+                    METRIC_PREFIX, format_labels([('stage', stage), ('quantile', pct / 100.0)]),
+                    percentile(samples, pct)))
+            labels = format_labels([('stage', stage)])
+            lines.append("%s_stage_seconds_sum%s %r" % (METRIC_PREFIX, labels, sum(samples)))
+            lines.append("%s_stage_seconds_count%s %d" % (METRIC_PREFIX, labels, len(samples)))
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            lines.append("# TYPE %s_%s_total counter" % (METRIC_PREFIX, name))
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append("%s_%s_total%s %r" % (METRIC_PREFIX, name, format_labels(labels),
+                                                       value))
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.summary(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path):
+        """Write a textfile for the node exporter's textfile collector, replacing it atomically."""
+        write_atomic(path, self.to_prometheus())
+
+
+def write_atomic(path, contents):
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, 'w') as metrics_file:
+        metrics_file.write(contents)
+    os.replace(tmp_path, path)
@@ -0,0 +1,177 @@
+"""
+Progress of a run: tracks completed, failed and remaining, bytes per second and an ETA.
+"""
+
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+from argparse import ArgumentTypeError
+from collections import deque
+
+from .metrics import write_atomic
+
+WINDOW = 30
+INTERVAL = 5.0
+
+
+def parse_udp_address(value):
+    """Parse a --progress-udp of the form HOST:PORT, where HOST defaults to localhost."""
+    host, _, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ArgumentTypeError("expected HOST:PORT, such as localhost:9999, got %r" % value)
+    if not 0 < port < 65536:
+        raise ArgumentTypeError("the port must be from 1 to 65535, got %d" % port)
+    return host or 'localhost', port
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+class Progress(object):
+    """
+    Counts of the tracks in a run, and the bytes downloaded over the last `window` seconds.
+
+    Bytes are added from the download loop, once per chunk, so only a running total for the current
+    second is updated then. Rates and the ETA are only worked out when status is called.
+    """
+
+    def __init__(self, total=0, window=WINDOW, clock=time.monotonic):
+        self.total = total
+        self.window = window
+        self.clock = clock
+        self.started = clock()
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self._buckets = deque()
+        self._lock = threading.Lock()
+
+    def add_total(self, tracks):
+        with self._lock:
+            self.total += tracks
+
+    def add_bytes(self, size):
+        second = int(self.clock())
+        with self._lock:
+            self.bytes += size
+            if self._buckets and self._buckets[-1][0] == second:
+                self._buckets[-1][1] += size
+            else:
+                self._buckets.append([second, size])
+                while self._buckets[0][0] <= second - self.window:
+                    self._buckets.popleft()
+
+    def track_done(self, success=True):
+        with self._lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def status(self):
+        """Return a dict of the counts of tracks, bytes per second and ETA in seconds."""
+        now = self.clock()
+        with self._lock:
+            done = self.completed + self.failed
+            status = {
+                'total': self.total,
+                'completed': self.completed,
+                'failed': self.failed,
+                'remaining': max(self.total - done, 0),
+                'bytes': self.bytes,
+            }
+            window_bytes = sum(size for second, size in self._buckets if second > now - self.window)
+        elapsed = now - self.started
+        status['elapsed'] = elapsed
+        status['bytes_per_sec'] = window_bytes / max(min(elapsed, self.window), 1e-9)
+        status['eta'] = elapsed / done * status['remaining'] if done else None
+        return status
+
+
+class ProgressReporter(object):
+    """
+    Report the status of a Progress every interval seconds, from a daemon thread.
+
+    The status is rendered on a single line of stream if it is a TTY, written as JSON to
+    status_path, and sent as a JSON datagram to the (host, port) of udp_address, as given.
+    """
+
+    def __init__(self, progress, interval=INTERVAL, stream=None, status_path=None,
+                 udp_address=None):
+        self.progress = progress
+        self.interval = interval
+        self.stream = stream if stream is not None and stream.isatty() else None
+        self.status_path = status_path
+        self.udp_address = udp_address
+        self._socket = None
+        if udp_address:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._closed = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_parser_args(cls, progress, parser_args):
+        """Build a reporter from --progress-interval, --progress-file and --progress-udp."""
+        return cls(progress, parser_args.progress_interval, sys.stderr, parser_args.progress_file,
+                   parser_args.progress_udp)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def render(status):
+        return "[%*d/%d] %d failed, %d left, %.2f MiB/s, ETA %s" % (
+            len(str(status['total'])), status['completed'] + status['failed'], status['total'],
+            status['failed'], status['remaining'], status['bytes_per_sec'] / 2 ** 20,
+            format_duration(status['eta']))
+
+    def report(self):
+        status = self.progress.status()
+        try:
+            if self.stream:
+                self.stream.write("\r%s" % self.render(status))
+                self.stream.flush()
+            if self.status_path:
+                write_atomic(self.status_path, json.dumps(status, sort_keys=True))
+            if self._socket:
+                self._socket.sendto(json.dumps(status, sort_keys=True).encode('utf-8'),
+                                    self.udp_address)
+        except (IOError, OSError):
+            logging.debug("could not report progress", exc_info=True)
+        return status
+
+    def start(self):
+        if self.interval and (self.stream or self.status_path or self._socket):
+            self._thread = threading.Thread(target=self._report_periodically, name='progress')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _report_periodically(self):
+        while not self._closed.wait(self.interval):
+            self.report()
+
+    def close(self):
+        """Stop reporting, and report the final status."""
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+        status = self.report()
+        if self.stream:
+            self.stream.write("\n")
+        if self._socket:
+            self._socket.close()
+        logging.info("progress: %s", json.dumps(status, sort_keys=True))
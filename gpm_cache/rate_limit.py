@@ -0,0 +1,67 @@
+"""
+Rate limiting helpers shared between caching workers.
+"""
+
+import threading
+import time
+
+STREAM = 'stream'
+MUTATION = 'mutation'
+ART = 'art'
+ENDPOINTS = (STREAM, MUTATION, ART)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket which refills at `rate` tokens per second up to `capacity`.
+
+    Callers which find the bucket empty reserve their token in advance and sleep until it is
+    due, so waiters are served in order. A rate of None or 0 never limits.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate) if rate else None
+        self.capacity = max(float(capacity), 1.0)
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = None
+
+    def acquire(self, tokens=1):
+        """Take tokens from the bucket, blocking until they are available."""
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = self.clock()
+            if self._updated is not None:
+                elapsed = max(now - self._updated, 0)
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+
+class RateLimiter(object):
+    """Keep a separate token bucket for each class of endpoint."""
+
+    def __init__(self, rate, burst=1, endpoints=ENDPOINTS, clock=time.monotonic, sleep=time.sleep):
+        self.buckets = {
+            endpoint: TokenBucket(rate, burst, clock=clock, sleep=sleep)
+            for endpoint in endpoints
+        }
+
+    @classmethod
+    def from_parser_args(cls, parser_args):
+        """Build a limiter from --rate-limit, falling back to the legacy --sleep-time."""
+        rate = parser_args.rate_limit
+        if rate is None and parser_args.sleep_time:
+            rate = 1.0 / parser_args.sleep_time
+        return cls(rate, parser_args.rate_burst)
+
+    def wait(self, endpoint=STREAM):
+        """Block until the caller is allowed to make another request to the endpoint."""
+        return self.buckets[endpoint].acquire()
@@ -1,22 +1,37 @@
 import re
-from six import binary_type, iterbytes, text_type, u, unichr  # noqa: W0611
+from functools import lru_cache
+
+from six import binary_type, text_type, u  # noqa: W0611
 
 FILENAME_KEEP_CHARS = (' ', '.', '_')
 
+FILENAME_CACHE_SIZE = 1024
+
+# bytes are decoded as latin-1 so that each byte maps to the code point of the same value, then
+# every byte outside of printable ASCII is replaced by its escape sequence.
+BYTE_ESCAPES = {c: u"\\x%02x" % (c, ) for c in range(0x7f, 0x100)}
+
+RE_FILENAME_DISCARD = re.compile(
+    "[^%s]+" % ("A-Za-z0-9" + re.escape("".join(FILENAME_KEEP_CHARS)))
+)
+
 
 def to_safe_print(thing, errors='backslashreplace'):
     """Take a stringable object of any type, returns a safe ASCII byte str."""
     if isinstance(thing, binary_type):
-        thing = u"".join([(unichr(c) if (c in range(0x7f)) else "\\x%02x" % (c, ))
-                          for c in iterbytes(thing)])
-        # thing = thing.decode('ascii', errors=errors)
+        thing = thing.decode('latin-1').translate(BYTE_ESCAPES)
     elif not isinstance(thing, text_type):
         thing = text_type(thing)
     return thing.encode('ascii', errors=errors).decode('ascii')
 
 
+@lru_cache(maxsize=FILENAME_CACHE_SIZE)
+def _to_safe_filename(thing):
+    return RE_FILENAME_DISCARD.sub("", to_safe_print(thing, errors='ignore')).rstrip()
+
+
 def to_safe_filename(thing):
     """Take a stringable object and return an ASCII string safe for filenames."""
-    thing = to_safe_print(thing, errors='ignore')
-    re_keep_characters = "[%s]" % ("A-Za-z0-9" + re.escape("".join(FILENAME_KEEP_CHARS)))
-    return "".join(c for c in thing if re.match(re_keep_characters, c)).rstrip()
+    if not isinstance(thing, (binary_type, text_type)):
+        thing = text_type(thing)
+    return _to_safe_filename(thing)
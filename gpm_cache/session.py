@@ -0,0 +1,46 @@
+"""
+Shared HTTP sessions, so that connections are pooled and kept alive between fetches.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .download import POOL_SIZE, TIMEOUT  # noqa: F401
+
+_DEFAULT_SESSION = None
+_DEFAULT_SESSION_LOCK = threading.Lock()
+
+
+class PooledSession(requests.Session):
+    """Session with a connection pool of a given size and a default timeout for every request."""
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT, keep_alive=True):
+        super(PooledSession, self).__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+
+    @classmethod
+    def from_parser_args(cls, parser_args):
+        """Build a session with a pool large enough for every worker to fetch at once."""
+        pool_size = parser_args.pool_size or max(POOL_SIZE, 2 * parser_args.workers)
+        return cls(pool_size=pool_size, timeout=parser_args.timeout,
+                   keep_alive=not parser_args.no_keep_alive)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(PooledSession, self).request(method, url, **kwargs)
+
+
+def get_default_session():
+    """Return the session shared by fetches which are not given one explicitly."""
+    global _DEFAULT_SESSION
+    with _DEFAULT_SESSION_LOCK:
+        if _DEFAULT_SESSION is None:
+            _DEFAULT_SESSION = PooledSession()
+        return _DEFAULT_SESSION
@@ -0,0 +1,226 @@
+"""
+Sharding of one run over several processes or hosts which share a cache location.
+
+Each shard downloads the tracks whose trackId hashes to it, and claims each track with a file in the
+cache location just before downloading it, so no two shards download the same track even if they
+are started with different shard counts. The claims on cached tracks are kept until the shards are
+merged. Shards record what they cached in their own manifest, and a final run with --merge-shards
+merges them before changing any playlists.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from argparse import ArgumentTypeError
+
+from .exceptions import IncompleteShardsException
+from .metrics import write_atomic
+from .sanitation_helper import to_safe_filename
+from .store import makedirs
+
+SHARD_DIRNAME = '.shards'
+CLAIM_TTL = 6 * 60 * 60.0
+
+
+def parse_shard(value):
+    """Parse a --shard of the form INDEX/COUNT, where INDEX counts from 0."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ArgumentTypeError("expected INDEX/COUNT, such as 0/4, got %r" % value)
+    if not 0 <= index < count:
+        raise ArgumentTypeError("the shard index must be from 0 to %d, got %d" % (count - 1, index))
+    return index, count
+
+
+def shard_of(track_id, count):
+    """Return the shard of a track, from a hash of its trackId which is the same on every host."""
+    return int(hashlib.sha1(track_id.encode('utf-8')).hexdigest()[:8], 16) % count
+
+
+def get_shard_name(index, count):
+    return "%d-of-%d" % (index, count)
+
+
+def get_shard_filepath(cache_location, index, count, kind, extension):
+    """Determine where a file belonging to one shard, such as its manifest, is kept."""
+    return os.path.join(os.path.expanduser(cache_location), SHARD_DIRNAME,
+                        "%s-%s%s" % (kind, get_shard_name(index, count), extension))
+
+
+def get_manifest_path(cache_location, index, count):
+    return get_shard_filepath(cache_location, index, count, 'manifest', '.sqlite3')
+
+
+def get_snapshot_path(cache_location, index, count):
+    return get_shard_filepath(cache_location, index, count, 'library-snapshot', '.jsonl')
+
+
+def get_journal_path(cache_location, index, count):
+    return get_shard_filepath(cache_location, index, count, 'journal', '.jsonl')
+
+
+def get_summary_path(cache_location, index, count):
+    return get_shard_filepath(cache_location, index, count, 'summary', '.json')
+
+
+def get_claims_root(cache_location):
+    return os.path.join(os.path.expanduser(cache_location), SHARD_DIRNAME, 'claims')
+
+
+def write_summary(cache_location, index, count, **summary):
+    """Write the summary of a shard, which marks it as finished."""
+    summary = dict(summary, shard=get_shard_name(index, count), finished_at=time.time())
+    write_atomic(get_summary_path(cache_location, index, count), json.dumps(summary, sort_keys=True))
+
+
+def merge_shards(manifest, cache_location, count):
+    """
+    Merge the manifests of count shards into manifest, and return the summary of each shard.
+
+    The manifests and summaries of the shards, and every claim, are removed once merged. Raise
+    IncompleteShardsException, without merging anything, if any shard has not finished.
+    """
+    unfinished = [
+        get_shard_name(index, count) for index in range(count)
+        if not os.path.exists(get_summary_path(cache_location, index, count))
+    ]
+    if unfinished:
+        raise IncompleteShardsException("shards have not finished: %s" % ", ".join(unfinished))
+
+    summaries = []
+    for index in range(count):
+        merged = manifest.merge(get_manifest_path(cache_location, index, count))
+        with open(get_summary_path(cache_location, index, count)) as summary_file:
+            summaries.append(json.load(summary_file))
+        logging.info("merged %d tracks from shard %s", merged, get_shard_name(index, count))
+    for index in range(count):
+        os.remove(get_summary_path(cache_location, index, count))
+        if os.path.exists(get_manifest_path(cache_location, index, count)):
+            os.remove(get_manifest_path(cache_location, index, count))
+    shutil.rmtree(get_claims_root(cache_location), ignore_errors=True)
+    return summaries
+
+
+class ShardResults(object):
+    """The entries cached by a shard, collected in place of the mutations made by a whole run."""
+
+    def __init__(self):
+        self.cached = []
+        self._lock = threading.Lock()
+
+    def track_cached(self, entry, cached_playlist=None):
+        with self._lock:
+            self.cached.append(entry['id'])
+
+
+class ClaimStore(object):
+    """
+    Claims on tracks, each a file in the cache location which is created only if it does not exist.
+
+    A claim names its owner, the host and shard, so a shard which is run again after a crash can
+    take back its own claims. Claims older than ttl seconds are broken by renaming them aside. The
+    renamed claim is checked again, and put back if it is not the expired claim which was seen, as
+    when a slower shard renames the fresh claim of a shard which broke it first. Once a track is
+    cached its claim is completed, and a completed claim is never broken, so the track is not
+    downloaded again by a shard which cannot see the manifest of the shard which cached it.
+    """
+
+    def __init__(self, cache_location, owner, ttl=CLAIM_TTL, clock=time.time):
+        self.root = get_claims_root(cache_location)
+        self.owner = owner
+        self.ttl = ttl
+        self.clock = clock
+        self.claimed = set()
+
+    @classmethod
+    def from_parser_args(cls, parser_args):
+        """Build the claims of the shard given by --shard, expiring after --claim-ttl seconds."""
+        owner = "%s %s" % (socket.gethostname(), get_shard_name(*parser_args.shard))
+        return cls(parser_args.cache_location, owner, parser_args.claim_ttl)
+
+    def get_claim_path(self, track_id):
+        shard = hashlib.md5(track_id.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.root, shard, "%s.claim" % to_safe_filename(track_id))
+
+    @staticmethod
+    def get_done_path(claim_path):
+        return "%s.done" % claim_path
+
+    def claim(self, track_id):
+        """Claim a track, returning False if it is claimed by another owner or already cached."""
+        claim_path = self.get_claim_path(track_id)
+        makedirs(os.path.dirname(claim_path))
+        if os.path.exists(self.get_done_path(claim_path)):
+            return False
+        claimed = self._create(claim_path) or self.get_owner(claim_path) == self.owner
+        if not claimed and self.is_expired(claim_path):
+            owner = self.get_owner(claim_path)
+            logging.warning("breaking expired claim on %s held by %s", track_id, owner)
+            self._break(claim_path, owner)
+            claimed = self._create(claim_path)
+        if claimed:
+            self.claimed.add(track_id)
+        return claimed
+
+    def _create(self, claim_path):
+        try:
+            claim_fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(claim_fd, 'w') as claim_file:
+            claim_file.write(self.owner)
+        return True
+
+    def _break(self, claim_path, owner):
+        """Remove the expired claim of owner, putting back a claim which replaced it meanwhile."""
+        broken_path = "%s.%d.broken" % (claim_path, os.getpid())
+        try:
+            os.rename(claim_path, broken_path)
+        except FileNotFoundError:
+            return
+        if not self.is_expired(broken_path) or self.get_owner(broken_path) != owner:
+            logging.info("putting back claim %s, which was renewed", claim_path)
+            try:
+                os.link(broken_path, claim_path)
+            except FileExistsError:
+                pass
+        os.remove(broken_path)
+
+    @staticmethod
+    def get_owner(claim_path):
+        try:
+            with open(claim_path) as claim_file:
+                return claim_file.read()
+        except (IOError, OSError):
+            return None
+
+    def is_expired(self, claim_path):
+        try:
+            return os.path.getmtime(claim_path) < self.clock() - self.ttl
+        except OSError:
+            return True
+
+    def complete(self, track_id):
+        """Mark the claim on a track which has been cached, so that it is kept until the merge."""
+        claim_path = self.get_claim_path(track_id)
+        if self.get_owner(claim_path) == self.owner:
+            os.replace(claim_path, self.get_done_path(claim_path))
+        self.claimed.discard(track_id)
+
+    def release(self, track_id):
+        """Remove the claim on a track, if this owner holds it."""
+        claim_path = self.get_claim_path(track_id)
+        if self.get_owner(claim_path) == self.owner:
+            os.remove(claim_path)
+        self.claimed.discard(track_id)
+
+    def release_all(self):
+        """Remove the claims on every track which was claimed but not cached."""
+        for track_id in list(self.claimed):
+            self.release(track_id)
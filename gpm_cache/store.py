@@ -0,0 +1,75 @@
+"""
+Content store of cached tracks, with each layout of the cache built as links into it.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+from functools import lru_cache
+
+from .sanitation_helper import to_safe_filename, to_safe_print
+
+STORE_DIRNAME = '.store'
+
+DIR_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=DIR_CACHE_SIZE)
+def makedirs(path):
+    """
+    Create a directory and its parents, only calling os.makedirs the first time for each path.
+
+    Directories are assumed not to be removed while the cache is being written to.
+    """
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def fsync_path(path):
+    """
+    Flush the contents of a file, or the entries of a directory, to disk.
+
+    Directories cannot be opened to be flushed on Windows, where this does nothing for them.
+    """
+    if os.name == 'nt' and os.path.isdir(path):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TrackStore(object):
+    """
+    One copy of each cached track, keyed by trackId.
+
+    The files in each cache layout are hard links to the copy in the store, or symbolic links on
+    filesystems which do not support hard links, so layouts can be rebuilt without downloading.
+    """
+
+    def __init__(self, cache_location):
+        self.root = os.path.join(os.path.expanduser(cache_location), STORE_DIRNAME)
+
+    def get_blob_path(self, track_id):
+        """Determine where the copy of a track is stored."""
+        shard = hashlib.md5(track_id.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.root, shard, "%s.mp3" % to_safe_filename(track_id))
+
+    def link_view(self, blob_path, view_path):
+        """Link view_path to the copy of a track at blob_path, replacing any other file there."""
+        if os.path.lexists(view_path):
+            if os.path.exists(view_path) and os.path.samefile(blob_path, view_path):
+                return view_path
+            os.remove(view_path)
+        makedirs(os.path.dirname(view_path))
+        try:
+            os.link(blob_path, view_path)
+        except OSError as exc:
+            if exc.errno not in (errno.EPERM, errno.EXDEV, errno.EMLINK, errno.ENOTSUP):
+                raise
+            logging.debug("could not hard link %s, falling back to a symlink: %s",
+                          to_safe_print(view_path), exc)
+            os.symlink(os.path.relpath(blob_path, os.path.dirname(view_path)), view_path)
+        return view_path
@@ -0,0 +1,76 @@
+"""
+Build and write ID3 tags for cached tracks.
+"""
+
+from functools import lru_cache
+from io import BytesIO
+
+# Bump this whenever the tags written for a track change, so that cached tracks are refreshed.
+TAG_VERSION = 1
+
+# Space reserved after the tags, so that they can be rewritten without moving the audio.
+ID3_PADDING = 16 * 1024
+
+# The number of album covers kept in memory, enough for the albums in flight across workers.
+ART_CACHE_SIZE = 32
+
+# mutagen is only imported once a track is tagged, to keep startup fast, so frames are named here
+ID3_FRAMES = {
+    'artist': 'TPE1',
+    'albumartist': 'TPE2',
+    'title': 'TIT2',
+    'album': 'TALB',
+    'genre': 'TCON',
+    'tracknumber': 'TRCK',
+    'discnumber': 'TPOS',
+    'date': 'TDRC',
+}
+
+
+@lru_cache(maxsize=ART_CACHE_SIZE)
+def read_album_art(album_art_path):
+    """Read the cover at album_art_path, which is only read once for all tracks in an album."""
+    with open(album_art_path, 'rb') as albumart:
+        return albumart.read()
+
+
+def get_padding(info):
+    """Reuse the existing padding if the new tags fit, otherwise reserve ID3_PADDING."""
+    if info.padding >= 0:
+        return info.padding
+    return ID3_PADDING
+
+
+def build_id3(track_info, album_art=None, tags=None):
+    """Set every frame for track_info and its cover on tags, or on new tags if none are given."""
+    from mutagen import id3
+
+    tags = id3.ID3() if tags is None else tags
+    for meta_key, meta_val in track_info.id3_meta.items():
+        frame_name = ID3_FRAMES[meta_key]
+        tags.setall(frame_name, [getattr(id3, frame_name)(encoding=3, text=[meta_val])])
+    if album_art:
+        tags.setall('APIC', [id3.APIC(encoding=3, mime='image/jpeg', type=3, desc=u'Cover', data=album_art)])
+    return tags
+
+
+def render_id3(track_info, album_art_path=None):
+    """
+    Render the tags for track_info as the bytes of an ID3v2 header, with ID3_PADDING.
+
+    The header can be written to a file ahead of the audio, so that the file never needs tagging.
+    """
+    album_art = read_album_art(album_art_path) if album_art_path else None
+    header = BytesIO()
+    build_id3(track_info, album_art).save(header, padding=lambda info: ID3_PADDING)
+    return header.getvalue()
+
+
+def load_id3(local_filepath):
+    """Load the existing tags from a file, or new empty tags if it has none."""
+    from mutagen.id3 import ID3, ID3NoHeaderError
+
+    try:
+        return ID3(local_filepath)
+    except ID3NoHeaderError:
+        return ID3()
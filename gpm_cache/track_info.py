@@ -1,58 +1,131 @@
 from six import b, binary_type, iterbytes, text_type, u, unichr  # noqa: W0611
 
+# (id3 key, track_info key) of each tag written to a cached track.
+ID3_FIELDS = (
+    ('artist', 'artist'),
+    ('albumartist', 'albumArtist'),
+    ('title', 'title'),
+    ('album', 'album'),
+    ('genre', 'genre'),
+    ('tracknumber', 'trackNumber'),
+    ('discnumber', 'discNumber'),
+    ('date', 'year'),
+)
+
+# Keys of the GPM track dict which are kept, everything else is dropped.
+TRACK_FIELDS = (
+    'title', 'artist', 'albumArtist', 'composer', 'album', 'genre', 'trackNumber', 'discNumber',
+    'year', 'albumId', 'estimatedSize', 'durationMillis',
+)
+
+# Bytes per millisecond of a 320kbps stream, used to estimate the size of tracks without one.
+BYTES_PER_MILLI = 320 * 1000 // 8 // 1000
+
 
 class TrackInfo(object):
-    """Helper class stores information about a track."""
+    """
+    Helper class stores information about a track.
+
+    Only the fields needed to file and tag the track are kept from the GPM track dict, and the
+    filing names and tags are computed once, so the dict does not need to be held onto. Instances
+    are immutable.
+    """
+    __slots__ = (
+        'track_id', 'album_art_url', 'filing_artist', 'filing_album', 'filing_title', '_fields',
+        '_id3_values',
+    )
+
     def __init__(self, track_id, track_info):
         track_info = track_info or {}
-        self.track_id = track_id
-        self.track_info = track_info
+        try:
+            album_art_url = track_info['albumArtRef'][0]['url']
+        except (KeyError, IndexError, TypeError):
+            album_art_url = None
+        setattr_ = super(TrackInfo, self).__setattr__
+        setattr_('track_id', track_id)
+        setattr_('album_art_url', album_art_url)
+        setattr_('_fields', tuple(track_info.get(key) for key in TRACK_FIELDS))
+        setattr_('_id3_values', tuple(
+            None if track_info.get(info_key) is None else text_type(track_info[info_key])
+            for _, info_key in ID3_FIELDS
+        ))
+        setattr_('filing_artist', self.get_filing_artist(track_info))
+        setattr_('filing_album', self.get_filing_album(track_info))
+        setattr_('filing_title', self.get_filing_title(track_id, track_info))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TrackInfo is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("TrackInfo is immutable")
+
+    def __repr__(self):
+        return "TrackInfo(%r, %r)" % (self.track_id, self.to_dict())
+
+    def __eq__(self, other):
+        if not isinstance(other, TrackInfo):
+            return NotImplemented
+        return (self.track_id, self._fields, self.album_art_url) == \
+            (other.track_id, other._fields, other.album_art_url)
+
+    def __hash__(self):
+        return hash((self.track_id, self._fields, self.album_art_url))
+
+    @property
+    def album_id(self):
+        return self._fields[TRACK_FIELDS.index('albumId')]
 
     @property
     def id3_meta(self):
         """Return the id3 tags for this object."""
+        return {
+            meta_key: meta_val
+            for (meta_key, _), meta_val in zip(ID3_FIELDS, self._id3_values) if meta_val is not None
+        }
 
-        response = {}
-        for meta_key, info_key, mapping_fn in [
-            ('artist', 'artist', text_type),
-            ('albumartist', 'albumArtist', text_type),
-            ('title', 'title', text_type),
-            ('album', 'album', text_type),
-            ('genre', 'genre', text_type),
-            ('tracknumber', 'trackNumber', text_type),
-            ('discnumber', 'discNumber', text_type),
-            ('date', 'year', text_type),
-        ]:
-            if self.track_info.get(info_key) is not None:
-                response[meta_key] = mapping_fn(self.track_info.get(info_key))
+    @property
+    def estimated_size(self):
+        """Return the estimated size of the track's stream in bytes, or None if it is unknown."""
+        estimated_size = self._fields[TRACK_FIELDS.index('estimatedSize')]
+        if estimated_size is not None:
+            return int(estimated_size)
+        duration = self._fields[TRACK_FIELDS.index('durationMillis')]
+        if duration is not None:
+            return int(duration) * BYTES_PER_MILLI
+        return None
 
+    def to_dict(self):
+        """Return the kept fields as a GPM style track dict, from which an equal TrackInfo is made."""
+        response = {key: value for key, value in zip(TRACK_FIELDS, self._fields) if value is not None}
+        if self.album_art_url:
+            response['albumArtRef'] = [{'url': self.album_art_url}]
         return response
 
-    @property
-    def filing_artist(self):
-        """Return the artist under which this track should be filed."""
+    @staticmethod
+    def get_filing_artist(track_info):
+        """Return the artist under which a track should be filed."""
         filing_artists = \
             [
-                self.track_info.get(key) for key in
+                track_info.get(key) for key in
                 ['albumArtist', 'artist', 'composer']
-                if self.track_info.get(key)
+                if track_info.get(key)
             ]
         return filing_artists[0] if filing_artists else "Unknown Artist"
 
-    @property
-    def filing_album(self):
-        response = self.track_info.get('album') if self.track_info.get('album') else "Unkown Album"
-        # if self.track_info.get('discNumber'):
-        #     response = "%s - disc %s" % (response, self.track_info.get('discNumber'))
-        if self.track_info.get('year'):
-            response = "%s [%s]" % (response, self.track_info.get('year'))
+    @staticmethod
+    def get_filing_album(track_info):
+        response = track_info.get('album') if track_info.get('album') else "Unkown Album"
+        # if track_info.get('discNumber'):
+        #     response = "%s - disc %s" % (response, track_info.get('discNumber'))
+        if track_info.get('year'):
+            response = "%s [%s]" % (response, track_info.get('year'))
         return response
 
-    @property
-    def filing_title(self):
-        response = self.track_info.get('title') if self.track_info.get('title') else self.track_id
-        if self.track_info.get('trackNumber') is not None:
-            response = "%02d - %s" % (self.track_info.get('trackNumber'), response)
-            if self.track_info.get('discNumber') is not None:
-                response = "%02d:%s" % (self.track_info.get('discNumber'), response)
+    @staticmethod
+    def get_filing_title(track_id, track_info):
+        response = track_info.get('title') if track_info.get('title') else track_id
+        if track_info.get('trackNumber') is not None:
+            response = "%02d - %s" % (track_info.get('trackNumber'), response)
+            if track_info.get('discNumber') is not None:
+                response = "%02d:%s" % (track_info.get('discNumber'), response)
         return response
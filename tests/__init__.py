@@ -2,3 +2,17 @@ import os
 
 REPO_ROOT = os.path.dirname(os.path.dirname(__file__))
 TEST_DATA_DIR = os.path.join(REPO_ROOT, 'tests', 'test_data')
+
+
+class FakeClock(object):
+    """Clock which only advances when slept on, or when now is moved by a test."""
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
@@ -0,0 +1,86 @@
+# -*- coding: utf8 -*-
+import os
+import sys
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.album_art import AlbumArtStore
+finally:
+    sys.path = PATH
+
+
+def touch(filepath):
+    with open(filepath, 'wb') as art_file:
+        art_file.write(b'cover')
+
+
+class TestAlbumArtStore(unittest.TestCase):
+    """Test AlbumArtStore helper class."""
+    def setUp(self):
+        self.out_dir = mkdtemp()
+
+    def test_index_includes_flat_and_sharded_covers(self):
+        store = AlbumArtStore(self.out_dir)
+        sharded = store.fetch('Bsharded', touch)
+        touch(os.path.join(self.out_dir, 'Bflat.jpg'))
+        touch(os.path.join(self.out_dir, 'Bpartial.jpg.part'))
+
+        store = AlbumArtStore(self.out_dir)
+        self.assertEqual(store.get('Bsharded'), sharded)
+        self.assertEqual(store.get('Bflat'), os.path.join(self.out_dir, 'Bflat.jpg'))
+        self.assertIsNone(store.get('Bpartial'))
+
+    def test_cover_cached_by_another_process_is_used(self):
+        store = AlbumArtStore(self.out_dir)
+        other_store = AlbumArtStore(self.out_dir)
+        filepath = other_store.fetch('Balbum', touch)
+        downloads = []
+        self.assertEqual(store.fetch('Balbum', downloads.append), filepath)
+        self.assertEqual(downloads, [])
+
+    def test_fetch_is_sharded(self):
+        store = AlbumArtStore(self.out_dir)
+        filepath = store.fetch('Balbum', touch)
+        self.assertEqual(os.path.dirname(os.path.dirname(filepath)), self.out_dir)
+        self.assertTrue(os.path.exists(filepath))
+
+    def test_fetch_only_downloads_once(self):
+        store = AlbumArtStore(self.out_dir)
+        downloads = []
+
+        def slow_download(filepath):
+            downloads.append(filepath)
+            time.sleep(0.05)
+            touch(filepath)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(store.fetch('Balbum', slow_download)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(downloads), 1)
+        self.assertEqual(results, downloads * 8)
+
+    def test_failed_fetch_is_not_retried(self):
+        store = AlbumArtStore(self.out_dir)
+
+        def failing_download(filepath):
+            raise IOError("art server unavailable")
+
+        with self.assertRaises(IOError):
+            store.fetch('Balbum', failing_download)
+        self.assertIsNone(store.get('Balbum'))
+        self.assertIsNone(store.fetch('Balbum', touch))
+        self.assertFalse(os.path.exists(store.get_filepath('Balbum')))
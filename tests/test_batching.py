@@ -0,0 +1,95 @@
+# -*- coding: utf8 -*-
+import sys
+import time
+import unittest
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.batching import MutationBatcher, PlaylistMutations
+finally:
+    sys.path = PATH
+
+
+class TestMutationBatcher(unittest.TestCase):
+    """Test MutationBatcher helper class."""
+    def setUp(self):
+        self.batches = []
+
+    def test_flush_full_batches(self):
+        with MutationBatcher(self.batches.append, batch_size=2, flush_interval=None) as batcher:
+            batcher.extend(range(5))
+            self.assertEqual(self.batches, [[0, 1], [2, 3]])
+        self.assertEqual(self.batches, [[0, 1], [2, 3], [4]])
+        self.assertEqual(batcher.flushed, list(range(5)))
+
+    def test_flush_on_timer(self):
+        with MutationBatcher(self.batches.append, batch_size=10, flush_interval=0.01) as batcher:
+            batcher.add(0)
+            for _ in range(100):
+                if self.batches:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(self.batches, [[0]])
+
+    def test_failed_batches(self):
+        def flush_fn(batch):
+            if 0 in batch:
+                raise IOError("mutation failed")
+            self.batches.append(batch)
+
+        flushed = []
+        with MutationBatcher(flush_fn, batch_size=2, flush_interval=None,
+                             on_flushed=flushed.extend) as batcher:
+            batcher.extend(range(4))
+        self.assertEqual(batcher.failed, [0, 1])
+        self.assertEqual(flushed, [2, 3])
+
+
+class FakeApi(object):
+    def __init__(self, fail_track_ids=()):
+        self.fail_track_ids = set(fail_track_ids)
+        self.added = []
+        self.removed = []
+
+    def add_songs_to_playlist(self, playlist_id, track_ids):
+        if self.fail_track_ids.intersection(track_ids):
+            raise IOError("mutation failed")
+        self.added.append(track_ids)
+        return track_ids
+
+    def remove_entries_from_playlist(self, entry_ids):
+        self.removed.extend(entry_ids)
+        return entry_ids
+
+
+class TestPlaylistMutations(unittest.TestCase):
+    """Test PlaylistMutations helper class."""
+    def setUp(self):
+        self.playlist = {'id': 'cached_id', 'name': 'cached', 'tracks': []}
+        self.entries = [
+            {'id': 'e1', 'trackId': 't1'},
+            {'id': 'e2', 'trackId': 't2'},
+            {'id': 'e3', 'trackId': 't2'},
+            {'id': 'e4', 'trackId': 't3'},
+        ]
+
+    def cache_entries(self, api):
+        with PlaylistMutations(api, clear_source=True, batch_size=2, flush_interval=None) as mutations:
+            for entry in self.entries:
+                mutations.track_cached(entry, self.playlist)
+        return mutations
+
+    def test_repeated_track_added_once(self):
+        api = FakeApi()
+        self.cache_entries(api)
+        self.assertEqual(api.added, [['t1', 't2'], ['t3']])
+        self.assertEqual(sorted(api.removed), ['e1', 'e2', 'e3', 'e4'])
+
+    def test_entries_waiting_on_failed_add_are_kept(self):
+        api = FakeApi(fail_track_ids=['t2'])
+        mutations = self.cache_entries(api)
+        self.assertEqual(sorted(api.removed), ['e4'])
+        self.assertEqual(sorted(entry['id'] for entry in mutations.failed), ['e1', 'e2', 'e3'])
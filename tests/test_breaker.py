@@ -0,0 +1,106 @@
+# -*- coding: utf8 -*-
+import sys
+import threading
+import unittest
+
+from . import REPO_ROOT, FakeClock
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.breaker import PROBE_POLL, CircuitBreaker
+    from gpm_cache.exceptions import CircuitOpenException
+finally:
+    sys.path = PATH
+
+
+def run_in_thread(fn):
+    """Call fn from another thread, as another worker would, and return its result."""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(fn()))
+    thread.start()
+    thread.join()
+    return results[0]
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test CircuitBreaker helper class."""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(threshold=3, backoff_base=1, backoff_max=3, cooldown=100,
+                                      trips=1, clock=self.clock, sleep=self.clock.sleep,
+                                      jitter=lambda: 1.0)
+
+    def test_no_wait_without_failures(self):
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.breaker.before_call()
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_exponential_backoff(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.assertEqual(self.clock.sleeps, [1, 2])
+        self.breaker.record_success()
+        self.breaker.before_call()
+        self.assertEqual(self.clock.sleeps, [1, 2])
+
+    def test_backoff_capped_with_jitter(self):
+        self.breaker = CircuitBreaker(threshold=10, backoff_base=1, backoff_max=3,
+                                      clock=self.clock, sleep=self.clock.sleep, jitter=lambda: 0.5)
+        for _ in range(5):
+            self.breaker.record_failure()
+        self.breaker.before_call()
+        self.assertEqual(self.clock.sleeps, [1.5])
+
+    def test_trips_then_probes(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.tripped, 1)
+        self.breaker.before_call()
+        self.assertEqual(sum(self.clock.sleeps), 100)
+        # only the probe is let through until it succeeds or fails
+        self.assertEqual(run_in_thread(self.breaker._get_delay), PROBE_POLL)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker._get_delay(), 0)
+
+    def test_in_flight_failures_do_not_trip_again(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        for _ in range(5):
+            run_in_thread(self.breaker.record_failure)
+        self.assertEqual(self.breaker.tripped, 1)
+        self.assertFalse(self.breaker.aborted)
+        self.breaker.before_call()
+        run_in_thread(self.breaker.record_success)
+        self.assertTrue(self.breaker.is_open())
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.aborted)
+
+    def test_zero_backoff_still_waits_for_probe(self):
+        self.breaker.backoff_base = 0
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.breaker.before_call()
+        self.assertGreater(run_in_thread(self.breaker._get_delay), 0)
+
+    def test_successful_probe_resets_trips(self):
+        for _ in range(2):
+            for _ in range(3):
+                self.breaker.record_failure()
+            self.breaker.before_call()
+            self.breaker.record_success()
+            self.clock.now += 86400
+        self.assertEqual(self.breaker.tripped, 0)
+        self.assertFalse(self.breaker.aborted)
+
+    def test_aborts_after_trips(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.aborted)
+        with self.assertRaises(CircuitOpenException):
+            self.breaker.before_call()
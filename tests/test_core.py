@@ -5,6 +5,7 @@ Basic tests for gpm_cache.
 
 from __future__ import print_function, unicode_literals
 
+import errno
 import json
 import os
 import shlex
@@ -16,6 +17,7 @@ from mutagen.easyid3 import EasyID3
 from mutagen.id3 import ID3, APIC
 
 from gmusicapi import Mobileclient
+from gmusicapi.exceptions import CallFailure
 from six import MovedModule, add_move, b, u  # noqa: W0611
 
 from . import REPO_ROOT, TEST_DATA_DIR
@@ -24,9 +26,18 @@ try:
     PATH = sys.path[:]
     sys.path.insert(1, REPO_ROOT)
     import gpm_cache
-    from gpm_cache.core import main, get_local_filepath, maybe_download_album_art, save_meta
+    from gpm_cache.core import (main, build_plan, cache_entry, cache_playlists, cache_shard, cache_track,
+                                clean_staging, download_cover, get_local_filepath, get_parser_args,
+                                get_playlist_mappings, get_staging_filepath, maybe_download_album_art,
+                                move_tmp_to_final, prune_staging, rebuild_views, save_meta)
+    from gpm_cache.journal import DOWNLOADED, MOVED, URL_FETCHED, RunJournal
+    from gpm_cache.manifest import Manifest
+    from gpm_cache.album_art import get_album_art_store
+    from gpm_cache.store import TrackStore
     from gpm_cache.track_info import TrackInfo
-    from gpm_cache.exceptions import BadLoginException, PlaylistNotFoundException
+    from gpm_cache.exceptions import (BadLoginException, IncompleteShardsException,
+                                      PlaylistNotFoundException)
+    from gpm_cache.shard import ClaimStore
 finally:
     sys.path = PATH
 
@@ -37,6 +48,12 @@ finally:
     from mock import patch
 
 
+def touch(url, filename, **kwargs):
+    with open(filename, 'wb') as stream_file:
+        stream_file.write(b'data')
+    return filename
+
+
 class TestCore(unittest.TestCase):
     def setUp(self):
         with open(os.path.join(TEST_DATA_DIR, 'track_info.json')) as json_fp:
@@ -61,14 +78,55 @@ class TestCore(unittest.TestCase):
 
     def test_maybe_download_album_art(self):
         # Given
-        expected = self.out_dir + "/B52ucw7kgew7axvye5vldk6rxty.jpg"
+        expected = get_album_art_store(self.out_dir).get_filepath('B52ucw7kgew7axvye5vldk6rxty')
 
         # When
-        with patch.object(gpm_cache.core, 'write_stream_to_disk'):
+        with patch.object(gpm_cache.core, 'write_stream_to_disk', side_effect=touch) as mock_write:
             result = maybe_download_album_art(self.info_obj, self.out_dir)
+            maybe_download_album_art(self.info_obj, self.out_dir)
 
         # Then
         self.assertEqual(expected, result)
+        self.assertTrue(os.path.exists(expected))
+        mock_write.assert_called_once()
+
+    def test_cover_downloaded_to_partial_file_of_process(self):
+        album_filepath = os.path.join(self.out_dir, 'Balbum.jpg')
+        with patch.object(gpm_cache.core, 'write_stream_to_disk', side_effect=touch) as mock_write:
+            download_cover('art_url', album_filepath)
+        self.assertEqual(mock_write.call_args[0][1], "%s.%d.part" % (album_filepath, os.getpid()))
+        self.assertTrue(os.path.exists(album_filepath))
+
+        def write_partial(url, filename, **kwargs):
+            touch(url, filename)
+            raise IOError("connection reset")
+
+        with patch.object(gpm_cache.core, 'write_stream_to_disk', side_effect=write_partial), \
+                self.assertRaises(IOError):
+            download_cover('art_url', os.path.join(self.out_dir, 'Bfailed.jpg'))
+        self.assertEqual(sorted(os.listdir(self.out_dir)), ['Balbum.jpg'])
+
+    def test_staging_in_cache_location(self):
+        parser_args = get_parser_args([
+            '--email', 'email', '--device-id', 'devid', '--playlist', 'plist',
+            '--cache-location', self.out_dir, '--shard', '1/2'])
+        self.assertEqual(parser_args.staging_location, os.path.join(self.out_dir, '.staging', '1-of-2'))
+
+    def test_move_tmp_to_final(self):
+        tmp_filename = touch(None, os.path.join(self.out_dir, 'track.part.mp3'))
+        local_filepath = os.path.join(self.out_dir, 'Artist', 'track.mp3')
+        with patch.object(shutil, 'move') as mock_move:
+            move_tmp_to_final(tmp_filename, local_filepath)
+        mock_move.assert_not_called()
+        self.assertTrue(os.path.exists(local_filepath))
+        self.assertFalse(os.path.exists(tmp_filename))
+
+    def test_move_tmp_to_final_across_filesystems(self):
+        tmp_filename = touch(None, os.path.join(self.out_dir, 'track.part.mp3'))
+        local_filepath = os.path.join(self.out_dir, 'Artist', 'track.mp3')
+        with patch.object(os, 'replace', side_effect=OSError(errno.EXDEV, 'cross-device link')):
+            move_tmp_to_final(tmp_filename, local_filepath)
+        self.assertTrue(os.path.exists(local_filepath))
 
     def test_save_meta(self):
         # Given
@@ -89,6 +147,462 @@ class TestCore(unittest.TestCase):
         self.assertTrue(meta['APIC:Cover'])
 
 
+class TestCacheTrack(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(TEST_DATA_DIR, 'track_info.json')) as json_fp:
+            self.info_obj = TrackInfo(track_id=u'T6zn3up2um24dxoggvac6obj7ay',
+                                      track_info=json.load(json_fp))
+        self.out_dir = mkdtemp()
+        self.parser_args = get_parser_args([
+            '--email', 'email', '--device-id', 'devid', '--playlist', 'plist',
+            '--sleep-time', '0', '--cache-location', self.out_dir,
+            '--art-cache-location', os.path.join(self.out_dir, 'art'),
+            '--staging-location', os.path.join(self.out_dir, 'staging'),
+        ])
+        with open(os.path.join(TEST_DATA_DIR, 'file_example_MP3_700KB.mp3'), 'rb') as audio_file:
+            self.audio = audio_file.read()
+        with open(os.path.join(TEST_DATA_DIR, 'SampleJPGImage_50kbmb.jpg'), 'rb') as art_file:
+            self.art = art_file.read()
+
+    def write_stream_to_disk(self, url, filename, header=b'', **kwargs):
+        with open(filename, 'wb') as stream_file:
+            stream_file.write(header + (self.audio if url == 'stream_url' else self.art))
+
+    def cache_track(self, parser_args):
+        with \
+                patch.object(Mobileclient, 'get_stream_url', return_value='stream_url'), \
+                patch.object(gpm_cache.core, 'write_stream_to_disk',
+                             side_effect=self.write_stream_to_disk):
+            return cache_track(Mobileclient(), parser_args, self.info_obj)[0]
+
+    def test_cache_track_writes_tags_ahead_of_audio(self):
+        with patch.object(gpm_cache.core, 'save_meta') as mock_save_meta:
+            local_filepath = self.cache_track(self.parser_args)
+
+        mock_save_meta.assert_not_called()
+        meta = EasyID3(local_filepath)
+        for meta_key, meta_val in self.info_obj.id3_meta.items():
+            self.assertEqual(meta[meta_key][0], meta_val)
+        self.assertEqual(ID3(local_filepath)['APIC:Cover'].data, self.art)
+        with open(local_filepath, 'rb') as local_file:
+            self.assertTrue(local_file.read().endswith(self.audio))
+
+    def test_missing_album_art_is_skipped(self):
+        art_requests = []
+
+        def write_stream_to_disk(url, filename, header=b'', **kwargs):
+            if url != 'stream_url':
+                art_requests.append(url)
+                raise IOError("404 Client Error: Not Found")
+            self.write_stream_to_disk(url, filename, header, **kwargs)
+
+        other_info = TrackInfo('Tother', self.info_obj.to_dict())
+        with patch.object(Mobileclient, 'get_stream_url', return_value='stream_url') as mock_url, \
+                patch.object(gpm_cache.core, 'write_stream_to_disk', side_effect=write_stream_to_disk):
+            local_filepath, _ = cache_track(Mobileclient(), self.parser_args, self.info_obj)
+            cache_track(Mobileclient(), self.parser_args, other_info)
+
+        self.assertEqual(mock_url.call_count, 2)
+        self.assertEqual(len(art_requests), 1)
+        self.assertNotIn('APIC:Cover', ID3(local_filepath))
+        self.assertEqual(EasyID3(local_filepath)['title'][0], self.info_obj.id3_meta['title'])
+
+    def test_album_art_uses_download_args(self):
+        self.parser_args.download_retries = 1
+        self.parser_args.download_backoff = 0.5
+        self.parser_args.chunk_size = 1024
+        with patch.object(Mobileclient, 'get_stream_url', return_value='stream_url'), \
+                patch.object(gpm_cache.core, 'write_stream_to_disk',
+                             side_effect=self.write_stream_to_disk) as mock_write:
+            cache_track(Mobileclient(), self.parser_args, self.info_obj)
+        art_call, stream_call = mock_write.call_args_list
+        for key, value in (('retries', 1), ('backoff', 0.5), ('chunk_size', 1024)):
+            self.assertEqual(art_call[1][key], value)
+            self.assertEqual(stream_call[1][key], value)
+
+    def test_cache_heirarchies_link_one_copy(self):
+        self.parser_args.cache_heirarchy = ['artist_album', 'flat']
+        local_filepath = self.cache_track(self.parser_args)
+
+        flat_filepath = get_local_filepath(self.out_dir, 'flat', self.info_obj)
+        blob_path = TrackStore(self.out_dir).get_blob_path(self.info_obj.track_id)
+        self.assertEqual(local_filepath, get_local_filepath(self.out_dir, 'artist_album',
+                                                            self.info_obj))
+        self.assertTrue(os.path.samefile(local_filepath, blob_path))
+        self.assertTrue(os.path.samefile(flat_filepath, blob_path))
+
+    def test_resume_moved_track_from_journal(self):
+        self.cache_track(self.parser_args)
+        journal = RunJournal(os.path.join(self.out_dir, 'journal.jsonl'))
+        journal.record(self.info_obj.track_id, MOVED)
+        with patch.object(Mobileclient, 'get_stream_url') as mock_url:
+            local_filepath, _ = cache_track(Mobileclient(), self.parser_args, self.info_obj,
+                                            journal=journal)
+        mock_url.assert_not_called()
+        self.assertTrue(os.path.samefile(
+            local_filepath, TrackStore(self.out_dir).get_blob_path(self.info_obj.track_id)))
+        journal.close()
+
+    def test_track_flushed_before_journal(self):
+        journal = RunJournal(os.path.join(self.out_dir, 'journal.jsonl'))
+        events = []
+        tmp_filename = get_staging_filepath(self.parser_args.staging_location, self.info_obj)
+        blob_path = TrackStore(self.out_dir).get_blob_path(self.info_obj.track_id)
+        with patch.object(gpm_cache.core, 'fsync_path', side_effect=events.append), \
+                patch.object(journal, 'record', side_effect=lambda track_id, stage: events.append(stage)), \
+                patch.object(Mobileclient, 'get_stream_url', return_value='stream_url'), \
+                patch.object(gpm_cache.core, 'write_stream_to_disk', side_effect=self.write_stream_to_disk):
+            cache_track(Mobileclient(), self.parser_args, self.info_obj, journal=journal)
+        self.assertEqual(events, [URL_FETCHED, tmp_filename, DOWNLOADED, blob_path,
+                                  os.path.dirname(blob_path), MOVED])
+        journal.close()
+
+    def test_resume_downloaded_track_from_journal(self):
+        tmp_filename = get_staging_filepath(self.parser_args.staging_location, self.info_obj)
+        self.write_stream_to_disk('stream_url', tmp_filename)
+        journal = RunJournal(os.path.join(self.out_dir, 'journal.jsonl'))
+        journal.record(self.info_obj.track_id, DOWNLOADED)
+        with patch.object(Mobileclient, 'get_stream_url') as mock_url:
+            local_filepath, _ = cache_track(Mobileclient(), self.parser_args, self.info_obj,
+                                            journal=journal)
+        mock_url.assert_not_called()
+        self.assertFalse(os.path.exists(tmp_filename))
+        self.assertEqual(journal.get(self.info_obj.track_id), MOVED)
+        with open(local_filepath, 'rb') as local_file:
+            self.assertEqual(local_file.read(), self.audio)
+        journal.close()
+
+    def test_clean_staging(self):
+        manifest = Manifest.from_parser_args(self.parser_args)
+        self.cache_track(self.parser_args)
+        manifest.record(self.info_obj.track_id,
+                        TrackStore(self.out_dir).get_blob_path(self.info_obj.track_id), 1)
+        cached_filename = get_staging_filepath(self.parser_args.staging_location, self.info_obj)
+        pending_filename = get_staging_filepath(self.parser_args.staging_location,
+                                                TrackInfo('Tpending', {}))
+        for filename in (cached_filename, pending_filename):
+            self.write_stream_to_disk('stream_url', filename)
+        self.assertEqual(clean_staging(self.parser_args.staging_location, manifest), 1)
+        self.assertFalse(os.path.exists(cached_filename))
+        self.assertTrue(os.path.exists(pending_filename))
+        manifest.close()
+
+    def test_prune_staging(self):
+        filenames = [
+            get_staging_filepath(self.parser_args.staging_location, TrackInfo(track_id, {}))
+            for track_id in ('Toldest', 'Tolder', 'Tnewest')
+        ]
+        for age, filename in enumerate(reversed(filenames)):
+            self.write_stream_to_disk('stream_url', filename)
+            os.utime(filename, (1000 - age, 1000 - age))
+        self.assertEqual(prune_staging(self.parser_args.staging_location, len(self.audio) * 2), 1)
+        self.assertEqual([os.path.exists(filename) for filename in filenames], [False, True, True])
+
+    def test_rebuild_views(self):
+        with patch.object(Mobileclient, 'get_stream_url', return_value='stream_url'), \
+                patch.object(gpm_cache.core, 'write_stream_to_disk',
+                             side_effect=self.write_stream_to_disk):
+            cache_entry(Mobileclient(), self.parser_args,
+                        {'trackId': self.info_obj.track_id, 'track': self.info_obj.to_dict()},
+                        manifest=Manifest.from_parser_args(self.parser_args))
+
+        self.parser_args.cache_heirarchy = ['flat']
+        self.assertEqual(rebuild_views(self.parser_args), 1)
+        blob_path = TrackStore(self.out_dir).get_blob_path(self.info_obj.track_id)
+        self.assertTrue(os.path.samefile(
+            get_local_filepath(self.out_dir, 'flat', self.info_obj), blob_path))
+
+
+class TestCachePlaylist(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(TEST_DATA_DIR, 'library.json')) as library_json:
+            self.library_data = json.load(library_json)
+        self.source_playlist = self.library_data[0]
+        template = self.source_playlist['tracks'][0]
+        self.source_playlist['tracks'] = [
+            dict(template, id='entry_%d' % index, trackId='track_%d' % index)
+            for index in range(8)
+        ]
+        self.out_dir = mkdtemp()
+
+    def get_parser_args(self, *extra):
+        return get_parser_args([
+            '--email', 'email', '--device-id', 'devid', '--playlist', self.source_playlist['name'],
+            '--playlist-cached', 'cached', '--sleep-time', '0', '--cache-location', self.out_dir,
+        ] + list(extra))
+
+    def fake_cache_track(self, api, parser_args, track_info, *args):
+        filename = TrackStore(self.out_dir).get_blob_path(track_info.track_id)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as track_file:
+            track_file.write(b'audio')
+        return filename, None
+
+    def get_all_playlists(self):
+        return [
+            {key: value for key, value in playlist.items() if key != 'tracks'}
+            for playlist in self.library_data
+        ]
+
+    def get_shared_playlist_contents(self, share_token):
+        for playlist in self.library_data:
+            if playlist['shareToken'] == share_token:
+                return playlist['tracks']
+
+    def run_cache_playlist(self, parser_args, cache_track, add_songs_to_playlist=None,
+                           run=cache_playlists):
+        with \
+                patch.object(Mobileclient, 'get_all_playlists', side_effect=self.get_all_playlists), \
+                patch.object(Mobileclient, 'get_shared_playlist_contents',
+                             side_effect=self.get_shared_playlist_contents), \
+                patch.object(Mobileclient, 'create_playlist', side_effect=lambda name: name + '_id'), \
+                patch.object(Mobileclient, 'add_songs_to_playlist',
+                             side_effect=add_songs_to_playlist) as self.add_songs, \
+                patch.object(Mobileclient, 'remove_entries_from_playlist') as remove_entries, \
+                patch.object(gpm_cache.core, 'cache_track', side_effect=cache_track) as mock_track:
+            run(Mobileclient(), parser_args)
+        return mock_track, remove_entries
+
+    def test_workers_cache_all_tracks(self):
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args('--workers', '4'), self.fake_cache_track)
+        self.assertEqual(mock_track.call_count, len(self.source_playlist['tracks']))
+        remove_entries.assert_called_once()
+        self.assertEqual(sorted(remove_entries.call_args[0][0]),
+                         sorted(entry['id'] for entry in self.source_playlist['tracks']))
+
+    def test_workers_collect_failures(self):
+        failing_id = self.source_playlist['tracks'][0]['trackId']
+
+        def cache_track(api, parser_args, track_info, *args):
+            if track_info.track_id == failing_id:
+                raise IOError("download failed")
+            return self.fake_cache_track(api, parser_args, track_info)
+
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args('--workers', '4'), cache_track)
+        # the failing track is queued again once the others have been tried
+        self.assertEqual(mock_track.call_count, len(self.source_playlist['tracks']) + 1)
+        succeeded = [
+            entry for entry in self.source_playlist['tracks'] if entry['trackId'] != failing_id
+        ]
+        self.assertEqual(sorted(self.add_songs.call_args[0][1]),
+                         sorted(entry['trackId'] for entry in succeeded))
+        self.assertEqual(sorted(remove_entries.call_args[0][0]),
+                         sorted(entry['id'] for entry in succeeded))
+
+    def test_mutations_are_batched(self):
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args('--batch-size', '3'), self.fake_cache_track)
+        self.assertEqual([len(call[0][1]) for call in self.add_songs.call_args_list], [3, 3, 2])
+        self.assertEqual([len(call[0][0]) for call in remove_entries.call_args_list], [3, 3, 2])
+
+    def test_failed_add_is_not_removed(self):
+        def add_songs_to_playlist(playlist_id, song_ids):
+            if 'track_0' in song_ids:
+                raise IOError("mutation failed")
+            return song_ids
+
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args('--batch-size', '4'), self.fake_cache_track, add_songs_to_playlist)
+        removed = [entry_id for call in remove_entries.call_args_list for entry_id in call[0][0]]
+        self.assertEqual(len(removed), 4)
+        self.assertNotIn('entry_0', removed)
+
+    def test_rerun_skips_tracks_in_manifest(self):
+        failing_id = self.source_playlist['tracks'][0]['trackId']
+
+        def cache_track(api, parser_args, track_info, *args):
+            if track_info.track_id == failing_id:
+                raise IOError("download failed")
+            return self.fake_cache_track(api, parser_args, track_info)
+
+        self.run_cache_playlist(self.get_parser_args(), cache_track)
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args(), self.fake_cache_track)
+        self.assertEqual(
+            [call[0][2].track_id for call in mock_track.call_args_list], [failing_id])
+        remove_entries.assert_called_once()
+
+    def test_batch_mode_downloads_shared_tracks_once(self):
+        template = self.source_playlist['tracks'][0]
+        self.library_data.append(dict(
+            self.source_playlist, id='second_id', name='Second Playlist', shareToken='second',
+            tracks=[dict(template, id='second_entry_%d' % index, trackId='track_%d' % index)
+                    for index in range(6, 10)]))
+        config_path = os.path.join(self.out_dir, 'playlists.json')
+        with open(config_path, 'w') as config_file:
+            json.dump([{'playlist': 'Second Playlist', 'playlist_cached': 'second cached'}],
+                      config_file)
+
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args('--playlist-config', config_path, '--workers', '3'),
+            self.fake_cache_track)
+
+        self.assertEqual(sorted(call[0][2].track_id for call in mock_track.call_args_list),
+                         sorted('track_%d' % index for index in range(10)))
+        added = {call[0][0]: sorted(call[0][1]) for call in self.add_songs.call_args_list}
+        self.assertEqual(added, {
+            'cached_id': sorted('track_%d' % index for index in range(8)),
+            'second cached_id': sorted('track_%d' % index for index in range(6, 10)),
+        })
+        removed = [entry_id for call in remove_entries.call_args_list for entry_id in call[0][0]]
+        self.assertEqual(len(removed), 12)
+
+    def test_metrics_exported(self):
+        failing_id = self.source_playlist['tracks'][0]['trackId']
+
+        def cache_track(api, parser_args, track_info, *args):
+            if track_info.track_id == failing_id:
+                raise IOError("download failed")
+            return self.fake_cache_track(api, parser_args, track_info)
+
+        metrics_path = os.path.join(self.out_dir, 'metrics.json')
+        prometheus_path = os.path.join(self.out_dir, 'gpm_cache.prom')
+        self.run_cache_playlist(self.get_parser_args(
+            '--metrics-json', metrics_path, '--metrics-prometheus', prometheus_path,
+            '--requeue-rounds', '0'), cache_track)
+        with open(metrics_path) as metrics_file:
+            summary = json.load(metrics_file)
+        self.assertEqual(summary['counters']['tracks'], len(self.source_playlist['tracks']) - 1)
+        self.assertEqual(summary['counters']['failures{exception="OSError"}'], 1)
+        self.assertEqual(summary['stages']['track']['count'], len(self.source_playlist['tracks']))
+        self.assertEqual(summary['stages']['manifest']['count'],
+                         len(self.source_playlist['tracks']) - 1)
+        self.assertTrue(os.path.exists(prometheus_path))
+
+    def test_requeued_track_succeeds(self):
+        attempts = []
+        failing_id = self.source_playlist['tracks'][0]['trackId']
+
+        def cache_track(api, parser_args, track_info, *args):
+            attempts.append(track_info.track_id)
+            if attempts.count(failing_id) == 1 and track_info.track_id == failing_id:
+                raise IOError("download failed")
+            return self.fake_cache_track(api, parser_args, track_info)
+
+        _, remove_entries = self.run_cache_playlist(self.get_parser_args(), cache_track)
+        self.assertEqual(attempts[-1], failing_id)
+        self.assertEqual(sorted(remove_entries.call_args[0][0]),
+                         sorted(entry['id'] for entry in self.source_playlist['tracks']))
+
+    def test_breaker_aborts_run(self):
+        def get_stream_url(track_id):
+            raise CallFailure("rejected device id", 'get_stream_url')
+
+        with patch.object(Mobileclient, 'get_stream_url', side_effect=get_stream_url) as mock_url, \
+                patch.object(gpm_cache.core, 'maybe_download_album_art', return_value=None):
+            mock_track, remove_entries = self.run_cache_playlist(self.get_parser_args(
+                '--breaker-threshold', '2', '--breaker-trips', '0', '--backoff-base', '0'),
+                cache_track)
+        self.assertEqual(mock_url.call_count, 2)
+        remove_entries.assert_not_called()
+
+    def test_shards_split_tracks_then_merge(self):
+        cached = []
+        for index in range(2):
+            mock_track, remove_entries = self.run_cache_playlist(
+                self.get_parser_args('--shard', '%d/2' % index), self.fake_cache_track,
+                run=cache_shard)
+            cached.extend(call[0][2].track_id for call in mock_track.call_args_list)
+            self.add_songs.assert_not_called()
+            remove_entries.assert_not_called()
+        self.assertEqual(sorted(cached), sorted(entry['trackId'] for entry in self.source_playlist['tracks']))
+
+        mock_track, remove_entries = self.run_cache_playlist(
+            self.get_parser_args('--merge-shards', '2'), self.fake_cache_track)
+        mock_track.assert_not_called()
+        self.assertEqual(sorted(remove_entries.call_args[0][0]),
+                         sorted(entry['id'] for entry in self.source_playlist['tracks']))
+
+    def test_merge_waits_for_every_shard(self):
+        self.run_cache_playlist(self.get_parser_args('--shard', '0/2'), self.fake_cache_track,
+                                run=cache_shard)
+        with self.assertRaises(IncompleteShardsException):
+            self.run_cache_playlist(self.get_parser_args('--merge-shards', '2'), self.fake_cache_track)
+
+    def test_cached_tracks_stay_claimed_until_merge(self):
+        self.run_cache_playlist(self.get_parser_args('--shard', '0/1'), self.fake_cache_track,
+                                run=cache_shard)
+        for index in range(2):
+            mock_track, _ = self.run_cache_playlist(
+                self.get_parser_args('--shard', '%d/2' % index), self.fake_cache_track,
+                run=cache_shard)
+            mock_track.assert_not_called()
+
+    def test_shard_skips_claimed_tracks(self):
+        claims = ClaimStore(self.out_dir, 'another host')
+        for entry in self.source_playlist['tracks']:
+            claims.claim(entry['trackId'])
+        mock_track, _ = self.run_cache_playlist(
+            self.get_parser_args('--shard', '0/1'), self.fake_cache_track, run=cache_shard)
+        mock_track.assert_not_called()
+
+    def run_plan(self, parser_args):
+        with \
+                patch.object(Mobileclient, 'get_all_playlists', side_effect=self.get_all_playlists), \
+                patch.object(Mobileclient, 'get_shared_playlist_contents',
+                             side_effect=self.get_shared_playlist_contents), \
+                patch.object(Mobileclient, 'create_playlist') as create_playlist, \
+                patch.object(gpm_cache.core, 'cache_track') as mock_track:
+            plan = build_plan(Mobileclient(), parser_args)
+        create_playlist.assert_not_called()
+        mock_track.assert_not_called()
+        return plan
+
+    def test_plan_downloads_nothing(self):
+        parser_args = self.get_parser_args('--art-cache-location', os.path.join(self.out_dir, 'art'))
+        plan = self.run_plan(parser_args)
+        self.assertEqual(plan['playlists'][0]['cached_id'], None)
+        self.assertEqual(len(plan['tracks']), len(self.source_playlist['tracks']))
+        self.assertEqual(plan['already_cached_entries'], 0)
+        self.assertEqual(plan['tracks'][0]['blob_path'],
+                         TrackStore(self.out_dir).get_blob_path('track_0'))
+        self.assertEqual(plan['missing_art'], [self.source_playlist['tracks'][0]['track']['albumId']])
+        # every entry copies the same track, so they would all be linked to the same path
+        self.assertEqual(len(plan['collisions']), 1)
+        self.assertEqual(len(plan['collisions'][0]['track_ids']), len(self.source_playlist['tracks']))
+        self.assertEqual(os.listdir(self.out_dir), ['library-snapshot.jsonl'])
+
+    def test_plan_skips_tracks_in_manifest(self):
+        self.run_cache_playlist(self.get_parser_args(), self.fake_cache_track)
+        self.source_playlist['tracks'].append(dict(
+            self.source_playlist['tracks'][0], id='entry_new', trackId='track_new'))
+        plan = self.run_plan(self.get_parser_args())
+        self.assertEqual([track['track_id'] for track in plan['tracks']], ['track_new'])
+        self.assertEqual(plan['already_cached_entries'], len(self.source_playlist['tracks']) - 1)
+
+
+class TestPlaylistMappings(unittest.TestCase):
+    def get_mappings(self, *argv):
+        return get_playlist_mappings(get_parser_args(['--email', 'email', '--device-id', 'devid']
+                                                     + list(argv)))
+
+    def test_paired_playlists(self):
+        self.assertEqual(
+            self.get_mappings('--playlist', 'a', '--playlist-cached', 'a cached',
+                              '--playlist', 'b', '--playlist-cached', 'b cached'),
+            [('a', 'a cached'), ('b', 'b cached')])
+
+    def test_shared_cached_playlist(self):
+        self.assertEqual(
+            self.get_mappings('--playlist', 'a', '--playlist', 'b', '--playlist-cached', 'cached'),
+            [('a', 'cached'), ('b', 'cached')])
+        self.assertEqual(self.get_mappings('--playlist', 'a'), [('a', None)])
+
+    def test_playlist_required(self):
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            self.get_mappings()
+
+    def test_mismatched_cached_playlists(self):
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            self.get_mappings('--playlist', 'a', '--playlist', 'b', '--playlist', 'c',
+                              '--playlist-cached', 'a cached', '--playlist-cached', 'b cached')
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            self.get_mappings('--playlist', 'a', '--playlist-cached', 'a cached',
+                              '--playlist-cached', 'b cached')
+
+
 class TestMainMocked(unittest.TestCase):
     dummy_argv = shlex.split("--email 'email' --pwd 'pass' --device-id 'devid' --playlist 'plist' "
                              "--debug-level 'critical'")
@@ -106,10 +620,23 @@ class TestMainMocked(unittest.TestCase):
                 patch.object(Mobileclient, 'oauth_login', return_value=True), \
                 patch.object(Mobileclient, 'is_authenticated', return_value=True), \
                 patch.object(Mobileclient, 'get_registered_devices', return_value=[]), \
-                patch.object(Mobileclient, 'get_all_user_playlist_contents', return_value=[]), \
+                patch.object(Mobileclient, 'get_all_playlists', return_value=[]), \
                 self.assertRaises(PlaylistNotFoundException):
             main(self.dummy_argv)
 
+    def test_rebuild_views_without_login(self):
+        with patch.object(gpm_cache.core, 'login') as login, \
+                patch.object(gpm_cache.core, 'rebuild_views', return_value=0) as rebuild:
+            main(['--cache-location', mkdtemp(), '--rebuild-views', '--debug-level', 'critical'])
+        login.assert_not_called()
+        rebuild.assert_called_once()
+
+    def test_login_args_required(self):
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            main(['--pwd', 'pass', '--device-id', 'devid', '--playlist', 'plist'])
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            main(['--email', 'email', '--playlist', 'plist'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,152 @@
+# -*- coding: utf8 -*-
+import hashlib
+import os
+import re
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import mkdtemp
+
+from six import MovedModule, add_move
+
+from . import REPO_ROOT, TEST_DATA_DIR
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.download import write_stream_to_disk
+    from gpm_cache.session import PooledSession
+finally:
+    sys.path = PATH
+
+try:
+    add_move(MovedModule('mock', 'mock', 'unittest.mock'))
+    from six.moves import mock  # noqa: W0611
+finally:
+    from mock import patch
+
+with open(os.path.join(TEST_DATA_DIR, 'file_example_MP3_700KB.mp3'), 'rb') as audio_file:
+    AUDIO = audio_file.read()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve AUDIO with Range support, dropping connections as configured on the server."""
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        if match and self.server.supports_range:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(AUDIO) - 1, len(AUDIO)))
+        else:
+            self.send_response(200)
+        body = AUDIO[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.drop_after:
+            body = body[:self.server.drop_after.pop(0)]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWriteStreamToDisk(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.requests = []
+        self.server.drop_after = []
+        self.server.supports_range = True
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05, ))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/stream' % self.server.server_address[1]
+        self.filename = os.path.join(mkdtemp(), 'track.part.mp3')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def read_download(self):
+        with open(self.filename, 'rb') as stream_file:
+            return stream_file.read()
+
+    def test_download(self):
+        write_stream_to_disk(self.url, self.filename, backoff=0)
+        self.assertEqual(self.read_download(), AUDIO)
+        self.assertEqual(self.server.requests, [None])
+
+    def test_injected_session(self):
+        session = PooledSession(pool_size=1)
+        with patch.object(session, 'get', wraps=session.get) as mock_get:
+            write_stream_to_disk(self.url, self.filename, backoff=0, session=session)
+        self.assertEqual(self.read_download(), AUDIO)
+        mock_get.assert_called_once()
+
+    def test_resume_after_dropped_connection(self):
+        self.server.drop_after = [1000, 50000]
+        write_stream_to_disk(self.url, self.filename, chunk_size=512, backoff=0)
+        self.assertEqual(self.read_download(), AUDIO)
+        self.assertEqual(len(self.server.requests), 3)
+        first_resume, second_resume = [
+            int(re.match(r'bytes=(\d+)-', header).group(1)) for header in self.server.requests[1:]
+        ]
+        self.assertTrue(0 < first_resume <= 1000)
+        self.assertTrue(first_resume < second_resume <= first_resume + 50000)
+
+    def test_resume_existing_partial_file(self):
+        with open(self.filename, 'wb') as stream_file:
+            stream_file.write(AUDIO[:4096])
+        write_stream_to_disk(self.url, self.filename, backoff=0)
+        self.assertEqual(self.read_download(), AUDIO)
+        self.assertEqual(self.server.requests, ['bytes=4096-'])
+
+    def test_header_written_before_stream(self):
+        self.server.drop_after = [50000]
+        write_stream_to_disk(self.url, self.filename, chunk_size=512, backoff=0, header=b'HEADER')
+        self.assertEqual(self.read_download(), b'HEADER' + AUDIO)
+        self.assertTrue(self.server.requests[1].startswith('bytes='))
+
+    def test_restart_when_header_changed(self):
+        with open(self.filename, 'wb') as stream_file:
+            stream_file.write(b'OLD HEADER' + AUDIO[:4096])
+        write_stream_to_disk(self.url, self.filename, backoff=0, header=b'NEW HEADER')
+        self.assertEqual(self.read_download(), b'NEW HEADER' + AUDIO)
+        self.assertEqual(self.server.requests, [None])
+
+    def test_restart_when_range_unsupported(self):
+        self.server.supports_range = False
+        with open(self.filename, 'wb') as stream_file:
+            stream_file.write(b'stale partial content')
+        write_stream_to_disk(self.url, self.filename, backoff=0)
+        self.assertEqual(self.read_download(), AUDIO)
+
+    def test_digest_of_resumed_download(self):
+        with open(self.filename, 'wb') as stream_file:
+            stream_file.write(b'HEADER' + AUDIO[:4096])
+        self.server.drop_after = [1000]
+        digest = write_stream_to_disk(self.url, self.filename, chunk_size=512, backoff=0,
+                                      header=b'HEADER')
+        self.assertEqual(digest, hashlib.sha1(b'HEADER' + AUDIO).hexdigest())
+
+    def test_gives_up_after_retries(self):
+        self.server.drop_after = [10, 10, 10]
+        with self.assertRaises(Exception):
+            write_stream_to_disk(self.url, self.filename, retries=2, backoff=0)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_chunks_reported(self):
+        self.server.drop_after = [10]
+        sizes = []
+        write_stream_to_disk(self.url, self.filename, chunk_size=512, backoff=0,
+                             on_chunk=sizes.append)
+        self.assertEqual(sum(sizes), len(AUDIO))
+
+    def test_retries_reported(self):
+        self.server.drop_after = [10]
+        retried = []
+        write_stream_to_disk(self.url, self.filename, backoff=0, on_retry=retried.append)
+        self.assertEqual(len(retried), 1)
+        self.assertEqual(self.read_download(), AUDIO)
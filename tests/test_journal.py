@@ -0,0 +1,70 @@
+# -*- coding: utf8 -*-
+import os
+import sys
+import time
+import unittest
+from tempfile import mkdtemp
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.journal import DOWNLOADED, MOVED, RECORDED, URL_FETCHED, RunJournal, replay
+finally:
+    sys.path = PATH
+
+
+class TestRunJournal(unittest.TestCase):
+    """Test RunJournal helper class."""
+    def setUp(self):
+        self.path = os.path.join(mkdtemp(), 'journal.jsonl')
+
+    def read_lines(self):
+        with open(self.path, 'rb') as journal_file:
+            return journal_file.read().splitlines()
+
+    def test_synced_in_batches(self):
+        journal = RunJournal(self.path, batch_size=2, sync_interval=60)
+        journal.record('Tone', URL_FETCHED)
+        self.assertEqual(self.read_lines(), [])
+        journal.record('Tone', DOWNLOADED)
+        self.assertEqual(len(self.read_lines()), 2)
+        self.assertEqual(replay(self.path), {'Tone': DOWNLOADED})
+        journal.close()
+
+    def test_synced_when_idle(self):
+        journal = RunJournal(self.path, batch_size=10, sync_interval=0.01)
+        journal.record('Tone', URL_FETCHED)
+        deadline = time.monotonic() + 5
+        while not self.read_lines() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(replay(self.path), {'Tone': URL_FETCHED})
+        journal.close()
+
+    def test_replay_resumes_stages(self):
+        with RunJournal(self.path) as journal:
+            journal.record('Tone', MOVED)
+            journal.record('Ttwo', URL_FETCHED)
+        self.assertEqual(RunJournal(self.path).get('Tone'), MOVED)
+
+    def test_incomplete_line_ignored(self):
+        with RunJournal(self.path) as journal:
+            journal.record('Tone', DOWNLOADED)
+        with open(self.path, 'ab') as journal_file:
+            journal_file.write(b'{"track_id": "Ttwo", "sta')
+        self.assertEqual(replay(self.path), {'Tone': DOWNLOADED})
+
+    def test_checkpoint_drops_recorded_tracks(self):
+        journal = RunJournal(self.path, batch_size=1)
+        journal.record('Tone', MOVED)
+        journal.record('Ttwo', RECORDED)
+        # a stage written by an older version, which is dropped like a recorded track
+        journal.record('Tthree', 'added')
+        journal.close()
+        self.assertEqual(replay(self.path), {'Tone': MOVED})
+        self.assertEqual(len(self.read_lines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
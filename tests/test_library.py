@@ -9,6 +9,7 @@ import json
 import os
 import sys
 import unittest
+from tempfile import mkdtemp
 
 from gmusicapi import Mobileclient
 from six import MovedModule, add_move, b, u  # noqa: W0611
@@ -18,7 +19,7 @@ from . import REPO_ROOT, TEST_DATA_DIR
 try:
     PATH = sys.path[:]
     sys.path.insert(1, REPO_ROOT)
-    from gpm_cache.library import Library
+    from gpm_cache.library import Library, LibrarySnapshot, to_track_record
     from gpm_cache.exceptions import PlaylistNotFoundException
 finally:
     sys.path = PATH
@@ -33,19 +34,39 @@ finally:
 class TestApiHelper(unittest.TestCase):
     def setUp(self):
         with open(os.path.join(TEST_DATA_DIR, 'library.json')) as library_json:
-            data = json.load(library_json)
-            with patch.object(Mobileclient, 'get_all_user_playlist_contents', return_value=data):
-                self.library = Library(Mobileclient())
+            self.data = json.load(library_json)
+        self.snapshot_path = os.path.join(mkdtemp(), 'library-snapshot.jsonl')
+        self.records = [to_track_record(entry) for entry in self.data[0]['tracks']]
+        self.library = self.get_library()
+
+    def get_all_playlists(self):
+        return [
+            {key: value for key, value in playlist.items() if key != 'tracks'}
+            for playlist in self.data
+        ]
+
+    def get_library(self, snapshot_path=None):
+        with patch.object(Mobileclient, 'get_all_playlists', side_effect=self.get_all_playlists):
+            return Library(Mobileclient(), snapshot_path)
+
+    def find_playlist(self, library, playlist_name):
+        with patch.object(Mobileclient, 'get_shared_playlist_contents',
+                          return_value=self.data[0]['tracks']) as get_contents:
+            return library.find_playlist(playlist_name), get_contents
 
     def test_find_existing_playist(self):
-        self.assertTrue(self.library.find_playlist('Fake Playlist'))
+        playlist, get_contents = self.find_playlist(self.library, 'Fake Playlist')
+        self.assertEqual(playlist['tracks'], self.records)
+        get_contents.assert_called_once_with(self.data[0]['shareToken'])
 
     def test_not_find_nonexisting_playist(self):
         with self.assertRaises(PlaylistNotFoundException):
             self.library.find_playlist('Nonexistent Playlist')
 
     def test_find_or_create_playlist_finds_existing_playlist(self):
-        self.assertTrue(self.library.find_or_create_playlist('Fake Playlist'))
+        with patch.object(Mobileclient, 'get_shared_playlist_contents',
+                          return_value=self.data[0]['tracks']):
+            self.assertTrue(self.library.find_or_create_playlist('Fake Playlist'))
 
     def test_find_or_create_playlist_creates_nonexisting_playlist(self):
         new_name = 'Nonexistent Playlist'
@@ -55,3 +76,103 @@ class TestApiHelper(unittest.TestCase):
                 'name': new_name,
                 'id': new_id
             })
+
+    def test_unmodified_playlist_served_from_snapshot(self):
+        self.find_playlist(self.get_library(self.snapshot_path), 'Fake Playlist')
+        playlist, get_contents = self.find_playlist(
+            self.get_library(self.snapshot_path), 'Fake Playlist')
+        get_contents.assert_not_called()
+        self.assertEqual(playlist['tracks'], self.records)
+
+    def test_modified_playlist_fetched(self):
+        self.find_playlist(self.get_library(self.snapshot_path), 'Fake Playlist')
+        self.data[0]['lastModifiedTimestamp'] = '1572605915831376'
+        _, get_contents = self.find_playlist(self.get_library(self.snapshot_path), 'Fake Playlist')
+        get_contents.assert_called_once()
+
+    def test_invalidated_playlist_fetched(self):
+        library = self.get_library(self.snapshot_path)
+        playlist, _ = self.find_playlist(library, 'Fake Playlist')
+        library.invalidate(playlist)
+        _, get_contents = self.find_playlist(self.get_library(self.snapshot_path), 'Fake Playlist')
+        get_contents.assert_called_once()
+
+    def test_track_records(self):
+        record = self.records[0]
+        entry = self.data[0]['tracks'][0]
+        self.assertEqual(set(record), {'id', 'trackId', 'source', 'track'})
+        self.assertEqual(record['track']['title'], entry['track']['title'])
+        self.assertNotIn('artistArtRef', record['track'])
+
+    def test_snapshot_keeps_other_playlists(self):
+        snapshot = LibrarySnapshot(self.snapshot_path)
+        playlists = [{'id': 'id_%d' % index, 'lastModifiedTimestamp': '1'} for index in range(3)]
+        for playlist in playlists:
+            snapshot.set_tracks(playlist, self.records)
+        snapshot.invalidate('id_1')
+        snapshot.set_tracks(playlists[2], self.records[:1])
+
+        snapshot = LibrarySnapshot(self.snapshot_path)
+        self.assertEqual(snapshot.get_tracks(playlists[0]), self.records)
+        self.assertIsNone(snapshot.get_tracks(playlists[1]))
+        self.assertEqual(snapshot.get_tracks(playlists[2]), self.records[:1])
+        self.assertIsNone(snapshot.get_tracks(dict(playlists[0], lastModifiedTimestamp='2')))
+
+    def test_user_playlist_contents_fetched_once(self):
+        for playlist in self.data:
+            playlist.pop('shareToken', None)
+        self.data.append(dict(self.data[0], id='second_id', name='Second Playlist'))
+        library = self.get_library()
+        with patch.object(Mobileclient, 'get_all_user_playlist_contents',
+                          return_value=self.data) as get_contents:
+            playlists = library.find_playlists(['Fake Playlist', 'Second Playlist'])
+        get_contents.assert_called_once_with()
+        self.assertEqual([playlist['tracks'] for playlist in playlists], [self.records, self.records])
+
+    def test_failed_shared_fetch_falls_back_to_user_playlists(self):
+        for failure in ({'side_effect': IndexError('list index out of range')}, {'return_value': []}):
+            with patch.object(Mobileclient, 'get_shared_playlist_contents', **failure), \
+                    patch.object(Mobileclient, 'get_all_user_playlist_contents',
+                                 return_value=self.data) as get_contents:
+                playlist = self.get_library().find_playlist('Fake Playlist')
+            get_contents.assert_called_once_with()
+            self.assertEqual(playlist['tracks'], self.records)
+
+
+class TestLibraryIndex(unittest.TestCase):
+    def setUp(self):
+        names = ['Road Trip 2', 'Road Trip', 'road trip', 'Chill (Cached)', 'Chill']
+        playlists = [{'name': name, 'id': 'id_%d' % index, 'tracks': []}
+                     for index, name in enumerate(names)]
+        with patch.object(Mobileclient, 'get_all_playlists', return_value=playlists):
+            self.library = Library(Mobileclient())
+
+    def assertFound(self, playlist_name, expected_id):
+        self.assertEqual(self.library.find_playlist(playlist_name)['id'], expected_id)
+
+    def test_exact_match_preferred(self):
+        self.assertFound('Road Trip', 'id_1')
+        self.assertFound('road trip', 'id_2')
+        self.assertFound('Chill', 'id_4')
+
+    def test_case_insensitive_match(self):
+        self.assertFound('ROAD TRIP', 'id_1')
+
+    def test_prefix_match(self):
+        self.assertFound('road', 'id_0')
+        self.assertFound('chi', 'id_3')
+
+    def test_regex_match(self):
+        self.assertFound('.*cached', 'id_3')
+        self.assertFound('Road Trip \\d', 'id_0')
+        with self.assertRaises(PlaylistNotFoundException):
+            self.library.find_playlist('.*missing')
+
+    def test_find_playlists(self):
+        self.assertEqual([playlist['id'] for playlist in
+                          self.library.find_playlists(['Chill', 'ROAD TRIP'])], ['id_4', 'id_1'])
+
+    def test_created_playlist_indexed(self):
+        with patch.object(Mobileclient, 'create_playlist', return_value='new_id'):
+            self.library.find_or_create_playlist('New Playlist')
+        self.assertEqual(self.library.match_playlist('new playlist'), 5)
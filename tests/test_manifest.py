@@ -0,0 +1,76 @@
+# -*- coding: utf8 -*-
+import os
+import sys
+import unittest
+from tempfile import mkdtemp
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.manifest import Manifest
+finally:
+    sys.path = PATH
+
+
+class TestManifest(unittest.TestCase):
+    """Test Manifest helper class."""
+    def setUp(self):
+        self.out_dir = mkdtemp()
+        self.manifest_path = os.path.join(self.out_dir, 'manifest.sqlite3')
+        self.manifest = Manifest(self.manifest_path)
+        self.track_path = os.path.join(self.out_dir, 'track.mp3')
+        with open(self.track_path, 'wb') as track_file:
+            track_file.write(b'audio')
+
+    def tearDown(self):
+        self.manifest.close()
+
+    def test_record(self):
+        self.assertFalse(self.manifest.is_cached('track_id', 1))
+        self.manifest.record('track_id', self.track_path, 1)
+        record = self.manifest.get('track_id')
+        self.assertEqual(record['path'], self.track_path)
+        self.assertEqual(record['size'], 5)
+        self.assertEqual(record['sha1'], 'a06a492959ce12b3f0292406ec84177d07ae19b1')
+        self.assertTrue(self.manifest.is_cached('track_id', 1))
+
+    def test_record_given_digest(self):
+        self.manifest.record('track_id', self.track_path, 1, sha1='digest')
+        self.assertEqual(self.manifest.get('track_id')['sha1'], 'digest')
+
+    def test_persists(self):
+        self.manifest.record('track_id', self.track_path, 1)
+        self.manifest.close()
+        self.manifest = Manifest(self.manifest_path)
+        self.assertTrue(self.manifest.is_cached('track_id', 1))
+
+    def test_stale_tag_version(self):
+        self.manifest.record('track_id', self.track_path, 1)
+        self.assertFalse(self.manifest.is_cached('track_id', 2))
+
+    def test_missing_or_changed_file(self):
+        self.manifest.record('track_id', self.track_path, 1)
+        with open(self.track_path, 'ab') as track_file:
+            track_file.write(b'truncated download')
+        self.assertFalse(self.manifest.is_cached('track_id', 1))
+        os.remove(self.track_path)
+        self.assertFalse(self.manifest.is_cached('track_id', 1))
+
+    def test_merge(self):
+        other = Manifest(os.path.join(self.out_dir, 'other.sqlite3'))
+        other.record('other_id', self.track_path, 1, track={'title': 'Other'})
+        other.close()
+        self.manifest.record('track_id', self.track_path, 1)
+        self.assertEqual(self.manifest.merge(other.path), 1)
+        self.assertTrue(self.manifest.is_cached('other_id', 1))
+        self.assertEqual(self.manifest.get('other_id')['track'], {'title': 'Other'})
+        self.assertEqual(self.manifest.merge(os.path.join(self.out_dir, 'missing.sqlite3')), 0)
+
+    def test_track_metadata(self):
+        self.manifest.record('track_id', self.track_path, 1, track={'title': 'Title'})
+        self.manifest.record('other_id', self.track_path, 1)
+        records = {record['track_id']: record for record in self.manifest.iter_records()}
+        self.assertEqual(records['track_id']['track'], {'title': 'Title'})
+        self.assertIsNone(records['other_id']['track'])
@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+import json
+import os
+import sys
+import unittest
+from tempfile import mkdtemp
+
+from . import REPO_ROOT, FakeClock
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.metrics import Metrics, percentile
+finally:
+    sys.path = PATH
+
+
+class TestMetrics(unittest.TestCase):
+    """Test Metrics helper class."""
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 51)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_timer_records_failures(self):
+        clock = FakeClock()
+        self.metrics = Metrics(clock=clock)
+        with self.metrics.timer('download'):
+            clock.now += 1.5
+        with self.assertRaises(IOError):
+            with self.metrics.timer('download'):
+                clock.now += 0.5
+                raise IOError("download failed")
+
+        stage = self.metrics.summary()['stages']['download']
+        self.assertEqual(stage['count'], 2)
+        self.assertEqual(stage['total'], 2.0)
+        self.assertEqual(stage['max'], 1.5)
+        self.assertEqual(stage['p99'], 1.5)
+
+    def test_counters(self):
+        self.metrics.count('bytes', 100)
+        self.metrics.count('bytes', 50)
+        self.metrics.count('failures', exception='IOError')
+        self.metrics.count('failures', exception='IOError')
+        self.metrics.count('failures', exception='CallFailure')
+        self.assertEqual(self.metrics.summary()['counters'], {
+            'bytes': 150,
+            'failures{exception="CallFailure"}': 1,
+            'failures{exception="IOError"}': 2,
+        })
+
+    def test_prometheus(self):
+        self.metrics.observe('download', 0.5)
+        self.metrics.count('failures', exception='IOError')
+        lines = self.metrics.to_prometheus().splitlines()
+        self.assertIn('gpm_cache_stage_seconds{stage="download",quantile="0.5"} 0.5', lines)
+        self.assertIn('gpm_cache_stage_seconds_count{stage="download"} 1', lines)
+        self.assertIn('# TYPE gpm_cache_failures_total counter', lines)
+        self.assertIn('gpm_cache_failures_total{exception="IOError"} 1', lines)
+
+    def test_write_files(self):
+        out_dir = mkdtemp()
+        self.metrics.count('tracks')
+        self.metrics.write_json(os.path.join(out_dir, 'metrics.json'))
+        self.metrics.write_prometheus(os.path.join(out_dir, 'gpm_cache.prom'))
+        with open(os.path.join(out_dir, 'metrics.json')) as metrics_file:
+            self.assertEqual(json.load(metrics_file)['counters'], {'tracks': 1})
+        with open(os.path.join(out_dir, 'gpm_cache.prom')) as metrics_file:
+            self.assertIn('gpm_cache_tracks_total 1', metrics_file.read())
@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+import io
+import json
+import os
+import socket
+import sys
+import unittest
+from argparse import ArgumentTypeError
+from tempfile import mkdtemp
+
+from . import REPO_ROOT, FakeClock
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.progress import Progress, ProgressReporter, format_duration, parse_udp_address
+finally:
+    sys.path = PATH
+
+
+class FakeTTY(io.StringIO):
+    def isatty(self):
+        return True
+
+
+class TestProgress(unittest.TestCase):
+    """Test Progress helper class."""
+    def setUp(self):
+        self.clock = FakeClock(100.0)
+        self.progress = Progress(total=10, window=10, clock=self.clock)
+
+    def test_counts_and_eta(self):
+        self.clock.now += 20
+        self.progress.track_done()
+        self.progress.track_done(success=False)
+        status = self.progress.status()
+        self.assertEqual(status['completed'], 1)
+        self.assertEqual(status['failed'], 1)
+        self.assertEqual(status['remaining'], 8)
+        self.assertEqual(status['eta'], 80)
+
+    def test_no_eta_before_first_track(self):
+        self.assertIsNone(self.progress.status()['eta'])
+        self.assertEqual(format_duration(None), '?')
+        self.assertEqual(format_duration(3725), '1:02:05')
+
+    def test_rolling_bytes_per_sec(self):
+        for _ in range(20):
+            self.clock.now += 1
+            self.progress.add_bytes(1000)
+        self.progress.add_bytes(1000)
+        status = self.progress.status()
+        self.assertEqual(status['bytes'], 21000)
+        self.assertEqual(status['bytes_per_sec'], 1100)
+        self.assertLessEqual(len(self.progress._buckets), 10)
+
+
+class TestProgressReporter(unittest.TestCase):
+    """Test ProgressReporter helper class."""
+    def setUp(self):
+        self.progress = Progress(total=120)
+        self.progress.track_done()
+
+    def test_renders_to_tty_only(self):
+        stream = FakeTTY()
+        reporter = ProgressReporter(self.progress, interval=0, stream=stream)
+        reporter.start()
+        reporter.close()
+        self.assertTrue(stream.getvalue().startswith("\r[  1/120] 0 failed, 119 left, "))
+        self.assertTrue(stream.getvalue().endswith("\n"))
+
+        stream = io.StringIO()
+        ProgressReporter(self.progress, stream=stream).close()
+        self.assertEqual(stream.getvalue(), "")
+
+    def test_status_file(self):
+        status_path = os.path.join(mkdtemp(), 'progress.json')
+        with ProgressReporter(self.progress, interval=0.01, status_path=status_path):
+            pass
+        with open(status_path) as status_file:
+            self.assertEqual(json.load(status_file)['remaining'], 119)
+
+    def test_status_datagram(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        try:
+            ProgressReporter(self.progress, udp_address=receiver.getsockname()).close()
+            self.assertEqual(json.loads(receiver.recv(65536).decode('utf-8'))['completed'], 1)
+        finally:
+            receiver.close()
+
+    def test_parse_udp_address(self):
+        self.assertEqual(parse_udp_address('dashboard:9999'), ('dashboard', 9999))
+        self.assertEqual(parse_udp_address(':9999'), ('localhost', 9999))
+        for value in ('dashboard', 'dashboard:port', 'dashboard:0', 'dashboard:70000'):
+            with self.assertRaises(ArgumentTypeError):
+                parse_udp_address(value)
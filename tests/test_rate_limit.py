@@ -0,0 +1,60 @@
+# -*- coding: utf8 -*-
+import sys
+import unittest
+
+from . import REPO_ROOT, FakeClock
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.rate_limit import ART, STREAM, RateLimiter, TokenBucket
+finally:
+    sys.path = PATH
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test TokenBucket helper class."""
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_spaces_grants(self):
+        bucket = TokenBucket(0.1, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 10)
+        self.assertEqual(bucket.acquire(), 10)
+        self.assertEqual(self.clock.now, 20)
+
+    def test_elapsed_time_counts(self):
+        bucket = TokenBucket(0.1, clock=self.clock, sleep=self.clock.sleep)
+        bucket.acquire()
+        self.clock.now += 7
+        self.assertAlmostEqual(bucket.acquire(), 3)
+        self.clock.now += 30
+        self.assertEqual(bucket.acquire(), 0)
+
+    def test_burst(self):
+        bucket = TokenBucket(1, capacity=3, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 1)
+        self.clock.now += 100
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 1)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(None, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test RateLimiter helper class."""
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_endpoints_are_independent(self):
+        limiter = RateLimiter(0.1, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(limiter.wait(STREAM), 0)
+        self.assertEqual(limiter.wait(ART), 0)
+        self.assertEqual(limiter.wait(STREAM), 10)
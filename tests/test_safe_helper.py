@@ -33,3 +33,16 @@ class TestSafeHelpers(unittest.TestCase):
     def test_safe_filename(self):
         response = to_safe_filename(u"hellö#my~baby")
         self.assertEqual(response, "hellmybaby")
+
+    def test_safe_print_every_byte(self):
+        response = to_safe_print(bytes(bytearray(range(0x100))))
+        expected = u"".join(
+            chr(c) if c < 0x7f else "\\x%02x" % (c, ) for c in range(0x100)
+        )
+        self.assertEqual(response, expected)
+
+    def test_safe_filename_unicode(self):
+        self.assertEqual(to_safe_filename(u"Sigur Rós - Ágætis byrjun "), "Sigur Rs  gtis byrjun")
+        self.assertEqual(to_safe_filename(u"坂本龍一"), "")
+        self.assertEqual(to_safe_filename(b"\x80abc"), "x80abc")
+        self.assertEqual(to_safe_filename(123), "123")
@@ -0,0 +1,50 @@
+# -*- coding: utf8 -*-
+import sys
+import unittest
+
+import requests
+from six import MovedModule, add_move
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.core import get_parser_args
+    from gpm_cache.session import PooledSession, get_default_session
+finally:
+    sys.path = PATH
+
+try:
+    add_move(MovedModule('mock', 'mock', 'unittest.mock'))
+    from six.moves import mock  # noqa: W0611
+finally:
+    from mock import patch
+
+
+class TestPooledSession(unittest.TestCase):
+    """Test PooledSession helper class."""
+    def get_parser_args(self, *extra):
+        return get_parser_args(['--email', 'email', '--device-id', 'devid', '--playlist', 'plist']
+                               + list(extra))
+
+    def test_pool_size(self):
+        session = PooledSession.from_parser_args(self.get_parser_args('--workers', '16'))
+        self.assertEqual(session.get_adapter('https://example.com')._pool_maxsize, 32)
+        session = PooledSession.from_parser_args(self.get_parser_args('--pool-size', '3'))
+        self.assertEqual(session.get_adapter('http://example.com')._pool_maxsize, 3)
+
+    def test_default_timeout(self):
+        session = PooledSession(timeout=5)
+        with patch.object(requests.Session, 'request') as mock_request:
+            session.get('http://example.com')
+            session.get('http://example.com', timeout=1)
+        self.assertEqual([call[1]['timeout'] for call in mock_request.call_args_list], [5, 1])
+
+    def test_keep_alive(self):
+        self.assertNotIn('close', PooledSession().headers.get('Connection', ''))
+        session = PooledSession.from_parser_args(self.get_parser_args('--no-keep-alive'))
+        self.assertEqual(session.headers['Connection'], 'close')
+
+    def test_default_session_is_shared(self):
+        self.assertIs(get_default_session(), get_default_session())
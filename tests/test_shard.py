@@ -0,0 +1,122 @@
+# -*- coding: utf8 -*-
+import os
+import sys
+import unittest
+from argparse import ArgumentTypeError
+from tempfile import mkdtemp
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.exceptions import IncompleteShardsException
+    from gpm_cache.manifest import Manifest
+    from gpm_cache.shard import (ClaimStore, get_claims_root, get_manifest_path, get_summary_path, merge_shards,
+                                 parse_shard, shard_of, write_summary)
+finally:
+    sys.path = PATH
+
+
+class TestSharding(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        for value in ('4/4', '-1/4', '1', 'a/b'):
+            with self.assertRaises(ArgumentTypeError):
+                parse_shard(value)
+
+    def test_shard_of_is_stable_and_spread(self):
+        track_ids = ['Ttrack%d' % index for index in range(400)]
+        shards = [shard_of(track_id, 4) for track_id in track_ids]
+        self.assertEqual(shards, [shard_of(track_id, 4) for track_id in track_ids])
+        for index in range(4):
+            self.assertGreater(shards.count(index), 50)
+
+
+class TestClaimStore(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = mkdtemp()
+        self.now = 1000.0
+        self.claims = ClaimStore(self.out_dir, 'host 0-of-2', ttl=60, clock=lambda: self.now)
+        self.other = ClaimStore(self.out_dir, 'host 1-of-2', ttl=60, clock=lambda: self.now)
+
+    def test_claim_is_exclusive(self):
+        self.assertTrue(self.claims.claim('Ttrack'))
+        self.assertFalse(self.other.claim('Ttrack'))
+        self.assertTrue(self.claims.claim('Ttrack'))
+
+    def test_released_claim_can_be_taken(self):
+        self.claims.claim('Ttrack')
+        self.claims.release_all()
+        self.assertFalse(os.path.exists(self.claims.get_claim_path('Ttrack')))
+        self.assertTrue(self.other.claim('Ttrack'))
+
+    def test_completed_claim_is_kept(self):
+        self.claims.claim('Tdone')
+        self.claims.complete('Tdone')
+        self.claims.claim('Tfailed')
+        self.claims.release_all()
+        self.now += 3600
+        self.assertFalse(self.other.claim('Tdone'))
+        self.assertTrue(self.other.claim('Tfailed'))
+
+    def test_expired_claim_is_broken(self):
+        self.claims.claim('Ttrack')
+        claim_path = self.claims.get_claim_path('Ttrack')
+        os.utime(claim_path, (self.now - 120, self.now - 120))
+        self.assertTrue(self.other.claim('Ttrack'))
+        self.assertEqual(ClaimStore.get_owner(claim_path), 'host 1-of-2')
+        # the broken claim is no longer this owner's to release
+        self.claims.release('Ttrack')
+        self.assertTrue(os.path.exists(claim_path))
+
+    def test_renewed_claim_is_put_back(self):
+        self.claims.claim('Ttrack')
+        claim_path = self.claims.get_claim_path('Ttrack')
+        os.utime(claim_path, (self.now - 120, self.now - 120))
+        slower = ClaimStore(self.out_dir, 'other 0-of-3', ttl=60, clock=lambda: self.now)
+        # both see the expired claim, but the other shard breaks it and claims the track first
+        self.assertTrue(self.other.claim('Ttrack'))
+        slower._break(claim_path, 'host 0-of-2')
+        self.assertEqual(ClaimStore.get_owner(claim_path), 'host 1-of-2')
+        self.assertFalse(slower.claim('Ttrack'))
+        self.assertEqual(os.listdir(os.path.dirname(claim_path)), [os.path.basename(claim_path)])
+
+
+class TestMergeShards(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = mkdtemp()
+        self.track_path = os.path.join(self.out_dir, 'track.mp3')
+        with open(self.track_path, 'wb') as track_file:
+            track_file.write(b'audio')
+        self.manifest = Manifest(os.path.join(self.out_dir, 'manifest.sqlite3'))
+
+    def tearDown(self):
+        self.manifest.close()
+
+    def finish_shard(self, index, track_id):
+        shard_manifest = Manifest(get_manifest_path(self.out_dir, index, 2))
+        shard_manifest.record(track_id, self.track_path, 1)
+        shard_manifest.close()
+        write_summary(self.out_dir, index, 2, failed_tracks=[])
+
+    def test_unfinished_shard(self):
+        self.finish_shard(0, 'Tzero')
+        with self.assertRaises(IncompleteShardsException):
+            merge_shards(self.manifest, self.out_dir, 2)
+        self.assertFalse(self.manifest.is_cached('Tzero', 1))
+
+    def test_merge(self):
+        self.finish_shard(0, 'Tzero')
+        self.finish_shard(1, 'Tone')
+        summaries = merge_shards(self.manifest, self.out_dir, 2)
+        self.assertEqual([summary['shard'] for summary in summaries], ['0-of-2', '1-of-2'])
+        self.assertTrue(self.manifest.is_cached('Tzero', 1))
+        self.assertTrue(self.manifest.is_cached('Tone', 1))
+        self.assertFalse(os.path.exists(get_summary_path(self.out_dir, 0, 2)))
+        self.assertFalse(os.path.exists(get_manifest_path(self.out_dir, 1, 2)))
+        self.assertFalse(os.path.exists(get_claims_root(self.out_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
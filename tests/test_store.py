@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*-
+import errno
+import os
+import sys
+import unittest
+from tempfile import mkdtemp
+
+from six import MovedModule, add_move
+
+from . import REPO_ROOT
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.store import TrackStore, makedirs
+finally:
+    sys.path = PATH
+
+try:
+    add_move(MovedModule('mock', 'mock', 'unittest.mock'))
+    from six.moves import mock  # noqa: W0611
+finally:
+    from mock import patch
+
+
+class TestTrackStore(unittest.TestCase):
+    """Test TrackStore helper class."""
+    def setUp(self):
+        self.out_dir = mkdtemp()
+        self.store = TrackStore(self.out_dir)
+        self.blob_path = self.store.get_blob_path('Ttrack')
+        os.makedirs(os.path.dirname(self.blob_path))
+        with open(self.blob_path, 'wb') as blob_file:
+            blob_file.write(b'audio')
+        self.view_path = os.path.join(self.out_dir, 'Artist', 'Album', 'track.mp3')
+
+    def test_blob_path_in_store(self):
+        self.assertTrue(self.blob_path.startswith(self.store.root))
+        self.assertEqual(self.blob_path, self.store.get_blob_path('Ttrack'))
+
+    def test_hard_link(self):
+        self.store.link_view(self.blob_path, self.view_path)
+        self.assertTrue(os.path.samefile(self.blob_path, self.view_path))
+        self.assertFalse(os.path.islink(self.view_path))
+        self.assertEqual(os.stat(self.blob_path).st_nlink, 2)
+
+    def test_replaces_other_file(self):
+        os.makedirs(os.path.dirname(self.view_path))
+        with open(self.view_path, 'wb') as view_file:
+            view_file.write(b'old download')
+        self.store.link_view(self.blob_path, self.view_path)
+        self.assertTrue(os.path.samefile(self.blob_path, self.view_path))
+
+    def test_makedirs_once(self):
+        dirname = os.path.join(self.out_dir, 'Artist', 'Album')
+        with patch.object(os, 'makedirs') as mock_makedirs:
+            self.assertEqual(makedirs(dirname), dirname)
+            makedirs(dirname)
+        mock_makedirs.assert_called_once_with(dirname, exist_ok=True)
+
+    def test_symlink_fallback(self):
+        with patch.object(os, 'link', side_effect=OSError(errno.EPERM, 'not permitted')):
+            self.store.link_view(self.blob_path, self.view_path)
+        self.assertTrue(os.path.islink(self.view_path))
+        self.assertTrue(os.path.samefile(self.blob_path, self.view_path))
@@ -0,0 +1,58 @@
+# -*- coding: utf8 -*-
+import json
+import os
+import shutil
+import sys
+import unittest
+from tempfile import mkdtemp
+
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3
+
+from . import REPO_ROOT, TEST_DATA_DIR
+
+try:
+    PATH = sys.path[:]
+    sys.path.insert(1, REPO_ROOT)
+    from gpm_cache.core import save_meta
+    from gpm_cache.tagging import build_id3, read_album_art
+    from gpm_cache.track_info import TrackInfo
+finally:
+    sys.path = PATH
+
+
+class TestTagging(unittest.TestCase):
+    """Test the tagging helpers."""
+    def setUp(self):
+        with open(os.path.join(TEST_DATA_DIR, 'track_info.json')) as json_fp:
+            self.track_info = json.load(json_fp)
+        self.info_obj = TrackInfo(track_id=u'T6zn3up2um24dxoggvac6obj7ay',
+                                  track_info=self.track_info)
+        self.out_dir = mkdtemp()
+        self.audio_dst = os.path.join(self.out_dir, 'test.mp3')
+        shutil.copy(os.path.join(TEST_DATA_DIR, 'file_example_MP3_700KB.mp3'), self.audio_dst)
+        self.art_src = os.path.join(TEST_DATA_DIR, 'SampleJPGImage_50kbmb.jpg')
+
+    def test_build_id3(self):
+        tags = build_id3(self.info_obj, b'cover')
+        self.assertEqual(tags['TIT2'].text, ['Southpaw'])
+        self.assertEqual(tags['TPE2'].text, ['Moonbase Commander'])
+        self.assertEqual(tags['APIC:Cover'].data, b'cover')
+
+    def test_retag_does_not_move_audio(self):
+        save_meta(self.audio_dst, self.info_obj, self.art_src)
+        tagged_size = os.path.getsize(self.audio_dst)
+
+        self.track_info['title'] = 'Southpaw (Remastered)'
+        save_meta(self.audio_dst, TrackInfo(self.info_obj.track_id, self.track_info), self.art_src)
+
+        self.assertEqual(os.path.getsize(self.audio_dst), tagged_size)
+        self.assertEqual(EasyID3(self.audio_dst)['title'], ['Southpaw (Remastered)'])
+        self.assertEqual(len(ID3(self.audio_dst).getall('APIC')), 1)
+
+    def test_read_album_art_cached(self):
+        read_album_art.cache_clear()
+        first = read_album_art(self.art_src)
+        second = read_album_art(self.art_src)
+        self.assertIs(first, second)
+        self.assertEqual(read_album_art.cache_info().hits, 1)
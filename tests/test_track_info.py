@@ -37,3 +37,29 @@ class TestTrackInfo(unittest.TestCase):
         self.assertEqual(info_obj.filing_album, 'Southpaw EP [2015]')
         self.assertEqual(info_obj.filing_artist, 'Moonbase Commander')
         self.assertEqual(info_obj.filing_title, '01:01 - Southpaw')
+
+    def test_drops_raw_dict(self):
+        info_obj = TrackInfo(track_id=u'T6zn3up2um24dxoggvac6obj7ay', track_info=self.track_info)
+
+        self.assertFalse(hasattr(info_obj, '__dict__'))
+        self.assertEqual(info_obj.album_id, self.track_info['albumId'])
+        self.assertEqual(info_obj.album_art_url, self.track_info['albumArtRef'][0]['url'])
+        self.assertNotIn('artistArtRef', info_obj.to_dict())
+        self.assertEqual(TrackInfo(info_obj.track_id, info_obj.to_dict()), info_obj)
+
+    def test_immutable(self):
+        info_obj = TrackInfo(track_id=u'T6zn3up2um24dxoggvac6obj7ay', track_info=self.track_info)
+
+        with self.assertRaises(AttributeError):
+            info_obj.filing_title = 'title'
+        info_obj.id3_meta['title'] = 'title'
+        self.assertEqual(info_obj.id3_meta['title'], 'Southpaw')
+
+    def test_missing_info(self):
+        info_obj = TrackInfo(track_id=u'Tmissing', track_info=None)
+
+        self.assertEqual(dict(info_obj.id3_meta), {})
+        self.assertIsNone(info_obj.album_id)
+        self.assertIsNone(info_obj.album_art_url)
+        self.assertEqual(info_obj.filing_artist, 'Unknown Artist')
+        self.assertEqual(info_obj.filing_title, 'Tmissing')